@@ -0,0 +1,239 @@
+"""
+Admission Control
+Limits how many requests of each endpoint run at once, by cost class. A request
+over the limit waits in a short bounded queue for a slot; when the queue is
+full, or the wait runs out, it is shed immediately with 503 and Retry-After
+instead of tying up a worker thread. Cheap endpoints (health, filters, debug)
+are never limited, so their latency stays flat while expensive ones queue.
+
+Classes are configured as ADMISSION_<CLASS>=concurrency:queue:timeout, for
+example ADMISSION_EXPENSIVE=2:4:1.0.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+# concurrency: requests running at once per endpoint, queue: requests allowed to
+# wait for a slot, timeout: seconds a queued request waits before it is shed
+CostClass = namedtuple('CostClass', 'concurrency queue timeout')
+
+CHEAP = 'cheap'
+STANDARD = 'standard'
+EXPENSIVE = 'expensive'
+
+
+def _class_from_env(name, default):
+    value = os.environ.get(f'ADMISSION_{name.upper()}')
+    if not value:
+        return default
+    concurrency, queue, timeout = value.split(':')
+    return CostClass(int(concurrency), int(queue), float(timeout))
+
+
+DEFAULT_CLASSES = {
+    STANDARD: _class_from_env(STANDARD, CostClass(concurrency=8, queue=16, timeout=2.0)),
+    EXPENSIVE: _class_from_env(EXPENSIVE, CostClass(concurrency=2, queue=4, timeout=1.0)),
+}
+
+# Filters that keep /api/search and /api/export from scanning every row
+NARROWING_FILTERS = ('candidate', 'constituency', 'state', 'party')
+
+
+def _search_cost(args):
+    return STANDARD if any(args.get(name) for name in NARROWING_FILTERS) else EXPENSIVE
+
+
+def _year_cost(args):
+    # Without a year these aggregate every election
+    return STANDARD if args.get('year') else EXPENSIVE
+
+
+# Route (or route prefix ending in '/') -> cost class, or fn(args) -> cost class.
+# Routes not listed are standard.
+DEFAULT_COSTS = {
+    '/api/health': CHEAP,
+    '/api/filters/': CHEAP,
+    '/api/debug/': CHEAP,
+    '/api/suggest': CHEAP,
+    # Only dispatches its parts, which are admitted one by one
+    '/api/dashboard/stream': CHEAP,
+    '/api/search': _search_cost,
+    '/api/export': EXPENSIVE,
+    '/api/party-seat-share': _year_cost,
+    '/api/state-turnout': _year_cost,
+    '/api/top-parties-vote-share': _year_cost,
+    '/api/margin-distribution': _year_cost,
+    '/api/analytics/narrowest-margins': _year_cost,
+    '/api/analytics/win-correlation': _year_cost,
+    '/api/gender-representation': EXPENSIVE,
+    '/api/analytics/seat-change': EXPENSIVE,
+    '/api/analytics/change-matrix': EXPENSIVE,
+    '/api/analytics/swing': EXPENSIVE,
+    '/api/analytics/percentiles': EXPENSIVE,
+    '/api/analytics/breakdown': EXPENSIVE,
+    '/api/analytics/national-vs-regional': EXPENSIVE,
+    '/api/analytics/education-correlation': EXPENSIVE,
+}
+
+
+class Overloaded(Exception):
+    def __init__(self, route, cost, retry_after):
+        super().__init__(f'{route} is overloaded, retry in {retry_after}s')
+        self.route = route
+        self.cost = cost
+        self.retry_after = retry_after
+
+
+class _Limiter:
+    """Concurrency slots of one endpoint and cost class, with a bounded wait queue"""
+
+    def __init__(self, cost_class):
+        self.cost_class = cost_class
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        limit = self.cost_class
+        with self.condition:
+            if self.active < limit.concurrency:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= limit.queue:
+                self.shed += 1
+                return False
+
+            self.waiting += 1
+            self.queued += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            deadline = time.monotonic() + limit.timeout
+            try:
+                while self.active >= limit.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        self.shed += 1
+                        return False
+                    self.condition.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'concurrency': self.cost_class.concurrency,
+                'queue_limit': self.cost_class.queue,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'max_queue_depth': self.max_waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'timed_out': self.timed_out,
+            }
+
+
+class AdmissionControl:
+    def __init__(self, classes=None, costs=None):
+        self.classes = DEFAULT_CLASSES if classes is None else classes
+        self.costs = DEFAULT_COSTS if costs is None else costs
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def cost(self, path, args):
+        rule = self.costs.get(path)
+        if rule is None:
+            rule = next((cost for prefix, cost in self.costs.items()
+                         if prefix.endswith('/') and path.startswith(prefix)), STANDARD)
+        return rule(args) if callable(rule) else rule
+
+    def _limiter(self, path, cost):
+        key = (path, cost)
+        with self.lock:
+            limiter = self.limiters.get(key)
+            if limiter is None:
+                limiter = self.limiters[key] = _Limiter(self.classes[cost])
+            return limiter
+
+    def admit(self, path, args):
+        """Release callback for an admitted request; raises Overloaded if it is shed"""
+        cost = self.cost(path, args)
+        if cost not in self.classes:
+            # Unlimited class
+            return lambda: None
+        limiter = self._limiter(path, cost)
+        if not limiter.acquire():
+            raise Overloaded(path, cost, max(1, math.ceil(limiter.cost_class.timeout)))
+        return limiter.release
+
+    def stats(self):
+        with self.lock:
+            limiters = sorted(self.limiters.items())
+        routes = {}
+        for (path, cost), limiter in limiters:
+            routes.setdefault(path, {})[cost] = limiter.stats()
+        entries = [entry for costs in routes.values() for entry in costs.values()]
+        return {
+            'classes': {name: cost_class._asdict() for name, cost_class in self.classes.items()},
+            'active': sum(entry['active'] for entry in entries),
+            'queue_depth': sum(entry['queue_depth'] for entry in entries),
+            'admitted': sum(entry['admitted'] for entry in entries),
+            'shed': sum(entry['shed'] for entry in entries),
+            'routes': routes,
+        }
+
+
+def admitted(view, control):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        release = control.admit(request.path, request.args)
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            release()
+            raise
+        if response.is_streamed:
+            # Keep the slot until the body has been sent
+            response.call_on_close(release)
+        else:
+            release()
+        return response
+
+    return wrapper
+
+
+def install(app, control):
+    """Limit every GET /api view; call after all routes are registered and before
+    singleflight.install, so coalesced followers do not take slots of their own"""
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/api/') and 'GET' in rule.methods:
+            app.view_functions[rule.endpoint] = admitted(app.view_functions[rule.endpoint], control)
+
+    @app.errorhandler(Overloaded)
+    def overloaded(e):
+        response = jsonify({'error': str(e), 'cost': e.cost, 'retry_after': e.retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+
+    return control
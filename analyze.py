@@ -7,6 +7,9 @@ import sqlite3
 import json
 from datetime import datetime
 
+import correlation
+import partitions
+
 DB_PATH = 'election_data2.db'
 
 def get_db_connection():
@@ -21,20 +24,21 @@ def question_a():
     print("="*80)
     
     conn = get_db_connection()
+    source = partitions.source(conn)
     
     # Get latest year within 1991-2019 range
-    cursor = conn.execute("SELECT MAX(Year) as latest_year FROM election_results WHERE Year >= 1991 AND Year <= 2019")
+    cursor = conn.execute(f"SELECT MAX(Year) as latest_year FROM {source} WHERE Year >= 1991 AND Year <= 2019")
     latest_year = cursor.fetchone()['latest_year']
     print(f"\nLatest election year (1991-2019): {latest_year}")
     
-    query = """
+    query = f"""
     SELECT 
         State_Name,
         AVG(Turnout_Percentage) as avg_turnout,
         MAX(Turnout_Percentage) as max_turnout,
         MIN(Turnout_Percentage) as min_turnout,
         COUNT(DISTINCT Constituency_Name) as constituencies
-    FROM election_results
+    FROM {source}
     WHERE Year = ? AND Year >= 1991 AND Year <= 2019
     GROUP BY State_Name
     ORDER BY avg_turnout DESC
@@ -66,11 +70,12 @@ def question_b():
     print("="*80)
     
     conn = get_db_connection()
+    source = partitions.source(conn)
     
     # Get last two years within 1991-2019 range
-    cursor = conn.execute("""
+    cursor = conn.execute(f"""
         SELECT DISTINCT Year 
-        FROM election_results 
+        FROM {source} 
         WHERE Year >= 1991 AND Year <= 2019 
         ORDER BY Year DESC 
         LIMIT 2
@@ -84,9 +89,9 @@ def question_b():
     year2, year1 = years[0], years[1]
     print(f"\nComparing elections: {year1} → {year2}")
     
-    query = """
+    query = f"""
     SELECT Party, COUNT(*) as seats
-    FROM election_results
+    FROM {source}
     WHERE Year = ? AND Year >= 1991 AND Year <= 2019 AND Position = 1
     GROUP BY Party
     """
@@ -148,15 +153,16 @@ def question_c():
     print("="*80)
     
     conn = get_db_connection()
+    source = partitions.source(conn)
     
-    query = """
+    query = f"""
     SELECT 
         COUNT(*) as total_candidates,
         SUM(CASE WHEN Sex = 'F' THEN 1 ELSE 0 END) as women_candidates,
         SUM(CASE WHEN Sex = 'M' THEN 1 ELSE 0 END) as men_candidates,
         SUM(CASE WHEN Sex = 'F' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as women_percentage,
         SUM(CASE WHEN Sex = 'M' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as men_percentage
-    FROM election_results
+    FROM {source}
     WHERE Year >= 1991 AND Year <= 2019
     """
     
@@ -164,13 +170,13 @@ def question_c():
     result = dict(cursor.fetchone())
     
     # Year-wise breakdown
-    query_yearly = """
+    query_yearly = f"""
     SELECT 
         Year,
         COUNT(*) as total_candidates,
         SUM(CASE WHEN Sex = 'F' THEN 1 ELSE 0 END) as women_candidates,
         SUM(CASE WHEN Sex = 'F' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as women_percentage
-    FROM election_results
+    FROM {source}
     WHERE Year >= 1991 AND Year <= 2019
     GROUP BY Year
     ORDER BY Year
@@ -218,8 +224,9 @@ def question_d():
     print("="*80)
     
     conn = get_db_connection()
+    source = partitions.source(conn)
     
-    query = """
+    query = f"""
     SELECT 
         Year,
         State_Name,
@@ -230,7 +237,7 @@ def question_d():
         Margin,
         Votes,
         Valid_Votes
-    FROM election_results
+    FROM {source}
     WHERE Year >= 1991 AND Year <= 2019 AND Position = 1 AND Margin_Percentage IS NOT NULL
     ORDER BY Margin_Percentage ASC
     LIMIT 20
@@ -277,15 +284,16 @@ def question_e():
     print("="*80)
     
     conn = get_db_connection()
+    source = partitions.source(conn)
     
-    query = """
+    query = f"""
     SELECT 
         Year,
         Party_Type_TCPD,
         SUM(Votes) as total_votes,
-        SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM election_results e2 WHERE e2.Year = election_results.Year AND e2.Year >= 1991 AND e2.Year <= 2019) as vote_share_percentage,
+        SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM {source} e2 WHERE e2.Year = election_results.Year AND e2.Year >= 1991 AND e2.Year <= 2019) as vote_share_percentage,
         COUNT(CASE WHEN Position = 1 THEN 1 END) as seats_won
-    FROM election_results
+    FROM {source} AS election_results
     WHERE Year >= 1991 AND Year <= 2019 AND Party_Type_TCPD IN ('National Party', 'Regional Party')
     GROUP BY Year, Party_Type_TCPD
     ORDER BY Year, Party_Type_TCPD
@@ -375,6 +383,7 @@ def question_f():
     print("="*80)
     
     conn = get_db_connection()
+    source = partitions.source(conn)
     
     # Check if education column exists
     cursor = conn.execute("PRAGMA table_info(election_results)")
@@ -386,8 +395,27 @@ def question_f():
         print("\n❌ Education data is NOT available in the dataset.")
         print("   The dataset does not contain education level information for candidates.")
         print("\n✓ ANSWER: Cannot determine correlation as education data is not available in the dataset.")
+        
+        # Fall back to the candidate attributes the dataset does have
+        attributes = correlation.compute(conn, source=source)
+        print("\nWin Rate by Candidate Attribute (all years, reference level marked *):")
+        print("-" * 80)
+        print(f"{'Attribute':<20} {'Level':<18} {'Win Rate %':>10} {'Logit Coef':>12} {'Chi-square p':>14}")
+        print("-" * 80)
+        for result in attributes:
+            pooled = result['years'][-1] if result['years'] else None
+            if not pooled:
+                continue
+            p_value = pooled['p_value']
+            for level in pooled['levels']:
+                label = level['value'] + ('*' if level['value'] == result['reference_level'] else '')
+                coef = level['logit_coefficient']
+                print(f"{result['attribute']:<20} {label:<18} {level['win_rate']:>10.2f} "
+                      f"{'' if coef is None else f'{coef:+.3f}':>12} "
+                      f"{'' if p_value is None else f'{p_value:.4f}':>14}")
+        
         conn.close()
-        return {'available': False}
+        return {'available': False, 'attributes': attributes}
     
     # If education data exists
     education_col = education_columns[0]
@@ -399,7 +427,7 @@ def question_f():
         SUM(CASE WHEN Position = 1 THEN 1 ELSE 0 END) as winners,
         SUM(CASE WHEN Position = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as win_percentage,
         AVG(Vote_Share_Percentage) as avg_vote_share
-    FROM election_results
+    FROM """ + source + """
     WHERE Year >= 1991 AND Year <= 2019 AND """ + education_col + """ IS NOT NULL
     GROUP BY """ + education_col + """
     ORDER BY win_percentage DESC
@@ -1,15 +1,43 @@
-from flask import Flask, jsonify, request, render_template_string, send_from_directory
+from flask import Flask, Response, jsonify, request, render_template_string, send_from_directory
 from flask_cors import CORS
 import sqlite3
 import os
+import sys
 import json
 
-app = Flask(__name__)
+# Static files are served by the static_files route below, not Flask's built-in one
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
 # Get base directory for file paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Shared modules live in the project root next to app.py
+sys.path.insert(0, BASE_DIR)
+import admission
+import assets
+import bitmaps
+import budgets
+import cache
+import change_matrix
+import coalitions
+import correlation
+import dashboard_stream
+import dataset
+import datasets
+import encoding
+import export
+import filters
+import jsonstream
+import memprofile
+import partitions
+import quantiles
+import singleflight
+import snapshots
+import suggest
+import swing
+import tracing
+
 # Get database path - adjust for Vercel deployment
 DB_PATH = os.path.join(BASE_DIR, 'election_data2.db')
 if not os.path.exists(DB_PATH):
@@ -17,9 +45,11 @@ if not os.path.exists(DB_PATH):
 
 def get_db_connection():
     try:
-        conn = sqlite3.connect(DB_PATH)
+        # Pooled, to the version of the dataset the request reads
+        conn = connection_pool.connect(snapshot_manager.path())
         conn.row_factory = sqlite3.Row
-        return conn
+        # Interrupted once the SQL time budget of the endpoint being served runs out
+        return budgets.attach(conn)
     except Exception as e:
         print(f"Database connection error: {e}")
         raise
@@ -37,11 +67,53 @@ def load_template():
 def static_files(filename):
     static_dir = os.path.join(BASE_DIR, 'static')
     try:
+        if filename.startswith('dist/'):
+            # Fingerprinted build output, served precompressed when the client accepts it
+            return assets.send_asset(filename[len('dist/'):], os.path.join(static_dir, 'dist'))
         return send_from_directory(static_dir, filename)
     except Exception as e:
         print(f"Error serving static file {filename}: {e}")
         return jsonify({'error': 'File not found'}), 404
 
+def reload_derived_data(version):
+    """Build the in-memory structures derived from a new database version (pinned) before it is served"""
+    suggest.reload_index(get_db_connection, version)
+    dataset.reload_store(get_db_connection, version)
+    change_matrix.reload_matrices(get_db_connection, version)
+    swing.reload_contests(get_db_connection, version)
+    quantiles.reload_sketches(get_db_connection, version)
+
+def release_derived_data(version):
+    """Drop everything derived from a database version once its last request has finished"""
+    suggest.release_index(version)
+    dataset.release_store(version)
+    change_matrix.release_matrices(version)
+    swing.release_contests(version)
+    quantiles.release_sketches(version)
+
+# Database files served by this process (DATASETS, else DB_PATH alone), each with
+# its own snapshot versions, connection pool, response cache and warmer. The
+# names below resolve to those of the dataset the request being served reads.
+registry = datasets.Registry(datasets.from_env(DB_PATH, BASE_DIR), app,
+                             on_change=[reload_derived_data], on_release=[release_derived_data])
+snapshot_manager = datasets.Current(registry, 'snapshots')
+connection_pool = datasets.Current(registry, 'pool')
+
+# Resolve fingerprinted static assets in templates
+assets.install(app)
+
+# Cache responses within each dataset's budget; its warmer precomputes everything
+# the dashboard requests
+response_cache = cache.install(app, datasets.Current(registry, 'cache'))
+
+@app.errorhandler(partitions.UnknownElectionType)
+def unknown_election_type(e):
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(coalitions.UnknownGrouping)
+def unknown_grouping(e):
+    return jsonify({'error': str(e)}), 400
+
 @app.route('/')
 def index():
     template_content = load_template()
@@ -51,6 +123,61 @@ def index():
 def health():
     return jsonify({'status': 'ok'})
 
+@app.route('/api/debug/memory', methods=['GET'])
+def memory_usage():
+    """Private vs shared resident memory of this worker and the shared column store size"""
+    store = dataset.get_store(budgets.unbudgeted(get_db_connection), snapshot_manager.version())
+    result = dataset.memory_report()
+    result['store'] = store.info()
+    return jsonify(result)
+
+@app.route('/api/debug/cache', methods=['GET'])
+def cache_stats():
+    """Response cache hit rate, evictions and bytes used per route"""
+    return jsonify(response_cache.stats())
+
+@app.route('/api/debug/coalescing', methods=['GET'])
+def coalescing_stats():
+    """How many concurrent identical requests shared one computation"""
+    return jsonify(flight.stats())
+
+@app.route('/api/debug/admission', methods=['GET'])
+def admission_stats():
+    """Concurrency, queue depth and shed requests per endpoint and cost class"""
+    return jsonify(admission_control.stats())
+
+@app.route('/api/debug/snapshots', methods=['GET'])
+def snapshot_stats():
+    """Database version being served, and retired versions still finishing requests"""
+    return jsonify(snapshot_manager.stats())
+
+@app.route('/api/debug/datasets', methods=['GET'])
+def dataset_stats():
+    """Registered datasets: open or idle, version served, cache and connection pool use"""
+    return jsonify(registry.stats())
+
+@app.route('/api/debug/memory-profile', methods=['GET'])
+def memory_profile():
+    """Peak, retained and top allocation sites per endpoint (with MEMORY_PROFILE=1)"""
+    return jsonify(memory_profiler.report())
+
+@app.route('/api/dashboard/stream', methods=['GET'])
+def dashboard_stream_parts():
+    """Stream every chart and analytics payload as soon as each one is ready (NDJSON or SSE)"""
+    year = request.args.get('year', type=int)
+    analytics = request.args.get('analytics', default='1') != '0'
+    sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    election_type = request.args.get('election_type')
+    # Rejected up front rather than as a failed part per chart
+    partitions.route(election_type)
+    
+    response = Response(dashboard_stream.stream(app, year, analytics, sse, election_type),
+                        mimetype='text/event-stream' if sse else 'application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/party-seat-share', methods=['GET'])
 def party_seat_share():
     """Get party-wise seat share per year (1991-2019 per requirements)"""
@@ -59,29 +186,31 @@ def party_seat_share():
     conn = get_db_connection()
     
     try:
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type'), year))
+        grouped = coalitions.grouped(conn, coded, request.args.get('group_by'))
         if year:
-            query = """
-            SELECT Party, COUNT(*) as seats
-            FROM election_results
+            query = f"""
+            SELECT {grouped.label} as Party, COUNT(*) as seats
+            FROM {grouped}
             WHERE Year = ? AND Year >= 1991 AND Year <= 2019 AND Position = 1
             GROUP BY Party
             ORDER BY seats DESC
             """
             cursor = conn.execute(query, (year,))
         else:
-            query = """
-            SELECT Year, Party, COUNT(*) as seats
-            FROM election_results
+            query = f"""
+            SELECT Year, {grouped.label} as Party, COUNT(*) as seats
+            FROM {grouped}
             WHERE Year >= 1991 AND Year <= 2019 AND Position = 1
             GROUP BY Year, Party
             ORDER BY Year, seats DESC
             """
             cursor = conn.execute(query)
         
-        results = [dict(row) for row in cursor.fetchall()]
-        return jsonify(results)
-    finally:
+        return jsonstream.array_response(conn, cursor)
+    except BaseException:
         conn.close()
+        raise
 
 @app.route('/api/state-turnout', methods=['GET'])
 def state_turnout():
@@ -91,38 +220,39 @@ def state_turnout():
     conn = get_db_connection()
     
     try:
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type'), year))
         if year:
-            query = """
+            query = f"""
             SELECT 
-                State_Name,
+                {coded.label('State_Name')} as State_Name,
                 AVG(Turnout_Percentage) as avg_turnout,
                 MAX(Turnout_Percentage) as max_turnout,
                 MIN(Turnout_Percentage) as min_turnout
-            FROM election_results
+            FROM {coded}
             WHERE Year = ? AND Year >= 1991 AND Year <= 2019
             GROUP BY State_Name
             ORDER BY avg_turnout DESC
             """
             cursor = conn.execute(query, (year,))
         else:
-            query = """
+            query = f"""
             SELECT 
                 Year,
-                State_Name,
+                {coded.label('State_Name')} as State_Name,
                 AVG(Turnout_Percentage) as avg_turnout,
                 MAX(Turnout_Percentage) as max_turnout,
                 MIN(Turnout_Percentage) as min_turnout
-            FROM election_results
+            FROM {coded}
             WHERE Year >= 1991 AND Year <= 2019
             GROUP BY Year, State_Name
             ORDER BY Year, avg_turnout DESC
             """
             cursor = conn.execute(query)
         
-        results = [dict(row) for row in cursor.fetchall()]
-        return jsonify(results)
-    finally:
+        return jsonstream.array_response(conn, cursor)
+    except BaseException:
         conn.close()
+        raise
 
 @app.route('/api/gender-representation', methods=['GET'])
 def gender_representation():
@@ -130,20 +260,21 @@ def gender_representation():
     conn = get_db_connection()
     
     try:
-        query = """
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type')))
+        query = f"""
         SELECT 
             Year,
-            Sex,
+            {coded.label('Sex')} as Sex,
             COUNT(*) as count,
-            COUNT(*) * 100.0 / (SELECT COUNT(*) FROM election_results e2 WHERE e2.Year = election_results.Year AND e2.Year >= 1991 AND e2.Year <= 2019) as percentage
-        FROM election_results
-        WHERE Year >= 1991 AND Year <= 2019 AND Sex IN ('M', 'F')
+            COUNT(*) * 100.0 / (SELECT COUNT(*) FROM {coded} e2 WHERE e2.Year = election_results.Year AND e2.Year >= 1991 AND e2.Year <= 2019) as percentage
+        FROM {coded} AS election_results
+        WHERE Year >= 1991 AND Year <= 2019 AND Sex IN {coded.values('Sex', 'M', 'F')}
         GROUP BY Year, Sex
         ORDER BY Year, Sex
         """
         
         cursor = conn.execute(query)
-        results = [dict(row) for row in cursor.fetchall()]
+        results = tracing.records(cursor.fetchall())
         return jsonify(results)
     finally:
         conn.close()
@@ -157,14 +288,16 @@ def top_parties_vote_share():
     conn = get_db_connection()
     
     try:
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type'), year))
+        grouped = coalitions.grouped(conn, coded, request.args.get('group_by'))
         if year:
-            query = """
+            query = f"""
             SELECT 
-                Party,
+                {grouped.label} as Party,
                 SUM(Votes) as total_votes,
-                SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM election_results WHERE Year = ? AND Year >= 1991 AND Year <= 2019) as vote_share_percentage,
+                SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM {coded} WHERE Year = ? AND Year >= 1991 AND Year <= 2019) as vote_share_percentage,
                 COUNT(CASE WHEN Position = 1 THEN 1 END) as seats_won
-            FROM election_results
+            FROM {grouped}
             WHERE Year = ? AND Year >= 1991 AND Year <= 2019
             GROUP BY Party
             ORDER BY vote_share_percentage DESC
@@ -172,13 +305,13 @@ def top_parties_vote_share():
             """
             cursor = conn.execute(query, (year, year, limit))
         else:
-            query = """
+            query = f"""
             SELECT 
-                Party,
+                {grouped.label} as Party,
                 SUM(Votes) as total_votes,
-                SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM election_results WHERE Year >= 1991 AND Year <= 2019) as vote_share_percentage,
+                SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM {coded} WHERE Year >= 1991 AND Year <= 2019) as vote_share_percentage,
                 COUNT(CASE WHEN Position = 1 THEN 1 END) as seats_won
-            FROM election_results
+            FROM {grouped}
             WHERE Year >= 1991 AND Year <= 2019
             GROUP BY Party
             ORDER BY vote_share_percentage DESC
@@ -186,7 +319,7 @@ def top_parties_vote_share():
             """
             cursor = conn.execute(query, (limit,))
         
-        results = [dict(row) for row in cursor.fetchall()]
+        results = tracing.records(cursor.fetchall())
         return jsonify(results)
     finally:
         conn.close()
@@ -199,75 +332,86 @@ def margin_distribution():
     conn = get_db_connection()
     
     try:
+        source = partitions.source(conn, request.args.get('election_type'), year)
         if year:
-            query = """
+            query = f"""
             SELECT Margin_Percentage
-            FROM election_results
+            FROM {source}
             WHERE Year = ? AND Year >= 1991 AND Year <= 2019 AND Position = 1 AND Margin_Percentage IS NOT NULL
             ORDER BY Margin_Percentage
             """
             cursor = conn.execute(query, (year,))
         else:
-            query = """
+            query = f"""
             SELECT Margin_Percentage
-            FROM election_results
+            FROM {source}
             WHERE Year >= 1991 AND Year <= 2019 AND Position = 1 AND Margin_Percentage IS NOT NULL
             ORDER BY Margin_Percentage
             """
             cursor = conn.execute(query)
         
-        results = [row['Margin_Percentage'] for row in cursor.fetchall()]
-        return jsonify(results)
-    finally:
+        return jsonstream.array_response(conn, cursor, lambda row: row['Margin_Percentage'])
+    except BaseException:
         conn.close()
+        raise
 
 @app.route('/api/search', methods=['GET'])
 def search():
     """Search by candidate or constituency (1991-2019 per requirements)"""
-    candidate = request.args.get('candidate', '')
-    constituency = request.args.get('constituency', '')
-    year = request.args.get('year', type=int)
-    state = request.args.get('state', '')
-    party = request.args.get('party', '')
-    gender = request.args.get('gender', '')
-    
     conn = get_db_connection()
     
     try:
-        query = "SELECT * FROM election_results WHERE Year >= 1991 AND Year <= 2019"
-        params = []
-        
-        if candidate:
-            query += " AND Candidate LIKE ?"
-            params.append(f'%{candidate}%')
-        
-        if constituency:
-            query += " AND Constituency_Name LIKE ?"
-            params.append(f'%{constituency}%')
-        
-        if year:
-            query += " AND Year = ?"
-            params.append(year)
-        
-        if state:
-            query += " AND State_Name = ?"
-            params.append(state)
-        
-        if party:
-            query += " AND Party = ?"
-            params.append(party)
-        
-        if gender:
-            query += " AND Sex = ?"
-            params.append(gender)
-        
-        query += " ORDER BY Year DESC, Position LIMIT 100"
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type'), request.args.get('year', type=int)))
+        where, params = filters.search_filters(request.args, coded)
+        order = 'Year DESC, Position'
+        if coded.encoded or partitions.has_catalog(conn):
+            # Rows no longer come in the original table's order, so ties are broken by the
+            # natural key and the 100 rows do not depend on the plan or the storage order
+            order += ', State_Name, Constituency_No, month, Poll_No'
+        # Filtered and sorted on the coded rows, so only the 100 returned are decoded
+        query = f"""SELECT {coded.columns(conn, 'c')} FROM (
+                       SELECT * FROM {coded} WHERE {where}
+                       ORDER BY {order} LIMIT 100) AS c"""
         
         cursor = conn.execute(query, params)
-        results = [dict(row) for row in cursor.fetchall()]
-        return jsonify(results)
-    finally:
+        return jsonstream.array_response(conn, cursor)
+    except BaseException:
         conn.close()
+        raise
+
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """Stream every matching election result as CSV, NDJSON or Parquet (1991-2019 per requirements)"""
+    fmt = request.args.get('format', default='csv')
+    
+    if fmt not in export.FORMATS:
+        return jsonify({'error': f"Unknown format '{fmt}', expected one of {list(export.FORMATS)}"}), 400
+    if fmt == 'parquet' and not export.parquet_available():
+        return jsonify({'error': 'Parquet export requires the pyarrow package'}), 400
+    
+    route = partitions.route(request.args.get('election_type'), request.args.get('year', type=int))
+    return export.export_response(get_db_connection, route, request.args, fmt,
+                                  request.headers.get('Accept-Encoding', ''))
+
+@app.route('/api/suggest', methods=['GET'])
+def suggest_names():
+    """Typeahead suggestions for candidates, constituencies and parties (1991-2019 per requirements)"""
+    q = request.args.get('q', '')
+    kind = request.args.get('kind', '')
+    limit = request.args.get('limit', default=10, type=int)
+    order = request.args.get('order', default='frequency')
+    
+    if kind and kind not in suggest.KINDS:
+        return jsonify({'error': f"Unknown kind '{kind}', expected one of {sorted(suggest.KINDS)}"}), 400
+    if order not in ('frequency', 'recency'):
+        return jsonify({'error': "order must be 'frequency' or 'recency'"}), 400
+    if not 1 <= limit <= suggest.MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {suggest.MAX_LIMIT}'}), 400
+    
+    # Served entirely from the in-memory index of the election type, SQLite is only read once to build it
+    index = suggest.get_index(budgets.unbudgeted(get_db_connection), request.args.get('election_type'),
+                              snapshot_manager.version())
+    return jsonify(index.suggest(q, kind or None, limit, order))
 
 @app.route('/api/filters/years', methods=['GET'])
 def get_years():
@@ -275,7 +419,8 @@ def get_years():
     conn = get_db_connection()
     
     try:
-        cursor = conn.execute("SELECT DISTINCT Year FROM election_results WHERE Year >= 1991 AND Year <= 2019 ORDER BY Year")
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type')))
+        cursor = conn.execute(coded.distinct('Year', 'Year >= 1991 AND Year <= 2019'))
         years = [row['Year'] for row in cursor.fetchall()]
         return jsonify(years)
     finally:
@@ -287,7 +432,8 @@ def get_states():
     conn = get_db_connection()
     
     try:
-        cursor = conn.execute("SELECT DISTINCT State_Name FROM election_results WHERE Year >= 1991 AND Year <= 2019 ORDER BY State_Name")
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type')))
+        cursor = conn.execute(coded.distinct('State_Name', 'Year >= 1991 AND Year <= 2019'))
         states = [row['State_Name'] for row in cursor.fetchall()]
         return jsonify(states)
     finally:
@@ -299,27 +445,41 @@ def get_parties():
     conn = get_db_connection()
     
     try:
-        cursor = conn.execute("SELECT DISTINCT Party FROM election_results WHERE Year >= 1991 AND Year <= 2019 AND Party IS NOT NULL ORDER BY Party")
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type')))
+        cursor = conn.execute(coded.distinct('Party', 'Year >= 1991 AND Year <= 2019'))
         parties = [row['Party'] for row in cursor.fetchall()]
         return jsonify(parties)
     finally:
         conn.close()
 
+@app.route('/api/filters/election-types', methods=['GET'])
+def get_election_types():
+    """Get the election types and the year range of each of their partitions"""
+    conn = get_db_connection()
+    
+    try:
+        return jsonify(partitions.summary(conn))
+    finally:
+        conn.close()
+
 @app.route('/api/analytics/highest-turnout-state', methods=['GET'])
 def highest_turnout_state():
     """Which state had the highest voter turnout in the latest general election (1991-2019)?"""
     conn = get_db_connection()
     
     try:
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type')))
         # Get latest year within 1991-2019 range
-        cursor = conn.execute("SELECT MAX(Year) as latest_year FROM election_results WHERE Year >= 1991 AND Year <= 2019")
+        cursor = conn.execute(f"SELECT MAX(Year) as latest_year FROM {coded} WHERE Year >= 1991 AND Year <= 2019")
         latest_year = cursor.fetchone()['latest_year']
+        if latest_year is None:
+            return jsonify({'error': 'No elections of this type in 1991-2019'})
         
-        query = """
+        query = f"""
         SELECT 
-            State_Name,
+            {coded.label('State_Name')} as State_Name,
             AVG(Turnout_Percentage) as avg_turnout
-        FROM election_results
+        FROM {coded}
         WHERE Year = ? AND Year >= 1991 AND Year <= 2019
         GROUP BY State_Name
         ORDER BY avg_turnout DESC
@@ -338,51 +498,134 @@ def seat_change():
     year1 = request.args.get('year1', type=int)
     year2 = request.args.get('year2', type=int)
     
-    conn = get_db_connection()
+    # Served from the change matrix, aggregated once for every election
+    matrix = change_matrix.get_matrix(budgets.unbudgeted(get_db_connection), request.args.get('election_type'),
+                                     request.args.get('group_by'), snapshot_manager.version())
+    
+    if not year1 or not year2:
+        # Last two years within 1991-2019 range
+        if len(matrix.years) >= 2:
+            year1, year2 = matrix.years[-2], matrix.years[-1]
+        else:
+            return jsonify({'error': 'Need at least 2 years of data'})
+    
+    return jsonify({
+        'year1': year1,
+        'year2': year2,
+        'changes': matrix.seat_change(year1, year2)[:10]  # Top 10
+    })
+
+@app.route('/api/analytics/change-matrix', methods=['GET'])
+def change_matrix_slice():
+    """Seats and vote share of each party in every election (1991-2019) and their changes
+    between pairs of elections, nationally or for one state, optionally broken down by state"""
+    state = request.args.get('state') or None
+    parties = [party.strip() for party in request.args.get('party', '').split(',') if party.strip()]
+    pairs = request.args.get('pairs', 'consecutive')
+    year1 = request.args.get('year1', type=int)
+    year2 = request.args.get('year2', type=int)
+    limit = request.args.get('limit', 10, type=int)
+    by_state = request.args.get('by_state', '').lower() in ('1', 'true', 'yes')
+    
+    if pairs not in change_matrix.PAIRS:
+        return jsonify({'error': "pairs must be 'consecutive' or 'all'"}), 400
+    
+    matrix = change_matrix.get_matrix(budgets.unbudgeted(get_db_connection), request.args.get('election_type'),
+                                     request.args.get('group_by'), snapshot_manager.version())
+    if state is not None and state not in matrix.states:
+        return jsonify({'error': f'Unknown state: {state}'}), 400
+    
+    return jsonify(matrix.series(state, parties, pairs, year1, year2, limit, by_state))
+
+@app.route('/api/analytics/swing', methods=['GET'])
+def swing_simulation():
+    """Seats each party would win in a base year (1991-2019) if vote shares swung as given,
+    or their distribution over randomly drawn swings in Monte Carlo mode"""
+    model = request.args.get('model', 'uniform')
+    simulations = request.args.get('simulations', default=0, type=int)
+    state_sd = request.args.get('state_sd', default=0.0, type=float)
+    interval = request.args.get('interval', default=0.9, type=float)
+    seed = request.args.get('seed', default=0, type=int)
+    
+    if not 0 <= simulations <= swing.MAX_SIMULATIONS:
+        return jsonify({'error': f'simulations must be between 0 and {swing.MAX_SIMULATIONS}'}), 400
+    if not 0 < interval < 1 or state_sd < 0:
+        return jsonify({'error': 'interval must be between 0 and 1 and state_sd not negative'}), 400
     
     try:
-        if not year1 or not year2:
-            # Get last two years within 1991-2019 range
-            cursor = conn.execute("SELECT DISTINCT Year FROM election_results WHERE Year >= 1991 AND Year <= 2019 ORDER BY Year DESC LIMIT 2")
-            years = [row['Year'] for row in cursor.fetchall()]
-            if len(years) >= 2:
-                year2, year1 = years[0], years[1]
-            else:
-                return jsonify({'error': 'Need at least 2 years of data'})
-        
-        query1 = """
-        SELECT Party, COUNT(*) as seats
-        FROM election_results
-        WHERE Year = ? AND Year >= 1991 AND Year <= 2019 AND Position = 1
-        GROUP BY Party
-        """
-        
-        seats_year1 = {row['Party']: row['seats'] for row in conn.execute(query1, (year1,)).fetchall()}
-        seats_year2 = {row['Party']: row['seats'] for row in conn.execute(query1, (year2,)).fetchall()}
-        
-        changes = []
-        all_parties = set(list(seats_year1.keys()) + list(seats_year2.keys()))
-        
-        for party in all_parties:
-            seats1 = seats_year1.get(party, 0)
-            seats2 = seats_year2.get(party, 0)
-            change = seats2 - seats1
-            changes.append({
-                'party': party,
-                'year1_seats': seats1,
-                'year2_seats': seats2,
-                'change': change
-            })
-        
-        changes.sort(key=lambda x: abs(x['change']), reverse=True)
-        
-        return jsonify({
-            'year1': year1,
-            'year2': year2,
-            'changes': changes[:10]  # Top 10
-        })
-    finally:
-        conn.close()
+        swings = [swing.Swing.parse(text) for text in request.args.getlist('swing')]
+        contests = swing.get_contests(budgets.unbudgeted(get_db_connection), request.args.get('election_type'),
+                                      request.args.get('year', type=int), request.args.get('group_by'),
+                                      snapshot_manager.version())
+        if contests is None:
+            return jsonify({'error': f"No results for {request.args.get('year')}"}), 400
+        if simulations:
+            result = contests.monte_carlo(swings, model, simulations, seed, state_sd, interval,
+                                          swing.WORKERS, swing.get_pool())
+        else:
+            result = contests.simulate(swings, model)
+    except swing.InvalidSwing as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/analytics/percentiles', methods=['GET'])
+def percentiles():
+    """Percentiles of turnout, victory margin, ENOP or vote share over any years and states
+    (1991-2019), merged from quantile sketches kept per year and state"""
+    by = request.args.get('by') or None
+    states = [state.strip() for state in request.args.get('state', '').split(',') if state.strip()]
+    
+    try:
+        metric = quantiles.metric(request.args.get('metric', 'turnout'))
+    except quantiles.UnknownMetric as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        qs = [float(q) for q in request.args.get('q', '').split(',') if q.strip()] or list(quantiles.DEFAULT_QUANTILES)
+        years = [int(year) for year in request.args.get('year', '').split(',') if year.strip()]
+    except ValueError:
+        return jsonify({'error': 'q and year must be comma-separated numbers'}), 400
+    if len(qs) > quantiles.MAX_QUANTILES or not all(0 <= q <= 1 for q in qs):
+        return jsonify({'error': f'q must be at most {quantiles.MAX_QUANTILES} quantiles between 0 and 1'}), 400
+    if by is not None and by not in quantiles.GROUPINGS:
+        return jsonify({'error': "by must be 'year' or 'state'"}), 400
+    
+    sketches = quantiles.get_sketches(budgets.unbudgeted(get_db_connection), request.args.get('election_type'),
+                                      snapshot_manager.version())
+    unknown = [state for state in states if state not in sketches.states]
+    if unknown:
+        return jsonify({'error': f'Unknown state: {unknown[0]}'}), 400
+    
+    return jsonify(sketches.percentiles(metric, qs, by, years=years or None,
+                                        year_from=request.args.get('year_from', type=int),
+                                        year_to=request.args.get('year_to', type=int), states=states or None))
+
+@app.route('/api/analytics/breakdown', methods=['GET'])
+def breakdown():
+    """Candidates, seats and votes matching any combination of year, state, party, gender, party type
+    and position filters (1991-2019), optionally per value of one of them, from bitmap indexes"""
+    by = request.args.get('by') or None
+    limit = request.args.get('rows', default=0, type=int)
+    route = partitions.route(request.args.get('election_type'))
+    
+    if route.election_type != partitions.DEFAULT_ELECTION_TYPE:
+        # The column store holds only the Lok Sabha rows
+        return jsonify({'error': f'breakdown is only available for election_type {partitions.DEFAULT_ELECTION_TYPE}'}), 400
+    if by is not None and by not in bitmaps.COLUMNS:
+        return jsonify({'error': f'by must be one of {list(bitmaps.COLUMNS)}'}), 400
+    if not 0 <= limit <= bitmaps.MAX_ROWS:
+        return jsonify({'error': f'rows must be between 0 and {bitmaps.MAX_ROWS}'}), 400
+    try:
+        predicates = bitmaps.predicates(request.args)
+    except ValueError:
+        return jsonify({'error': 'year and position must be comma-separated integers'}), 400
+    
+    # The shared column store holds the indexes
+    index = bitmaps.BitmapIndex(dataset.get_store(budgets.unbudgeted(get_db_connection), snapshot_manager.version()))
+    rows = index.select(predicates)
+    result = index.aggregate(rows, bitmaps.COLUMNS.get(by))
+    if limit:
+        result['rows'] = index.fetch(rows, limit)
+    return jsonify(result)
 
 @app.route('/api/analytics/women-percentage', methods=['GET'])
 def women_percentage():
@@ -390,16 +633,17 @@ def women_percentage():
     conn = get_db_connection()
     
     try:
-        query = """
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type')))
+        query = f"""
         SELECT 
             COUNT(*) as total_candidates,
-            SUM(CASE WHEN Sex = 'F' THEN 1 ELSE 0 END) as women_candidates,
-            SUM(CASE WHEN Sex = 'F' THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as women_percentage
-        FROM election_results
+            SUM(CASE WHEN {coded.equals('Sex')} THEN 1 ELSE 0 END) as women_candidates,
+            SUM(CASE WHEN {coded.equals('Sex')} THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as women_percentage
+        FROM {coded}
         WHERE Year >= 1991 AND Year <= 2019
         """
         
-        cursor = conn.execute(query)
+        cursor = conn.execute(query, ('F', 'F'))
         result = dict(cursor.fetchone())
         return jsonify(result)
     finally:
@@ -414,43 +658,49 @@ def narrowest_margins():
     conn = get_db_connection()
     
     try:
+        # Only the winners returned have their state and party decoded
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type'), year))
         if year:
-            query = """
+            query = f"""
             SELECT 
                 Year,
-                State_Name,
+                {coded.label('State_Name')} as State_Name,
                 Constituency_Name,
                 Candidate,
-                Party,
+                {coded.label('Party')} as Party,
                 Margin_Percentage,
                 Margin
-            FROM election_results
-            WHERE Year = ? AND Year >= 1991 AND Year <= 2019 AND Position = 1 AND Margin_Percentage IS NOT NULL
-            ORDER BY Margin_Percentage ASC
-            LIMIT ?
+            FROM (
+                SELECT * FROM {coded}
+                WHERE Year = ? AND Year >= 1991 AND Year <= 2019 AND Position = 1 AND Margin_Percentage IS NOT NULL
+                ORDER BY Margin_Percentage ASC
+                LIMIT ?
+            )
             """
             cursor = conn.execute(query, (year, limit))
         else:
-            query = """
+            query = f"""
             SELECT 
                 Year,
-                State_Name,
+                {coded.label('State_Name')} as State_Name,
                 Constituency_Name,
                 Candidate,
-                Party,
+                {coded.label('Party')} as Party,
                 Margin_Percentage,
                 Margin
-            FROM election_results
-            WHERE Year >= 1991 AND Year <= 2019 AND Position = 1 AND Margin_Percentage IS NOT NULL
-            ORDER BY Margin_Percentage ASC
-            LIMIT ?
+            FROM (
+                SELECT * FROM {coded}
+                WHERE Year >= 1991 AND Year <= 2019 AND Position = 1 AND Margin_Percentage IS NOT NULL
+                ORDER BY Margin_Percentage ASC
+                LIMIT ?
+            )
             """
             cursor = conn.execute(query, (limit,))
         
-        results = [dict(row) for row in cursor.fetchall()]
-        return jsonify(results)
-    finally:
+        return jsonstream.array_response(conn, cursor)
+    except BaseException:
         conn.close()
+        raise
 
 @app.route('/api/analytics/national-vs-regional', methods=['GET'])
 def national_vs_regional():
@@ -458,20 +708,21 @@ def national_vs_regional():
     conn = get_db_connection()
     
     try:
-        query = """
+        coded = encoding.coded(conn, partitions.route(request.args.get('election_type')))
+        query = f"""
         SELECT 
             Year,
-            Party_Type_TCPD,
+            {coded.label('Party_Type_TCPD')} as Party_Type_TCPD,
             SUM(Votes) as total_votes,
-            SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM election_results e2 WHERE e2.Year = election_results.Year AND e2.Year >= 1991 AND e2.Year <= 2019) as vote_share_percentage
-        FROM election_results
-        WHERE Year >= 1991 AND Year <= 2019 AND Party_Type_TCPD IN ('National Party', 'Regional Party')
+            SUM(Votes) * 100.0 / (SELECT SUM(Votes) FROM {coded} e2 WHERE e2.Year = election_results.Year AND e2.Year >= 1991 AND e2.Year <= 2019) as vote_share_percentage
+        FROM {coded} AS election_results
+        WHERE Year >= 1991 AND Year <= 2019 AND Party_Type_TCPD IN {coded.values('Party_Type_TCPD', 'National Party', 'Regional Party')}
         GROUP BY Year, Party_Type_TCPD
         ORDER BY Year, Party_Type_TCPD
         """
         
         cursor = conn.execute(query)
-        results = [dict(row) for row in cursor.fetchall()]
+        results = tracing.records(cursor.fetchall())
         return jsonify(results)
     finally:
         conn.close()
@@ -482,32 +733,83 @@ def education_correlation():
     conn = get_db_connection()
     
     try:
+        source = partitions.source(conn, request.args.get('election_type'))
         # Check if education column exists
         cursor = conn.execute("PRAGMA table_info(election_results)")
         columns = [row[1] for row in cursor.fetchall()]
         
         if 'Education' in columns or 'education' in columns:
-            query = """
+            query = f"""
             SELECT 
                 Education,
                 COUNT(*) as total_candidates,
                 SUM(CASE WHEN Position = 1 THEN 1 ELSE 0 END) as winners,
                 SUM(CASE WHEN Position = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*) as win_percentage
-            FROM election_results
+            FROM {source}
             WHERE Year >= 1991 AND Year <= 2019 AND Education IS NOT NULL
             GROUP BY Education
             ORDER BY win_percentage DESC
             """
             cursor = conn.execute(query)
-            results = [dict(row) for row in cursor.fetchall()]
+            results = tracing.records(cursor.fetchall())
         else:
             # Return a message indicating education data is not available
-            results = {'message': 'Education data not available in dataset'}
+            results = {
+                'message': 'Education data not available in dataset',
+                'alternatives': '/api/analytics/win-correlation?attribute=' + '|'.join(correlation.ATTRIBUTES)
+            }
         
         return jsonify(results)
     finally:
         conn.close()
 
+@app.route('/api/analytics/win-correlation', methods=['GET'])
+def win_correlation():
+    """How do candidate attributes (gender, incumbency, party type, ...) relate to winning (1991-2019)?"""
+    attribute = request.args.get('attribute', '')
+    year = request.args.get('year', type=int)
+    state = request.args.get('state', '')
+    
+    if attribute and attribute not in correlation.ATTRIBUTES:
+        return jsonify({'error': f"Unknown attribute '{attribute}', expected one of {list(correlation.ATTRIBUTES)}"}), 400
+    
+    conn = get_db_connection()
+    
+    try:
+        source = partitions.source(conn, request.args.get('election_type'), year)
+        results = correlation.compute(conn, [attribute] if attribute else None, year, state, source)
+        return jsonify(results)
+    finally:
+        conn.close()
+
+# Interrupt queries that exceed their endpoint's time budget (innermost, so the
+# budget starts once the request has been admitted)
+query_budgets = budgets.install(app, budgets.QueryBudgets())
+
+# Bound concurrent requests per endpoint and shed the excess with 503 (after all
+# routes are registered, and before coalescing so only one of identical requests takes a slot)
+admission_control = admission.install(app, admission.AdmissionControl())
+
+# Identical concurrent requests share one computation (after all routes are registered)
+flight = singleflight.install(app, singleflight.SingleFlight())
+
+# Trace sampled requests from the WSGI entry to the last byte sent
+tracer = tracing.install(app, tracing.Tracer())
+
+# Measure the memory of each request with tracemalloc when MEMORY_PROFILE is set
+memory_profiler = memprofile.install(app, memprofile.MemoryProfiler())
+
+# Pin every request to the database version current when it arrived until its
+# response has been sent (so everything inside reads that version)
+snapshots.install(app, snapshot_manager)
+
+# Route every request to its dataset, from its /datasets/<name>/ prefix or its
+# `dataset` parameter (outermost, so the snapshots, connections and cache inside
+# are that dataset's)
+datasets.install(app, registry)
+
 # For local development
 if __name__ == '__main__':
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        registry.start()
     app.run(debug=True, port=5000)
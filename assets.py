@@ -0,0 +1,271 @@
+"""
+Static Asset Pipeline
+Minifies static/dashboard.js and static/style.css, writes them under
+static/dist/ with content-hash filenames plus precompressed .gz (and .br when
+the brotli package is installed) variants, and records the mapping in
+static/dist/manifest.json. Templates reference assets through asset_url(),
+which resolves to the hashed file once the build has run and to the original
+file otherwise.
+
+Usage:
+    python assets.py
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+ASSETS = ['dashboard.js', 'style.css']
+
+# Preferred first when the client accepts several
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# A / after one of these (or at the start) begins a regex literal, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw',
+                  'yield', 'await'}
+
+
+def _regex_allowed(out):
+    """Whether a / following the code written to out starts a regex literal"""
+    text = ''.join(out[-20:]).rstrip()
+    if not text:
+        return True
+    if text.endswith(('++', '--')):
+        # a++ / 2
+        return False
+    if text[-1] in REGEX_PRECEDERS:
+        return True
+    word = re.search(r'[A-Za-z_$][\w$]*$', text)
+    return word is not None and word.group() in REGEX_KEYWORDS
+
+
+def minify_js(source):
+    """Strip comments, indentation and blank lines outside string, template and regex literals.
+
+    Newlines are kept so that automatic semicolon insertion behaves as before.
+    """
+    out = []
+    # Stack of open contexts: 'code', 'template' or a quote character
+    stack = ['code']
+    # Brace depth of each ${...} expression currently open inside a template
+    braces = []
+    i, n = 0, len(source)
+    at_line_start = True
+
+    while i < n:
+        ch = source[i]
+        mode = stack[-1]
+
+        if mode == 'template':
+            out.append(ch)
+            if ch == '\\':
+                out.append(source[i + 1:i + 2])
+                i += 2
+                continue
+            if ch == '`':
+                stack.pop()
+            elif ch == '$' and source[i + 1:i + 2] == '{':
+                out.append('{')
+                stack.append('code')
+                braces.append(0)
+                i += 2
+                continue
+            i += 1
+            continue
+
+        if mode in ('"', "'"):
+            out.append(ch)
+            if ch == '\\':
+                out.append(source[i + 1:i + 2])
+                i += 2
+                continue
+            if ch == mode or ch == '\n':
+                stack.pop()
+            i += 1
+            continue
+
+        # Code
+        if at_line_start and ch in ' \t':
+            i += 1
+            continue
+        if ch == '/' and source[i + 1:i + 2] == '/':
+            while i < n and source[i] != '\n':
+                i += 1
+            continue
+        if ch == '/' and source[i + 1:i + 2] == '*':
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        if ch == '/' and _regex_allowed(out):
+            # Copied up to the closing slash, which does not close it inside a [...] class
+            j, in_class = i + 1, False
+            while j < n and source[j] != '\n':
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                elif source[j] == '/' and not in_class:
+                    break
+                j += 1
+            if j < n and source[j] == '/':
+                out.append(source[i:j + 1])
+                at_line_start = False
+                i = j + 1
+                continue
+            # Unterminated on its line, so a division after all
+        if ch == '\n':
+            # Drop trailing whitespace and collapse blank lines
+            while out and out[-1] in ' \t':
+                out.pop()
+            if out and out[-1] != '\n':
+                out.append('\n')
+            at_line_start = True
+            i += 1
+            continue
+
+        at_line_start = False
+        out.append(ch)
+        if ch in ('"', "'"):
+            stack.append(ch)
+        elif ch == '`':
+            stack.append('template')
+        elif braces:
+            if ch == '{':
+                braces[-1] += 1
+            elif ch == '}':
+                if braces[-1] == 0:
+                    # Closes the ${...} expression, back inside the template
+                    braces.pop()
+                    stack.pop()
+                else:
+                    braces[-1] -= 1
+        i += 1
+
+    return ''.join(out).strip() + '\n'
+
+
+def minify_css(source):
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,])\s*', r'\1', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+def build(static_dir=STATIC_DIR):
+    dist_dir = os.path.join(static_dir, 'dist')
+    os.makedirs(dist_dir, exist_ok=True)
+
+    manifest = {}
+    written = {'manifest.json'}
+    for name in ASSETS:
+        stem, ext = os.path.splitext(name)
+        with open(os.path.join(static_dir, name), 'r', encoding='utf-8') as f:
+            original = f.read()
+        data = MINIFIERS[ext](original).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        hashed = f'{stem}.{digest}{ext}'
+
+        variants = {hashed: data}
+        # mtime=0 keeps the .gz byte-identical across builds of the same content
+        variants[hashed + '.gz'] = gzip.compress(data, compresslevel=9, mtime=0)
+        if brotli is not None:
+            variants[hashed + '.br'] = brotli.compress(data, quality=11)
+
+        for filename, content in variants.items():
+            with open(os.path.join(dist_dir, filename), 'wb') as f:
+                f.write(content)
+            written.add(filename)
+
+        manifest[name] = f'dist/{hashed}'
+        sizes = ', '.join(f'{filename[len(hashed):] or ext}: {len(content)}' for filename, content in variants.items())
+        print(f"{name}: {len(original.encode('utf-8'))} bytes -> {hashed} ({sizes})")
+
+    # Remove the outputs of earlier builds
+    for filename in os.listdir(dist_dir):
+        if filename not in written:
+            os.remove(os.path.join(dist_dir, filename))
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+_manifest = {'mtime': None, 'entries': {}}
+
+
+def load_manifest():
+    """Current manifest, re-read only when the file changes"""
+    try:
+        mtime = os.stat(MANIFEST_PATH).st_mtime_ns
+    except OSError:
+        _manifest.update(mtime=None, entries={})
+        return _manifest['entries']
+    if mtime != _manifest['mtime']:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            _manifest.update(mtime=mtime, entries=json.load(f))
+    return _manifest['entries']
+
+
+def asset_url(name):
+    """URL of the built asset, or of the source file when no build exists"""
+    return '/static/' + load_manifest().get(name, name)
+
+
+def send_asset(filename, dist_dir=DIST_DIR):
+    """Serve a built asset, using a precompressed variant the client accepts"""
+    accepted = request.headers.get('Accept-Encoding', '')
+    accepted = {part.split(';')[0].strip().lower() for part in accepted.split(',')}
+
+    response = None
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(os.path.join(dist_dir, filename + suffix)):
+            response = send_from_directory(dist_dir, filename + suffix,
+                                           mimetype=_mimetype(filename), conditional=True)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(dist_dir, filename, mimetype=_mimetype(filename), conditional=True)
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+def _mimetype(filename):
+    if filename.endswith('.js'):
+        return 'application/javascript'
+    if filename.endswith('.css'):
+        return 'text/css'
+    return None
+
+
+def install(app):
+    """Make asset_url() available to templates"""
+    app.context_processor(lambda: {'asset_url': asset_url})
+
+
+if __name__ == '__main__':
+    build()
@@ -0,0 +1,296 @@
+"""
+Bitmap Indexes
+One bitmap per value of the low-cardinality columns (Year, State_Name, Party,
+Sex, Party_Type_TCPD, Position) of the shared column store (dataset.py), so a
+combination of filters is evaluated with bitwise AND/OR over the rows instead
+of a scan, and the matching rows or aggregates are read straight from the
+store's columns.
+
+Values on at least 1/32 of the rows keep a packed bitmap (np.packbits, one
+bit per row); rarer values keep the sorted ids of their rows, which is
+smaller (4 bytes per row) and intersects faster. A combination stays a list
+of row ids as long as one of its terms is one. The indexes are derived
+arrays of the store, built with it and shared by the pre-forked workers.
+
+Usage:
+    python bitmaps.py [db_path]   # index sizes and filter timings vs SQLite
+"""
+
+import sqlite3
+import sys
+import time
+from functools import partial
+
+import numpy as np
+
+import dataset
+import partitions
+
+# Query parameter -> indexed column
+COLUMNS = {
+    'year': 'Year',
+    'state': 'State_Name',
+    'party': 'Party',
+    'gender': 'Sex',
+    'party_type': 'Party_Type_TCPD',
+    'position': 'Position',
+}
+
+# Values on fewer than 1 / SPARSE_FRACTION of the rows are stored as row ids
+SPARSE_FRACTION = 32
+
+MAX_ROWS = 1000
+
+# Set bits of every byte value
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class UnknownColumn(ValueError):
+    pass
+
+
+def _build(column, store):
+    """Arrays of the index of one column: the sorted values, each one's slot
+    in the dense bitmaps (-1 when sparse) and its range of sparse row ids"""
+    values = store[column]
+    n_rows = store.n_rows
+    # Missing text (-1) and numeric (NaN) values are not indexed
+    present = values >= 0 if column in store.labels else ~np.isnan(values.astype(np.float64))
+    rows = np.flatnonzero(present)
+    keys, inverse = np.unique(values[rows], return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(keys))
+    dense = counts * SPARSE_FRACTION >= n_rows
+
+    slots = np.full(len(keys), -1, dtype=np.int32)
+    slots[dense] = np.arange(dense.sum(), dtype=np.int32)
+    bitmaps = np.zeros((int(dense.sum()), (n_rows + 7) // 8), dtype=np.uint8)
+    for key in np.flatnonzero(dense):
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[rows[inverse == key]] = True
+        bitmaps[slots[key]] = np.packbits(mask)
+
+    sparse_rows = ~dense[inverse]
+    order = np.argsort(inverse[sparse_rows], kind='stable')
+    ids = rows[sparse_rows][order].astype(np.uint32)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.where(dense, 0, counts))
+    return {'keys': keys, 'slots': slots, 'bitmaps': bitmaps, 'ids': ids, 'offsets': offsets}
+
+
+for _column in COLUMNS.values():
+    dataset.register_derived(f'bitmap.{_column}', partial(_build, _column))
+
+
+class RowSet:
+    """Rows of the store as a packed bitmap or as sorted row ids"""
+
+    __slots__ = ('n_rows', 'bits', 'ids')
+
+    def __init__(self, n_rows, bits=None, ids=None):
+        self.n_rows = n_rows
+        self.bits = bits
+        self.ids = ids
+
+    @classmethod
+    def all(cls, n_rows):
+        return cls(n_rows, ids=np.arange(n_rows, dtype=np.uint32))
+
+    def __len__(self):
+        if self.ids is not None:
+            return len(self.ids)
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def contains(self, ids):
+        """Mask of which of the sorted row ids are in the set"""
+        if self.ids is not None:
+            positions = np.minimum(np.searchsorted(self.ids, ids), max(len(self.ids) - 1, 0))
+            return (self.ids[positions] == ids) if len(self.ids) else np.zeros(len(ids), dtype=bool)
+        return (self.bits[ids >> 3] >> (7 - (ids & 7)).astype(np.uint8)) & 1 == 1
+
+    def to_bits(self):
+        if self.bits is not None:
+            return self.bits
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.ids] = True
+        return np.packbits(mask)
+
+    def to_ids(self):
+        """Sorted row ids, as the index type NumPy gathers with fastest"""
+        if self.ids is not None:
+            return self.ids.astype(np.intp)
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.n_rows).view(bool))
+
+    def __and__(self, other):
+        if self.ids is not None:
+            return RowSet(self.n_rows, ids=self.ids[other.contains(self.ids)])
+        if other.ids is not None:
+            return RowSet(self.n_rows, ids=other.ids[self.contains(other.ids)])
+        return RowSet(self.n_rows, bits=self.bits & other.bits)
+
+    def __or__(self, other):
+        if self.ids is not None and other.ids is not None:
+            return RowSet(self.n_rows, ids=np.union1d(self.ids, other.ids).astype(np.uint32))
+        return RowSet(self.n_rows, bits=self.to_bits() | other.to_bits())
+
+
+class BitmapIndex:
+    def __init__(self, store):
+        self.store = store
+
+    def _array(self, column, part):
+        return self.store[f'bitmap.{column}.{part}']
+
+    def rows(self, column, value):
+        """RowSet of the rows where column equals value (a label or a number)"""
+        keys = self._array(column, 'keys')
+        if column in self.store.labels:
+            key = self.store.code(column, value)
+            found = key >= 0
+        else:
+            key = int(np.searchsorted(keys, value))
+            found = key < len(keys) and keys[key] == value
+        if not found:
+            return RowSet(self.store.n_rows, ids=np.zeros(0, dtype=np.uint32))
+        slot = self._array(column, 'slots')[key]
+        if slot >= 0:
+            return RowSet(self.store.n_rows, bits=self._array(column, 'bitmaps')[slot])
+        offsets = self._array(column, 'offsets')
+        return RowSet(self.store.n_rows, ids=self._array(column, 'ids')[offsets[key]:offsets[key + 1]])
+
+    def select(self, predicates):
+        """RowSet of the rows matching every {column: [values]} predicate, any of
+        the values of each"""
+        terms = []
+        for column, values in predicates.items():
+            if f'bitmap.{column}.keys' not in self.store:
+                raise UnknownColumn(f'{column} is not indexed')
+            term = None
+            for value in values:
+                rows = self.rows(column, value)
+                term = rows if term is None else term | rows
+            terms.append(term)
+        if not terms:
+            return RowSet.all(self.store.n_rows)
+        # Row id lists first: the intersection stays one and only shrinks
+        terms.sort(key=lambda term: (term.ids is None, len(term.ids) if term.ids is not None else 0))
+        result = terms[0]
+        for term in terms[1:]:
+            result = result & term
+        return result
+
+    def fetch(self, rowset, limit=MAX_ROWS):
+        """The first `limit` matching rows (in store order) as dicts of every column"""
+        ids = rowset.to_ids()[:limit]
+        columns = [name for name in self.store.arrays if '.' not in name and name != 'contest_id']
+        values = {}
+        for name in columns:
+            array = self.store[name][ids]
+            if name in self.store.labels:
+                values[name] = self.store.decode(name, array)
+            elif array.dtype.kind == 'f':
+                values[name] = [None if np.isnan(value) else float(value) for value in array]
+            else:
+                values[name] = array.tolist()
+        return [dict(zip(columns, row)) for row in zip(*(values[name] for name in columns))]
+
+    def aggregate(self, rowset, by=None):
+        """Candidates, seats won and votes of the matching rows, in total and per
+        value of the `by` column"""
+        ids = rowset.to_ids()
+        votes = np.nan_to_num(self.store['Votes'][ids].astype(np.float64))
+        won = self.store['Position'][ids] == 1
+        total_votes = float(votes.sum())
+        result = {
+            'candidates': len(ids),
+            'seats': int(won.sum()),
+            'votes': int(total_votes),
+        }
+        if by is None:
+            return result
+
+        codes = self.store[by][ids]
+        if by in self.store.labels:
+            # Text codes index the labels directly
+            labels = self.store.labels[by]
+            present = codes >= 0
+            key_index, n_keys = codes[present], len(labels)
+            label = labels.__getitem__
+        else:
+            keys = self._array(by, 'keys')
+            present = ~np.isnan(codes) if codes.dtype.kind == 'f' else slice(None)
+            key_index, n_keys = np.searchsorted(keys, codes[present]), len(keys)
+            label = lambda key: keys[key].item()
+        candidates = np.bincount(key_index, minlength=n_keys)
+        seats = np.bincount(key_index, weights=won[present], minlength=n_keys)
+        group_votes = np.bincount(key_index, weights=votes[present], minlength=n_keys)
+        found = np.flatnonzero(candidates)
+        groups = [
+            {
+                'value': label(key),
+                'candidates': count,
+                'seats': int(seats_won),
+                'votes': int(votes_won),
+                'vote_share': round(votes_won * 100 / total_votes, 2) if total_votes else None,
+            }
+            # Python scalars: per-element NumPy arithmetic costs more than the bincounts
+            for key, count, seats_won, votes_won in zip(
+                found.tolist(), candidates[found].tolist(), seats[found].tolist(), group_votes[found].tolist())
+        ]
+        groups.sort(key=lambda group: (-group['seats'], -group['votes']))
+        result['groups'] = groups
+        return result
+
+
+def predicates(args):
+    """{column: [values]} from the comma-separated filter parameters"""
+    result = {}
+    for name, column in COLUMNS.items():
+        values = [value.strip() for value in args.get(name, '').split(',') if value.strip()]
+        if values:
+            if column in ('Year', 'Position'):
+                values = [int(value) for value in values]
+            result[column] = values
+    return result
+
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'election_data2.db'
+    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    store = dataset.build_store(conn)
+    print(f'Built the store and its indexes in {time.perf_counter() - start:.2f}s ({store.n_rows} rows)')
+    for column in COLUMNS.values():
+        size = sum(store[f'bitmap.{column}.{part}'].nbytes for part in ('keys', 'slots', 'bitmaps', 'ids', 'offsets'))
+        print(f"  {column:<18} {len(store[f'bitmap.{column}.keys']):>5} values "
+              f"{len(store[f'bitmap.{column}.bitmaps']):>4} bitmaps {size / 1024:>9.1f} KB")
+
+    index = BitmapIndex(store)
+    state = store.labels['State_Name'][0]
+    party = store.labels['Party'][0]
+    queries = [
+        {'Year': [2019]},
+        {'Year': [2014, 2019], 'Position': [1]},
+        {'State_Name': [state], 'Sex': ['F']},
+        {'Party': [party], 'Position': [1], 'Year': [2009, 2014, 2019]},
+    ]
+    print(f"\n{'Filters':<60} {'Rows':>6} {'Bitmap us':>10} {'SQLite us':>10}")
+    for query in queries:
+        repeat = 200
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = index.aggregate(index.select(query))
+        bitmap_us = (time.perf_counter() - start) / repeat * 1e6
+        where = ' AND '.join(f"{column} IN ({', '.join('?' * len(values))})" for column, values in query.items())
+        params = [value for values in query.values() for value in values]
+        sql = f"""SELECT COUNT(*), SUM(Position = 1), SUM(Votes) FROM {partitions.source(conn)}
+                  WHERE Year >= 1991 AND Year <= 2019 AND {where}"""
+        start = time.perf_counter()
+        for _ in range(repeat // 10):
+            conn.execute(sql, params).fetchone()
+        sqlite_us = (time.perf_counter() - start) / (repeat // 10) * 1e6
+        print(f"{str(query)[:60]:<60} {result['candidates']:>6} {bitmap_us:>10.1f} {sqlite_us:>10.1f}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+SQL Time Budgets
+Every connection opened while serving a request gets the time budget of the
+request's endpoint. A SQLite progress handler checks the deadline every few
+thousand virtual machine instructions (a few milliseconds apart even inside
+large sorts) and interrupts the running statement once it has passed, so a
+pathological query cannot hold a worker thread and a connection indefinitely.
+The endpoint then returns a structured 504 error, and every cancellation is
+logged with the statement that was interrupted.
+
+SQL_BUDGET_SECONDS sets the default budget and SQL_BUDGETS overrides single
+routes, for example SQL_BUDGETS="/api/search=2,/api/suggest=0.5"; a budget of
+0 disables it for that route.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from functools import wraps
+
+from flask import g, has_request_context, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# Virtual machine instructions between deadline checks
+PROGRESS_INSTRUCTIONS = 10000
+
+DEFAULT_BUDGET = float(os.environ.get('SQL_BUDGET_SECONDS', 10))
+
+# Route -> seconds, or None for no budget
+DEFAULT_BUDGETS = {
+    '/api/suggest': 1.0,
+    '/api/search': 5.0,
+    # Streams for as long as the download takes, outside of the request
+    '/api/export': None,
+}
+
+
+def _budgets_from_env(defaults):
+    budgets = dict(defaults)
+    for entry in filter(None, os.environ.get('SQL_BUDGETS', '').split(',')):
+        route, _, seconds = entry.partition('=')
+        budgets[route.strip()] = float(seconds) or None
+    return budgets
+
+
+class QueryTimeout(Exception):
+    def __init__(self, route, budget, elapsed, statement):
+        super().__init__(f'Query exceeded the {budget:g}s time budget of {route}')
+        self.route = route
+        self.budget = budget
+        self.elapsed = elapsed
+        self.statement = statement
+
+
+class Budget:
+    """Deadline shared by every connection opened for one request"""
+
+    def __init__(self, route, seconds):
+        self.route = route
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds
+        self.expired = False
+        self.statement = None
+
+    def attach(self, conn):
+        conn.set_progress_handler(self._progress, PROGRESS_INSTRUCTIONS)
+        conn.set_trace_callback(self._trace)
+
+    def _progress(self):
+        # A non-zero return interrupts the running statement
+        if time.monotonic() >= self.deadline:
+            self.expired = True
+            return 1
+        return 0
+
+    def _trace(self, statement):
+        # On one line for the log
+        self.statement = ' '.join(statement.split())
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+class QueryBudgets:
+    def __init__(self, budgets=None, default=DEFAULT_BUDGET):
+        self.budgets = _budgets_from_env(DEFAULT_BUDGETS) if budgets is None else budgets
+        self.default = default
+
+    def seconds(self, route):
+        return self.budgets.get(route, self.default)
+
+
+def attach(conn):
+    """Bound conn by the budget of the request being served, if there is one"""
+    if has_request_context():
+        budget = g.get('sql_budget')
+        if budget is not None:
+            budget.attach(conn)
+    return conn
+
+
+def detach(conn):
+    """Lift the request's budget from conn"""
+    conn.set_progress_handler(None, 0)
+    conn.set_trace_callback(None)
+    return conn
+
+
+def unbudgeted(connect):
+    """Connection factory for structures built once and shared by every later
+    request, which must not fail because the request that triggers them is short"""
+    def open_connection():
+        return detach(connect())
+    return open_connection
+
+
+def budgeted(view, budgets):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        seconds = budgets.seconds(request.path)
+        if not seconds:
+            return view(*args, **kwargs)
+        budget = g.sql_budget = Budget(request.path, seconds)
+        try:
+            return view(*args, **kwargs)
+        except sqlite3.OperationalError:
+            if not budget.expired:
+                raise
+            logger.warning('SQL time budget of %gs exceeded on %s after %.0fms, interrupted: %s',
+                           seconds, budget.route, budget.elapsed() * 1000, budget.statement)
+            raise QueryTimeout(budget.route, seconds, budget.elapsed(), budget.statement)
+        finally:
+            g.sql_budget = None
+
+    return wrapper
+
+
+def install(app, budgets):
+    """Budget every GET /api view; call after all routes are registered and before
+    singleflight.install, so coalesced followers get the same timeout error"""
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/api/') and 'GET' in rule.methods:
+            app.view_functions[rule.endpoint] = budgeted(app.view_functions[rule.endpoint], budgets)
+
+    @app.errorhandler(QueryTimeout)
+    def query_timeout(e):
+        return jsonify({
+            'error': str(e),
+            'route': e.route,
+            'budget_ms': round(e.budget * 1000),
+            'elapsed_ms': round(e.elapsed * 1000, 1),
+        }), 504
+
+    return budgets
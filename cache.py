@@ -0,0 +1,269 @@
+"""
+Response Cache
+Caches the JSON bodies of GET /api responses, keyed by route and normalized
+query parameters, and serves them before the view runs.
+
+The cache is bounded by the total size of the cached bodies in bytes rather
+than by entry count, evicting least-recently-used entries once the budget is
+exceeded, so a few huge responses cannot push the memory use past the budget.
+Per-route rules set a TTL or pin entries so they are never evicted.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, request
+
+from snapshots import environ_version
+
+# Responses that must always reflect the live process
+UNCACHED = {'/api/health'}
+UNCACHED_PREFIX = '/api/debug/'
+
+# Streamed responses, which must be neither buffered nor cached (other streamed
+# responses are cached once they have been sent)
+STREAMED = {'/api/dashboard/stream', '/api/export'}
+
+BYPASS = 'cache.bypass'
+# Set on requests whose responses should be pinned (the cache warmer's)
+PIN = 'cache.pin'
+
+DEFAULT_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Approximate bookkeeping cost of one entry on top of its body
+ENTRY_OVERHEAD = 256
+
+# Route -> {'ttl': seconds, 'pin': bool}
+DEFAULT_RULES = {
+    '/api/filters/years': {'pin': True},
+    '/api/filters/states': {'pin': True},
+    '/api/filters/parties': {'pin': True},
+    '/api/filters/election-types': {'pin': True},
+    '/api/search': {'ttl': 300},
+    '/api/suggest': {'ttl': 3600},
+}
+
+
+def cache_key(path, args, version=None):
+    """Route plus query parameters in a canonical order, per database snapshot version"""
+    return path, tuple(sorted(args.items(multi=True))), version
+
+
+def request_key(req):
+    return cache_key(req.path, req.args, environ_version(req.environ))
+
+
+class _Entry:
+    __slots__ = ('body', 'mimetype', 'size', 'expires', 'pinned')
+
+    def __init__(self, body, mimetype, size, expires, pinned):
+        self.body = body
+        self.mimetype = mimetype
+        self.size = size
+        self.expires = expires
+        self.pinned = pinned
+
+
+def _route_stats():
+    return {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'rejected': 0,
+            'entries': 0, 'bytes': 0}
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, rules=None, max_entry_fraction=0.25):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.max_bytes = max_bytes
+        # A single response larger than this is never cached
+        self.max_entry_bytes = int(max_bytes * max_entry_fraction)
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.bytes_used = 0
+        self.routes = {}
+
+    def _stats(self, route):
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = _route_stats()
+        return stats
+
+    def _remove(self, key, counter=None):
+        entry = self.entries.pop(key)
+        self.bytes_used -= entry.size
+        stats = self._stats(key[0])
+        stats['entries'] -= 1
+        stats['bytes'] -= entry.size
+        if counter:
+            stats[counter] += 1
+
+    def get(self, key):
+        with self.lock:
+            stats = self._stats(key[0])
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= time.monotonic():
+                self._remove(key, 'expirations')
+                entry = None
+            if entry is None:
+                stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            stats['hits'] += 1
+            return entry.body, entry.mimetype
+
+    def set(self, key, body, mimetype, pin=False):
+        route = key[0]
+        rule = self.rules.get(route, {})
+        size = len(body) + sum(len(str(part)) for part in key[1]) + len(route) + ENTRY_OVERHEAD
+        ttl = rule.get('ttl')
+
+        with self.lock:
+            if key in self.entries:
+                # Keep a pin set by the warmer when a user request refreshes the entry
+                pin = pin or self.entries[key].pinned
+                self._remove(key)
+            if size > self.max_entry_bytes:
+                self._stats(route)['rejected'] += 1
+                return False
+
+            entry = _Entry(body, mimetype, size,
+                           time.monotonic() + ttl if ttl else None,
+                           pin or rule.get('pin', False))
+            self.entries[key] = entry
+            self.bytes_used += size
+            stats = self._stats(route)
+            stats['entries'] += 1
+            stats['bytes'] += size
+            self._evict()
+            return True
+
+    def reject(self, key):
+        """Count a response too large to cache, which also drops the stale entry"""
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self._stats(key[0])['rejected'] += 1
+
+    def _evict(self):
+        """Drop least-recently-used unpinned entries until within budget"""
+        if self.bytes_used <= self.max_bytes:
+            return
+        for key in list(self.entries):
+            if self.bytes_used <= self.max_bytes:
+                break
+            if not self.entries[key].pinned:
+                self._remove(key, 'evictions')
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def release(self, version):
+        """Drop the responses of a database snapshot that is no longer served"""
+        with self.lock:
+            for key in [key for key in self.entries if key[2] == version]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes_used = 0
+            for stats in self.routes.values():
+                stats['entries'] = 0
+                stats['bytes'] = 0
+
+    def stats(self):
+        with self.lock:
+            routes = {route: dict(stats) for route, stats in sorted(self.routes.items())}
+            pinned = sum(entry.size for entry in self.entries.values() if entry.pinned)
+            entries = len(self.entries)
+            bytes_used = self.bytes_used
+        for stats in routes.values():
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        hits = sum(stats['hits'] for stats in routes.values())
+        lookups = hits + sum(stats['misses'] for stats in routes.values())
+        return {
+            'budget_bytes': self.max_bytes,
+            'bytes_used': bytes_used,
+            'pinned_bytes': pinned,
+            'entries': entries,
+            'hits': hits,
+            'misses': lookups - hits,
+            'hit_rate': hits / lookups if lookups else None,
+            'evictions': sum(stats['evictions'] for stats in routes.values()),
+            'expirations': sum(stats['expirations'] for stats in routes.values()),
+            'rejected': sum(stats['rejected'] for stats in routes.values()),
+            'routes': routes,
+        }
+
+
+def is_cacheable(req):
+    return (req.method == 'GET' and req.path.startswith('/api/')
+            and req.path not in UNCACHED and req.path not in STREAMED
+            and not req.path.startswith(UNCACHED_PREFIX))
+
+
+class _CollectedBody:
+    """Streamed body that keeps a copy of what it sends and caches it once the
+    last chunk has been sent; it stops collecting as soon as the body outgrows
+    the largest cacheable entry"""
+
+    def __init__(self, body, cache, key, mimetype, pin):
+        self.body = body
+        self.cache = cache
+        self.key = key
+        self.mimetype = mimetype
+        self.pin = pin
+
+    def __iter__(self):
+        chunks, size = [], 0
+        for chunk in self.body:
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.cache.max_entry_bytes:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is None:
+            self.cache.reject(self.key)
+        else:
+            self.cache.set(self.key, b''.join(chunks), self.mimetype, pin=self.pin)
+
+    def close(self):
+        close = getattr(self.body, 'close', None)
+        if close is not None:
+            close()
+
+
+def install(app, cache):
+    """Serve cached responses before dispatch and store successful ones after"""
+
+    @app.before_request
+    def serve_from_cache():
+        if not is_cacheable(request) or request.environ.get(BYPASS):
+            return None
+        entry = cache.get(request_key(request))
+        if entry is None:
+            return None
+        body, mimetype = entry
+        response = Response(body, mimetype=mimetype)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    @app.after_request
+    def store_in_cache(response):
+        if (is_cacheable(request) and response.status_code == 200
+                and 'X-Cache' not in response.headers):
+            key = request_key(request)
+            pin = bool(request.environ.get(PIN))
+            if response.is_streamed:
+                # Streamed JSON arrays are stored once they have been sent in full
+                response.response = _CollectedBody(response.response, cache, key, response.mimetype, pin)
+            else:
+                cache.set(key, response.get_data(), response.mimetype, pin=pin)
+            response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return cache
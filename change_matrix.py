@@ -0,0 +1,200 @@
+"""
+Seat and Vote Change Matrix
+Aggregates seats won and votes per (state, year, party) for 1991-2019 with a
+single GROUP BY, and keeps them as NumPy arrays from which the seat and
+vote-share changes of every party between every pair of elections, nationally
+or per state, are computed by array arithmetic. Endpoints serve slices of it,
+so a gains and losses chart over all elections takes one request instead of
+one per pair of years.
+
+The matrix is built once per election type and grouping (parties, or the
+coalitions of coalitions.py) on first use and rebuilt when the database changes.
+"""
+
+import threading
+
+import numpy as np
+
+import coalitions
+import encoding
+import partitions
+
+PAIRS = ('consecutive', 'all')
+
+
+def _values(array, integer=False):
+    """JSON-ready list: NaN (no election in that scope and year) becomes None"""
+    return [None if np.isnan(value) else (int(value) if integer else float(value)) for value in array]
+
+
+class ChangeMatrix:
+    def __init__(self, years, states, parties, seats, votes, held):
+        self.years = years
+        self.states = states
+        self.parties = parties
+        # (state, year, party), NaN where the state held no election that year
+        self.seats = seats
+        self.votes = votes
+        # (state, year)
+        self.held = held
+
+    @classmethod
+    def from_connection(cls, conn, route, group_by=None):
+        coded = encoding.coded(conn, route)
+        grouped = coalitions.grouped(conn, coded, group_by)
+        rows = conn.execute(f"""
+        SELECT Year, {coded.label('State_Name')} as State_Name, {grouped.label} as Party,
+               COUNT(CASE WHEN Position = 1 THEN 1 END) as seats, SUM(Votes) as votes
+        FROM {grouped}
+        WHERE Year >= 1991 AND Year <= 2019
+        GROUP BY Year, State_Name, Party
+        """).fetchall()
+        if not rows:
+            return cls([], [], [], np.zeros((0, 0, 0)), np.zeros((0, 0, 0)), np.zeros((0, 0), dtype=bool))
+
+        year, state, party, seats, votes = zip(*rows)
+        years, year_index = np.unique(np.array(year), return_inverse=True)
+        states, state_index = np.unique(np.array(state, dtype=object), return_inverse=True)
+        parties, party_index = np.unique(np.array(party, dtype=object), return_inverse=True)
+
+        shape = (len(states), len(years), len(parties))
+        seat_matrix = np.zeros(shape)
+        vote_matrix = np.zeros(shape)
+        seat_matrix[state_index, year_index, party_index] = seats
+        vote_matrix[state_index, year_index, party_index] = np.array(votes, dtype=np.float64)
+
+        # A state without an election in a year has no seats or shares to compare, not zero
+        held = np.zeros(shape[:2], dtype=bool)
+        held[state_index, year_index] = True
+        seat_matrix[~held] = np.nan
+        vote_matrix[~held] = np.nan
+        return cls([int(y) for y in years], list(states), list(parties), seat_matrix, vote_matrix, held)
+
+    def scope(self, state=None):
+        """Seats and vote share (year, party) nationally or within one state"""
+        if state is None:
+            seats = np.nansum(self.seats, axis=0)
+            votes = np.nansum(self.votes, axis=0)
+            # nansum would turn a year without any election into zeros
+            held = self.held.any(axis=0)
+            seats[~held] = np.nan
+            votes[~held] = np.nan
+        else:
+            index = self.states.index(state)
+            seats, votes = self.seats[index], self.votes[index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = votes * 100.0 / votes.sum(axis=1, keepdims=True)
+        return seats, share
+
+    def pair_indices(self, pairs='consecutive', year1=None, year2=None):
+        """(earlier, later) year indices of the election pairs to compare"""
+        if year1 is not None and year2 is not None:
+            if year1 not in self.years or year2 not in self.years:
+                return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+            return np.array([self.years.index(year1)]), np.array([self.years.index(year2)])
+        if pairs == 'all':
+            return np.triu_indices(len(self.years), 1)
+        first = np.arange(max(len(self.years) - 1, 0))
+        return first, first + 1
+
+    def seat_change(self, year1, year2):
+        """Seat changes of every party that won seats in either year, largest first"""
+        seats, _ = self.scope()
+        earlier, later = self.pair_indices(year1=year1, year2=year2)
+        if not len(earlier):
+            return []
+        before, after = np.nan_to_num(seats[earlier[0]]), np.nan_to_num(seats[later[0]])
+        change = after - before
+        won = np.flatnonzero((before > 0) | (after > 0))
+        order = won[np.argsort(-np.abs(change[won]), kind='stable')]
+        return [{
+            'party': self.parties[i],
+            'year1_seats': int(before[i]),
+            'year2_seats': int(after[i]),
+            'change': int(change[i]),
+        } for i in order]
+
+    def _series(self, seats, share, earlier, later, party_indices):
+        seat_change = seats[later] - seats[earlier]
+        share_change = share[later] - share[earlier]
+        return [{
+            'party': self.parties[i],
+            'seats': _values(seats[:, i], integer=True),
+            'vote_share': _values(share[:, i]),
+            'seat_change': _values(seat_change[:, i], integer=True),
+            'vote_share_change': _values(share_change[:, i]),
+        } for i in party_indices]
+
+    def series(self, state=None, parties=None, pairs='consecutive', year1=None, year2=None,
+               limit=10, by_state=False):
+        """Per-party seats and vote share by year, and their changes by election pair"""
+        seats, share = self.scope(state)
+        earlier, later = self.pair_indices(pairs, year1, year2)
+
+        if parties:
+            party_indices = [self.parties.index(party) for party in parties if party in self.parties]
+        else:
+            # Parties whose seat counts moved the most over the selected pairs
+            movement = np.nansum(np.abs(seats[later] - seats[earlier]), axis=0)
+            party_indices = np.argsort(-movement, kind='stable')
+            party_indices = party_indices[movement[party_indices] > 0]
+            if limit:
+                party_indices = party_indices[:limit]
+
+        result = {
+            'state': state,
+            'years': self.years,
+            'pairs': [[self.years[i], self.years[j]] for i, j in zip(earlier, later)],
+            'parties': self._series(seats, share, earlier, later, party_indices),
+        }
+        if by_state:
+            result['states'] = []
+            for name in self.states:
+                state_seats, state_share = self.scope(name)
+                result['states'].append({
+                    'state': name,
+                    'parties': self._series(state_seats, state_share, earlier, later, party_indices),
+                })
+        return result
+
+
+# (database snapshot version, election type, grouping) -> matrix
+_matrices = {}
+_matrices_lock = threading.Lock()
+
+
+def get_matrix(get_db_connection, election_type=None, group_by=None, version=None):
+    """Return the process-wide matrix of an election type and grouping (parties
+    or coalitions) in a database version, building it on first use"""
+    key = (version, partitions.route(election_type).election_type, coalitions.grouping(group_by))
+    matrix = _matrices.get(key)
+    if matrix is None:
+        with _matrices_lock:
+            matrix = _matrices.get(key)
+            if matrix is None:
+                conn = get_db_connection()
+                try:
+                    matrix = _matrices[key] = ChangeMatrix.from_connection(conn, partitions.route(key[1]), key[2])
+                finally:
+                    conn.close()
+    return matrix
+
+
+def reload_matrices(get_db_connection, version=None):
+    """Build every matrix built so far from a new database version (or rebuild
+    them) before it is served"""
+    for election_type, group_by in {key[1:] for key in list(_matrices)}:
+        conn = get_db_connection()
+        try:
+            matrix = ChangeMatrix.from_connection(conn, partitions.route(election_type), group_by)
+        finally:
+            conn.close()
+        with _matrices_lock:
+            _matrices[version, election_type, group_by] = matrix
+
+
+def release_matrices(version):
+    """Drop the matrices of a database version that is no longer served"""
+    with _matrices_lock:
+        for key in [key for key in _matrices if key[0] == version]:
+            del _matrices[key]
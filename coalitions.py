@@ -0,0 +1,160 @@
+"""
+Coalition Groupings
+Maps (Year, State_Name, Party) to a coalition (NDA, UPA, Third Front, ...) in
+the coalitions table of the database, so aggregate endpoints can report
+alliances instead of parties with group_by=coalition. Membership changes by
+year and by state: a row with an empty State_Name applies in every state that
+year, and a row for a state overrides it there. Parties without a mapping
+stay a group of their own.
+
+The mapping is applied in SQL, joined onto the rows being aggregated, so a
+coalition total is one GROUP BY rather than one query per member party.
+
+Usage:
+    python coalitions.py load <mapping.csv> [db_path]   # replace the mapping
+    python coalitions.py list [db_path]
+
+The CSV has the columns Year,State_Name,Party,Coalition.
+"""
+
+import csv
+import sqlite3
+import sys
+
+import partitions
+
+TABLE = 'coalitions'
+
+GROUPINGS = ('party', 'coalition')
+
+
+class UnknownGrouping(ValueError):
+    pass
+
+
+def has_table(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE,)).fetchone()
+    return row is not None
+
+
+def create_table(conn):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        Year INTEGER NOT NULL,
+        State_Name TEXT,
+        Party TEXT NOT NULL,
+        Coalition TEXT NOT NULL
+    )
+    """)
+    # One coalition per party, year and state (or every state); also the join's lookup
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_key ON {TABLE} (Year, Party, IFNULL(State_Name, ''))")
+
+
+class Grouped:
+    """FROM-clause relation whose rows carry the group they are aggregated under.
+
+    label is the group to select as Party; grouped by party, the relation and
+    label are those of the underlying encoding.Coded, so the query is exactly
+    the ungrouped one.
+    """
+
+    def __init__(self, relation, label):
+        self.relation = relation
+        self.label = label
+
+    def __str__(self):
+        return self.relation
+
+
+def grouping(group_by=None):
+    """Grouping named by a request's group_by; raises UnknownGrouping"""
+    value = (group_by or 'party').lower()
+    if value not in GROUPINGS:
+        raise UnknownGrouping(f"Unknown group_by '{group_by}', expected one of {list(GROUPINGS)}")
+    return value
+
+
+def grouped(conn, coded, group_by=None):
+    """Grouped relation over an encoding.Coded; raises UnknownGrouping"""
+    if grouping(group_by) == 'party':
+        return Grouped(str(coded), coded.label('Party'))
+    if not has_table(conn):
+        # No coalitions defined: every party is its own group
+        return Grouped(str(coded), coded.label('Party'))
+
+    # The group replaces Party, so queries that GROUP BY Party (which SQLite
+    # resolves to the column, not to a select alias) group by coalition
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({partitions.VIEW})')]
+    select = ', '.join(
+        'COALESCE(state.Coalition, every_state.Coalition, results._party) AS Party' if column == 'Party'
+        else f'results.{column}'
+        for column in columns
+    )
+    # Labels are resolved in an inner select, where the mapping's own columns
+    # cannot make the (possibly coded) Party and State_Name ambiguous
+    relation = f"""(
+        SELECT {select}
+        FROM (SELECT *, {coded.label('Party')} AS _party, {coded.label('State_Name')} AS _state FROM {coded}) AS results
+        LEFT JOIN {TABLE} AS state
+            ON state.Year = results.Year AND state.Party = results._party AND IFNULL(state.State_Name, '') = results._state
+        LEFT JOIN {TABLE} AS every_state
+            ON every_state.Year = results.Year AND every_state.Party = results._party AND IFNULL(every_state.State_Name, '') = ''
+    )"""
+    return Grouped(relation, 'Party')
+
+
+def load(conn, path):
+    """Replace the mapping with the rows of a CSV file; returns the number of rows"""
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [
+            (int(row['Year']), row['State_Name'].strip() or None, row['Party'].strip(), row['Coalition'].strip())
+            for row in csv.DictReader(f)
+        ]
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        create_table(conn)
+        conn.execute(f'DELETE FROM {TABLE}')
+        conn.executemany(f'INSERT INTO {TABLE} (Year, State_Name, Party, Coalition) VALUES (?, ?, ?, ?)', rows)
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return len(rows)
+
+
+def mapping(conn):
+    if not has_table(conn):
+        return []
+    return conn.execute(f"""
+    SELECT Year, State_Name, Party, Coalition
+    FROM {TABLE}
+    ORDER BY Year, Coalition, IFNULL(State_Name, ''), Party
+    """).fetchall()
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('load', 'list') or (sys.argv[1] == 'load' and len(sys.argv) < 3):
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == 'load':
+        db_path = sys.argv[3] if len(sys.argv) > 3 else 'election_data2.db'
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            count = load(conn, sys.argv[2])
+        except sqlite3.IntegrityError:
+            print(f'{sys.argv[2]} maps a party to more than one coalition in the same year and state')
+            sys.exit(1)
+        finally:
+            conn.close()
+        print(f'Loaded {count} coalition memberships into {db_path}')
+        return
+
+    conn = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else 'election_data2.db')
+    for year, state, party, coalition in mapping(conn):
+        print(f"{year}  {coalition:<20} {state or 'all states':<30} {party}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
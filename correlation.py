@@ -0,0 +1,203 @@
+"""
+Win-Rate Correlation Engine
+Relates categorical or binary candidate attributes to winning: win rate, average
+vote share, a chi-square test of independence and the logistic-regression
+coefficient for every level, per election year and pooled over all years.
+"""
+
+import math
+
+import numpy as np
+
+# Attribute name -> how its raw column values are turned into levels
+ATTRIBUTES = {
+    'Sex': 'categorical',
+    'Incumbent': 'binary',
+    'Turncoat': 'binary',
+    'Recontest': 'binary',
+    'Party_Type_TCPD': 'categorical',
+    'Constituency_Type': 'categorical',
+    'No_Terms': 'buckets',
+}
+
+# No_Terms is a count, so it is grouped into buckets (lower bound, label)
+TERM_BUCKETS = [(0, '0'), (1, '1'), (2, '2'), (3, '3-4'), (5, '5+')]
+
+
+def load_columns(conn, attributes, year=None, state=None, source='election_results'):
+    """Fetch the outcome columns and the requested attributes as NumPy arrays"""
+    query = f"""
+    SELECT Year, Position, Vote_Share_Percentage, {', '.join(attributes)}
+    FROM {source}
+    WHERE Year >= 1991 AND Year <= 2019
+    """
+    params = []
+    if year:
+        query += " AND Year = ?"
+        params.append(year)
+    if state:
+        query += " AND State_Name = ?"
+        params.append(state)
+
+    rows = conn.execute(query, params).fetchall()
+    columns = list(zip(*rows)) if rows else [()] * (3 + len(attributes))
+    data = {
+        'Year': np.array(columns[0], dtype=np.int64),
+        'won': np.asarray(columns[1]) == 1,
+        'Vote_Share_Percentage': np.array(columns[2], dtype=float),
+    }
+    for name, values in zip(attributes, columns[3:]):
+        data[name] = np.array(values, dtype=object)
+    return data
+
+
+def encode_levels(kind, values):
+    """Map raw values to integer level codes; returns (labels, codes, valid mask)"""
+    valid = np.array([v is not None and v != '' for v in values], dtype=bool)
+
+    if kind == 'binary':
+        numeric = np.where(valid, values, 0).astype(float)
+        return ['0', '1'], (numeric != 0).astype(np.int64), valid
+
+    if kind == 'buckets':
+        numeric = np.where(valid, values, 0).astype(float)
+        bounds = np.array([lower for lower, _ in TERM_BUCKETS], dtype=float)
+        codes = np.searchsorted(bounds, numeric, side='right') - 1
+        return [label for _, label in TERM_BUCKETS], np.clip(codes, 0, None), valid
+
+    labels, codes = np.unique(values[valid].astype(str), return_inverse=True)
+    full = np.zeros(len(values), dtype=np.int64)
+    full[valid] = codes
+    return [str(label) for label in labels], full, valid
+
+
+def chi2_sf(x, dof):
+    """Survival function of the chi-square distribution (regularized upper gamma)"""
+    if dof <= 0 or not np.isfinite(x):
+        return None
+    if x <= 0:
+        return 1.0
+    a, z = dof / 2.0, x / 2.0
+    log_prefix = a * math.log(z) - z - math.lgamma(a)
+
+    if z < a + 1:
+        # Series for the lower incomplete gamma
+        term = total = 1.0 / a
+        n = a
+        for _ in range(500):
+            n += 1
+            term *= z / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+
+    # Continued fraction for the upper incomplete gamma
+    b = z + 1 - a
+    c = 1.0 / 1e-300
+    d = 1.0 / b
+    h = d
+    for i in range(1, 500):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = 1e-300 if abs(d) < 1e-300 else d
+        c = b + an / c
+        c = 1e-300 if abs(c) < 1e-300 else c
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, h * math.exp(log_prefix))
+
+
+def _grid(year_index, codes, n_years, n_levels, weights=None):
+    """Count (or sum weights) for every year x level cell, plus a pooled row"""
+    cells = np.bincount(year_index * n_levels + codes, weights=weights, minlength=n_years * n_levels)
+    cells = cells.reshape(n_years, n_levels)
+    return np.vstack([cells, cells.sum(axis=0, keepdims=True)])
+
+
+def attribute_grid(data, attribute):
+    """Compute every statistic for one attribute across all years at once"""
+    kind = ATTRIBUTES[attribute]
+    labels, codes, valid = encode_levels(kind, data[attribute])
+    # Same shape for every kind of attribute when the slice has no rows
+    if not labels or not valid.any():
+        return {'attribute': attribute, 'reference_level': None, 'years': []}
+
+    years, year_index = np.unique(data['Year'][valid], return_inverse=True)
+    codes = codes[valid]
+    won = data['won'][valid]
+    vote_share = data['Vote_Share_Percentage'][valid]
+    has_share = ~np.isnan(vote_share)
+    n_years, n_levels = len(years), len(labels)
+
+    totals = _grid(year_index, codes, n_years, n_levels)
+    winners = _grid(year_index, codes, n_years, n_levels, weights=won.astype(float))
+    share_sum = _grid(year_index[has_share], codes[has_share], n_years, n_levels, weights=vote_share[has_share])
+    share_count = _grid(year_index[has_share], codes[has_share], n_years, n_levels)
+    losers = totals - winners
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        win_rate = winners * 100.0 / totals
+        avg_share = share_sum / share_count
+
+        # Chi-square test of independence on the level x (won, lost) table
+        present = totals > 0
+        n = totals.sum(axis=1, keepdims=True)
+        expected_win = totals * winners.sum(axis=1, keepdims=True) / n
+        expected_loss = totals * losers.sum(axis=1, keepdims=True) / n
+        chi2 = np.where(present, (winners - expected_win) ** 2 / expected_win
+                        + (losers - expected_loss) ** 2 / expected_loss, 0.0)
+        chi2 = np.nansum(chi2, axis=1)
+        dof = present.sum(axis=1) - 1
+
+        # A one-hot logistic regression on a single attribute is saturated, so its
+        # MLE coefficients are exactly the log odds ratios against the reference
+        # level (0.5 added to every cell to keep empty cells finite)
+        reference = 0 if kind in ('binary', 'buckets') else int(np.argmax(totals[-1]))
+        log_odds = np.log((winners + 0.5) / (losers + 0.5))
+        coefficient = log_odds - log_odds[:, [reference]]
+        inverse_cells = 1.0 / (winners + 0.5) + 1.0 / (losers + 0.5)
+        std_error = np.sqrt(inverse_cells + inverse_cells[:, [reference]])
+
+    year_labels = [int(y) for y in years] + ['all']
+    results = []
+    for row, year_label in enumerate(year_labels):
+        has_reference = bool(present[row, reference])
+        levels = []
+        for col, label in enumerate(labels):
+            if not present[row, col]:
+                continue
+            compared = has_reference and col != reference
+            levels.append({
+                'value': label,
+                'candidates': int(totals[row, col]),
+                'winners': int(winners[row, col]),
+                'win_rate': float(win_rate[row, col]),
+                'avg_vote_share': None if np.isnan(avg_share[row, col]) else float(avg_share[row, col]),
+                'logit_coefficient': float(coefficient[row, col]) if compared else None,
+                'std_error': float(std_error[row, col]) if compared else None,
+            })
+        results.append({
+            'year': year_label,
+            'chi_square': float(chi2[row]),
+            'dof': int(dof[row]),
+            'p_value': chi2_sf(float(chi2[row]), int(dof[row])),
+            'levels': levels,
+        })
+
+    return {
+        'attribute': attribute,
+        'reference_level': labels[reference],
+        'years': results,
+    }
+
+
+def compute(conn, attributes=None, year=None, state=None, source='election_results'):
+    """Correlation results for each attribute, sliced by year and state, read from source"""
+    attributes = attributes or list(ATTRIBUTES)
+    data = load_columns(conn, attributes, year, state, source)
+    return [attribute_grid(data, attribute) for attribute in attributes]
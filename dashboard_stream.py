@@ -0,0 +1,85 @@
+"""
+Progressive Dashboard Stream
+Computes every chart and analytics payload the dashboard needs in parallel and
+emits each one as soon as it is ready, as NDJSON lines or Server-Sent Events,
+so the first chart can render after the cheapest query instead of the slowest.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import datasets
+import tracing
+
+# (key, url, takes the year filter)
+CHART_PARTS = [
+    ('seatShare', '/api/party-seat-share', True),
+    ('turnout', '/api/state-turnout', True),
+    ('gender', '/api/gender-representation', False),
+    ('voteShare', '/api/top-parties-vote-share?limit=10', True),
+    ('margin', '/api/margin-distribution', True),
+    ('nationalVsRegional', '/api/analytics/national-vs-regional', False),
+]
+
+ANALYTICS_PARTS = [
+    ('highestTurnout', '/api/analytics/highest-turnout-state', False),
+    ('womenPercentage', '/api/analytics/women-percentage', False),
+    ('seatChange', '/api/analytics/seat-change', False),
+    ('narrowMargins', '/api/analytics/narrowest-margins?limit=5', False),
+]
+
+_executor = ThreadPoolExecutor(max_workers=len(CHART_PARTS) + len(ANALYTICS_PARTS),
+                               thread_name_prefix='dashboard-stream')
+
+
+def part_urls(year=None, analytics=True, election_type=None):
+    parts = CHART_PARTS + (ANALYTICS_PARTS if analytics else [])
+    urls = []
+    for key, url, by_year in parts:
+        if year and by_year:
+            url = f"{url}{'&' if '?' in url else '?'}year={year}"
+        if election_type:
+            url = f"{url}{'&' if '?' in url else '?'}election_type={election_type}"
+        urls.append((key, url))
+    return urls
+
+
+def _fetch(app, url, headers, environ):
+    # Goes through the normal request path, so cached responses are reused;
+    # buffered, so a streamed part is read to its end and closed
+    response = app.test_client().get(url, headers=headers, buffered=True, environ_base=environ)
+    return response.status_code, response.get_data()
+
+
+def _encode(key, status, body, elapsed_ms, sse):
+    # The view's JSON body is embedded as-is rather than decoded and re-encoded
+    line = (b'{"key":' + json.dumps(key).encode() + b',"status":' + str(status).encode()
+            + b',"elapsed_ms":' + f'{elapsed_ms:.1f}'.encode() + b',"data":' + body.strip() + b'}')
+    if sse:
+        return b'event: part\ndata: ' + line + b'\n\n'
+    return line + b'\n'
+
+
+def stream(app, year=None, analytics=True, sse=False, election_type=None):
+    """Yield one encoded part per payload, in completion order"""
+    start = time.perf_counter()
+    # Parts run on pool threads; the header makes their spans part of this request's trace
+    headers = tracing.propagation_headers()
+    # ... and read the dataset and database version this request is pinned to
+    environ = datasets.request_environ()
+    futures = {_executor.submit(_fetch, app, url, headers, environ): key for key, url in part_urls(year, analytics, election_type)}
+    try:
+        for future in as_completed(futures):
+            key = futures[future]
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            try:
+                status, body = future.result()
+            except Exception as e:
+                status, body = 500, json.dumps({'error': str(e)}).encode()
+            yield _encode(key, status, body, elapsed_ms, sse)
+        if sse:
+            yield b'event: done\ndata: {}\n\n'
+    finally:
+        for future in futures:
+            future.cancel()
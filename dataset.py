@@ -0,0 +1,322 @@
+"""
+Shared Column Store
+Loads the Lok Sabha election results (1991-2019) into contiguous read-only
+NumPy arrays packed into a single anonymous memory mapping. When built in the gunicorn master before
+forking (see gunicorn.conf.py) every worker shares the same physical pages
+copy-on-write: the data lives in flat buffers rather than Python objects, so
+reference counting in the workers never writes to them.
+
+Text columns are dictionary encoded: an int32 code per row plus one UTF-8 blob
+of sorted labels and an offsets array.
+
+Usage:
+    python dataset.py info                # build the store and print its layout
+    python dataset.py memory <master_pid> # private vs shared RSS of each worker
+"""
+
+import gc
+import mmap
+import os
+import sys
+import threading
+from bisect import bisect_left
+
+import numpy as np
+
+import partitions
+
+ALIGNMENT = 64
+
+# Derived aggregates computed once at load time: name -> fn(store) -> ndarray,
+# or a dict of suffix -> ndarray stored as name.suffix
+DERIVED = {}
+
+
+def register_derived(name, fn):
+    """Register an aggregate (or a structure of several arrays) to be precomputed
+    into the shared buffer"""
+    DERIVED[name] = fn
+
+
+class Labels:
+    """Sorted label strings stored as one UTF-8 blob plus offsets"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def code(self, value):
+        """Code of `value`, or -1 if it never occurs"""
+        index = bisect_left(self, value)
+        if index < len(self) and self[index] == value:
+            return index
+        return -1
+
+
+class ColumnStore:
+    def __init__(self, buffer, arrays, text_columns, n_rows):
+        self.buffer = buffer
+        self.arrays = arrays
+        self.text_columns = text_columns
+        self.n_rows = n_rows
+        self.labels = {
+            name: Labels(arrays[f'{name}.blob'], arrays[f'{name}.offsets'])
+            for name in text_columns
+        }
+
+    def __getitem__(self, name):
+        """Numeric values, or int32 codes for a text column"""
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def code(self, column, value):
+        return self.labels[column].code(value)
+
+    def decode(self, column, codes):
+        labels = self.labels[column]
+        return [None if code < 0 else labels[code] for code in codes]
+
+    def info(self):
+        return {
+            'rows': self.n_rows,
+            'bytes': len(self.buffer),
+            'columns': {name: str(array.dtype) for name, array in self.arrays.items() if '.' not in name},
+        }
+
+
+def _read_columns(conn):
+    info = conn.execute("PRAGMA table_info(election_results)").fetchall()
+    names = [row[1] for row in info]
+    types = {row[1]: (row[2] or '').upper() for row in info}
+
+    # Rows of the default (Lok Sabha) partitions
+    cursor = conn.execute(f"""
+    SELECT {', '.join(names)}
+    FROM {partitions.source(conn)}
+    WHERE Year >= 1991 AND Year <= 2019
+    ORDER BY Year, State_Name, Constituency_No, Position
+    """)
+    values = {name: [] for name in names}
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for name, column in zip(names, zip(*rows)):
+            values[name].extend(column)
+    return names, types, values
+
+
+def _encode_text(values):
+    labels = sorted({value for value in values if value is not None})
+    lookup = {label: code for code, label in enumerate(labels)}
+    codes = np.fromiter((lookup.get(value, -1) for value in values), dtype=np.int32, count=len(values))
+    encoded = [label.encode('utf-8') for label in labels]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(label) for label in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return codes, blob, offsets
+
+
+def _encode_numeric(values, declared):
+    if 'INT' in declared and all(value is not None for value in values):
+        return np.array(values, dtype=np.int64)
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+def _pack(arrays):
+    """Copy arrays into one read-only anonymous mapping"""
+    offsets = {}
+    size = 0
+    for name, array in arrays.items():
+        size = (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        offsets[name] = size
+        size += array.nbytes
+    buffer = mmap.mmap(-1, max(size, 1))
+
+    packed = {}
+    for name, array in arrays.items():
+        view = np.frombuffer(buffer, dtype=array.dtype, count=array.size, offset=offsets[name])
+        view[:] = array.ravel()
+        view = view.reshape(array.shape)
+        view.flags.writeable = False
+        packed[name] = view
+    return buffer, packed
+
+
+def run_starts(*columns):
+    """Mask of the rows of sorted key columns that start a new run of equal keys"""
+    with np.errstate(invalid='ignore'):
+        # Missing (NaN) keys all cast to the same integer, so they form one run
+        keys = np.stack(columns).astype(np.int64)
+    boundary = np.ones(keys.shape[1], dtype=bool)
+    boundary[1:] = np.any(keys[:, 1:] != keys[:, :-1], axis=0)
+    return boundary
+
+
+def _contest_ids(store):
+    """Integer id per row for its (Year, State, Constituency) contest"""
+    boundary = run_starts(store['Year'], store['State_Name'], store['Constituency_No'])
+    return np.cumsum(boundary).astype(np.int32) - 1
+
+
+register_derived('contest_id', _contest_ids)
+
+
+def build_store(conn):
+    names, types, values = _read_columns(conn)
+    n_rows = len(values[names[0]]) if names else 0
+
+    arrays = {}
+    text_columns = []
+    for name in names:
+        if 'CHAR' in types[name] or 'TEXT' in types[name] or 'CLOB' in types[name]:
+            codes, blob, offsets = _encode_text(values[name])
+            arrays[name] = codes
+            arrays[f'{name}.blob'] = blob
+            arrays[f'{name}.offsets'] = offsets
+            text_columns.append(name)
+        else:
+            arrays[name] = _encode_numeric(values[name], types[name])
+        # Drop the Python objects as soon as each column is encoded
+        values[name] = None
+
+    store = ColumnStore(b'', arrays, text_columns, n_rows)
+    for name, fn in DERIVED.items():
+        derived = fn(store)
+        if isinstance(derived, dict):
+            arrays.update((f'{name}.{suffix}', array) for suffix, array in derived.items())
+        else:
+            arrays[name] = derived
+
+    buffer, packed = _pack(arrays)
+    return ColumnStore(buffer, packed, text_columns, n_rows)
+
+
+# Database snapshot version -> store
+_stores = {}
+_store_lock = threading.Lock()
+
+
+def preload(db_path, version=None):
+    """Build the store in this process (the pre-fork master) and freeze the heap"""
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    try:
+        store = build_store(conn)
+    finally:
+        conn.close()
+    with _store_lock:
+        _stores[version] = store
+    # Move everything allocated so far out of the collector's reach, so that
+    # workers' GC passes do not write to (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+    return store
+
+
+def get_store(get_db_connection, version=None):
+    """Return the shared store of a database version, building it on first use if
+    it was not preloaded"""
+    store = _stores.get(version)
+    if store is None:
+        with _store_lock:
+            store = _stores.get(version)
+            if store is None:
+                conn = get_db_connection()
+                try:
+                    store = _stores[version] = build_store(conn)
+                finally:
+                    conn.close()
+    return store
+
+
+def reload_store(get_db_connection, version=None):
+    """Build the store of a new database version (or rebuild it) before it is served"""
+    if not _stores:
+        # Never built in this process, the next request builds it fresh
+        return
+    conn = get_db_connection()
+    try:
+        store = build_store(conn)
+    finally:
+        conn.close()
+    with _store_lock:
+        _stores[version] = store
+
+
+def release_store(version):
+    """Drop the store of a database version that is no longer served"""
+    with _store_lock:
+        _stores.pop(version, None)
+
+
+def memory_report(pid='self'):
+    """Resident memory split into private and shared pages, in kB (Linux only)"""
+    report = {'pid': os.getpid() if pid == 'self' else int(pid)}
+    path = f'/proc/{pid}/smaps_rollup'
+    if not os.path.exists(path):
+        report['error'] = 'smaps_rollup not available on this platform'
+        return report
+
+    fields = {}
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+
+    report.update({
+        'rss_kb': fields.get('Rss', 0),
+        'pss_kb': fields.get('Pss', 0),
+        'shared_kb': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'private_kb': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        'private_dirty_kb': fields.get('Private_Dirty', 0),
+    })
+    return report
+
+
+def worker_pids(master_pid):
+    pids = []
+    task_dir = f'/proc/{master_pid}/task'
+    for task in os.listdir(task_dir):
+        with open(os.path.join(task_dir, task, 'children'), 'r') as f:
+            pids.extend(int(pid) for pid in f.read().split())
+    return pids
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('info', 'memory'):
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == 'info':
+        import sqlite3
+        conn = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else 'election_data2.db')
+        store = build_store(conn)
+        conn.close()
+        info = store.info()
+        print(f"Rows: {info['rows']}  Shared buffer: {info['bytes'] / 1024 / 1024:.1f} MB")
+        for name, dtype in info['columns'].items():
+            print(f"  {name:<25} {dtype}")
+        return
+
+    master = int(sys.argv[2])
+    print(f"{'PID':>8} {'RSS kB':>10} {'Shared kB':>10} {'Private kB':>11} {'PSS kB':>10}")
+    print("-" * 53)
+    for pid in [master] + worker_pids(master):
+        report = memory_report(pid)
+        print(f"{report['pid']:>8} {report.get('rss_kb', 0):>10} {report.get('shared_kb', 0):>10} "
+              f"{report.get('private_kb', 0):>11} {report.get('pss_kb', 0):>10}")
+
+
+if __name__ == '__main__':
+    main()
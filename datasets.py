@@ -0,0 +1,539 @@
+"""
+Datasets
+Serves several registered database files (the Lok Sabha results, a state's
+assembly results, a cleaned variant) from one process instead of one process
+per file. A request selects its dataset with a /datasets/<name>/ path prefix
+or a `dataset` query parameter; without either it reads the default dataset,
+the first one registered.
+
+Each dataset has its own database snapshots, pool of open connections,
+response cache budget and cache warmer schedule. Everything derived from its
+data is keyed by its snapshot versions, which carry its name, so the shared
+in-memory structures of two datasets never mix.
+
+Datasets are opened on their first request and closed after
+DATASET_IDLE_SECONDS without one (the default dataset stays open): their
+warmer stops, their pooled connections are closed and their cached responses
+and derived structures are dropped.
+
+Datasets are registered in the DATASETS environment variable as
+comma-separated name=path entries, each with optional :option=value settings:
+
+    DATASETS="lok_sabha=election_data2.db,kerala=kerala.db:cache_mb=16:warm=false"
+
+    cache_mb        response cache budget in MB (default: CACHE_MAX_BYTES)
+    pool            idle connections kept open (default: 4)
+    warm_interval   seconds between checks for a new database version (default: 5)
+    warm            precompute the dashboard's responses (default: true)
+
+Without DATASETS the app's own database is served as the only dataset.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode
+
+from flask import has_request_context, request
+
+import budgets
+import cache
+import snapshots
+import tracing
+from warmer import CacheWarmer
+
+logger = logging.getLogger(__name__)
+
+# WSGI environ key of the Dataset a request reads
+ENVIRON = 'datasets.dataset'
+# WSGI environ key of the connections a request checked out of the pools
+CONNECTIONS = 'datasets.connections'
+
+PREFIX = '/datasets/'
+PARAMETER = 'dataset'
+
+DEFAULT_NAME = 'default'
+POOL_SIZE = 4
+WARM_INTERVAL = 5.0
+
+# Seconds without a request after which a dataset is closed
+IDLE_SECONDS = float(os.environ.get('DATASET_IDLE_SECONDS', 900))
+
+DatasetConfig = namedtuple('DatasetConfig', 'name path cache_bytes pool_size warm_interval warm')
+
+_local = threading.local()
+
+
+class UnknownDataset(ValueError):
+    pass
+
+
+class DatasetClosed(RuntimeError):
+    """An internal request (of a warmer stopped when its dataset was closed)
+    reached a dataset that has been closed since"""
+
+
+def _parse(entry, base_dir=None):
+    name, _, spec = entry.partition('=')
+    path, *options = spec.split(':')
+    name, path = name.strip(), path.strip()
+    if not name or not path:
+        raise ValueError(f"Invalid DATASETS entry '{entry}', expected name=path[:option=value...]")
+    if base_dir is not None and os.path.exists(os.path.join(base_dir, path)):
+        path = os.path.join(base_dir, path)
+    settings = dict(option.partition('=')[::2] for option in options)
+    unknown = set(settings) - {'cache_mb', 'pool', 'warm_interval', 'warm'}
+    if unknown:
+        raise ValueError(f"Unknown DATASETS option(s) {sorted(unknown)} for '{name}'")
+    return DatasetConfig(
+        name=name,
+        path=path,
+        cache_bytes=int(float(settings['cache_mb']) * 1024 * 1024) if 'cache_mb' in settings else cache.DEFAULT_MAX_BYTES,
+        pool_size=int(settings.get('pool', POOL_SIZE)),
+        warm_interval=float(settings.get('warm_interval', WARM_INTERVAL)),
+        warm=settings.get('warm', 'true').lower() not in ('0', 'false', 'no'),
+    )
+
+
+def from_env(default_path, base_dir=None):
+    """Registered datasets, the default one first; relative paths are looked up
+    in base_dir first when given"""
+    entries = [entry.strip() for entry in os.environ.get('DATASETS', '').split(',') if entry.strip()]
+    if not entries:
+        return [DatasetConfig(DEFAULT_NAME, default_path, cache.DEFAULT_MAX_BYTES, POOL_SIZE, WARM_INTERVAL, True)]
+    configs = [_parse(entry, base_dir) for entry in entries]
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f'Duplicate dataset names in DATASETS: {names}')
+    return configs
+
+
+class _PoolConnection(tracing.TracedConnection):
+    """Connection kept open between requests; traced whenever the request
+    using it is sampled"""
+
+
+class PooledConnection:
+    """One checkout of a pooled connection. close() hands it back to the pool,
+    once: a response body may close its connection twice, and the second
+    close must not return a connection another request is using."""
+
+    __slots__ = ('_conn', '_pool')
+
+    def __init__(self, conn, pool):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_pool', pool)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool.put(conn)
+
+
+class ConnectionPool:
+    """Idle connections to the current snapshot of one dataset, reused instead
+    of opening the database file on every request"""
+
+    def __init__(self, manager, size=POOL_SIZE):
+        self.manager = manager
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = []
+        self.closed = False
+        self.opened = 0
+        self.reused = 0
+
+    def connect(self, path):
+        stale = []
+        conn = None
+        with self.lock:
+            while self.idle:
+                candidate = self.idle.pop()
+                if candidate.pool_path == path:
+                    conn = candidate
+                    self.reused += 1
+                    break
+                # Left from a retired snapshot
+                stale.append(candidate)
+            if conn is None:
+                self.opened += 1
+        for candidate in stale:
+            candidate.close()
+        if conn is None:
+            with tracing.span('sqlite.connect'):
+                conn = sqlite3.connect(path, factory=_PoolConnection, check_same_thread=False)
+            conn.pool_path = path
+        pooled = PooledConnection(conn, self)
+        if has_request_context():
+            # Handed back when the request ends if the view has not, e.g. on an error
+            request.environ.setdefault(CONNECTIONS, []).append(pooled)
+        return pooled
+
+    def put(self, conn):
+        # Budgets belong to the request that attached them, and an open
+        # transaction would keep the file's read lock
+        budgets.detach(conn)
+        conn.row_factory = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self.lock:
+            keep = (not self.closed and len(self.idle) < self.size
+                    and conn.pool_path == self.manager.current.path)
+            if keep:
+                self.idle.append(conn)
+        if not keep:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {'idle': len(self.idle), 'size': self.size, 'opened': self.opened, 'reused': self.reused}
+
+
+class Dataset:
+    def __init__(self, config, app, on_change=(), on_release=(), qualify=True):
+        self.config = config
+        self.name = config.name
+        self.app = app
+        self.on_change = list(on_change)
+        self.on_release = list(on_release)
+        # The default dataset keeps its unqualified snapshot versions
+        self.qualify = qualify
+        self.snapshots = None
+        self.cache = None
+        self.pool = None
+        self.warmer = None
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.snapshots is not None
+
+    def _pinned(self, callback):
+        def pinned_callback(version):
+            with pin(self):
+                callback(version)
+        return pinned_callback
+
+    def open(self):
+        manager = snapshots.SnapshotManager(self.config.path, self.name if self.qualify else None)
+        self.cache = cache.ResponseCache(self.config.cache_bytes)
+        self.pool = ConnectionPool(manager, self.config.pool_size)
+        manager.on_release.append(self.cache.release)
+        manager.on_release.extend(self.on_release)
+        self.warmer = CacheWarmer(self.app, self.cache, manager, interval=self.config.warm_interval,
+                                  on_change=[self._pinned(callback) for callback in self.on_change],
+                                  environ={ENVIRON: self}, dashboard=self.config.warm)
+        self.snapshots = manager
+        self.opened_at = time.time()
+        logger.info("Opened dataset %s (%s, version %s)", self.name, self.config.path, manager.current.version)
+
+    def close(self):
+        manager = self.snapshots
+        self.warmer.stop()
+        self.pool.close()
+        self.cache.clear()
+        self.snapshots = self.cache = self.pool = self.warmer = None
+        self.opened_at = None
+        # Closed with no request in flight, so no other version is draining
+        for callback in manager.on_release:
+            callback(manager.current.version)
+        logger.info("Closed dataset %s after %.0fs idle", self.name, time.monotonic() - self.last_used)
+
+    def stats(self):
+        result = {
+            'path': self.config.path,
+            'open': self.is_open,
+            'active': self.active,
+            'idle_seconds': round(time.monotonic() - self.last_used, 1),
+            'warm': self.config.warm,
+            'warm_interval': self.config.warm_interval,
+        }
+        if self.is_open:
+            result['opened_at'] = self.opened_at
+            result['version'] = self.snapshots.current.version
+            result['cache'] = {'bytes': self.cache.bytes_used, 'max_bytes': self.cache.max_bytes,
+                               'entries': len(self.cache.entries)}
+            result['pool'] = self.pool.stats()
+            result['last_warm'] = self.warmer.last_warm
+        return result
+
+
+def hand_off(conn):
+    """Keep conn open after its request ends, for the streamed response body
+    that now owns it and closes it"""
+    if has_request_context():
+        connections = request.environ.get(CONNECTIONS, [])
+        connections[:] = [checkout for checkout in connections if checkout is not conn]
+    return conn
+
+
+def pinned():
+    """Dataset the current thread is serving, if any"""
+    return getattr(_local, 'dataset', None)
+
+
+@contextmanager
+def pin(dataset):
+    """Read dataset on this thread inside the with block"""
+    previous, _local.dataset = pinned(), dataset
+    try:
+        yield dataset
+    finally:
+        _local.dataset = previous
+
+
+def request_environ():
+    """environ of an internal request reading what the current thread reads"""
+    environ = {}
+    dataset = pinned()
+    if dataset is not None:
+        environ[ENVIRON] = dataset
+    snapshot = snapshots.pinned()
+    if snapshot is not None:
+        environ[snapshots.ENVIRON] = snapshot
+    return environ
+
+
+class Registry:
+    def __init__(self, configs, app, on_change=(), on_release=(), idle_seconds=IDLE_SECONDS):
+        self.lock = threading.Lock()
+        self.datasets = {}
+        for index, config in enumerate(configs):
+            self.datasets[config.name] = Dataset(config, app, on_change, on_release, qualify=index > 0)
+        self.default = self.datasets[configs[0].name]
+        self.idle_seconds = idle_seconds
+        self.started = False
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.closes = 0
+
+    def get(self, name=None):
+        if name is None:
+            return self.default
+        dataset = self.datasets.get(name)
+        if dataset is None:
+            raise UnknownDataset(f"Unknown dataset '{name}', expected one of {list(self.datasets)}")
+        return dataset
+
+    def _open(self, dataset):
+        # With the registry's lock held
+        if not dataset.is_open:
+            dataset.open()
+            if self.started:
+                dataset.warmer.start()
+
+    def current(self):
+        """Dataset of the request being served, else the default one (opened if needed)"""
+        dataset = pinned() or self.default
+        if not dataset.is_open:
+            with self.lock:
+                if dataset is not self.default and not dataset.is_open:
+                    # Pinned by a warmer callback still running after the dataset was closed
+                    raise DatasetClosed(f"Dataset '{dataset.name}' has been closed")
+                self._open(dataset)
+        return dataset
+
+    def acquire(self, dataset, reopen=True):
+        """Count a request reading dataset, opening it if needed; with reopen
+        False, raise DatasetClosed instead of opening a closed dataset"""
+        with self.lock:
+            if not reopen and not dataset.is_open:
+                raise DatasetClosed(f"Dataset '{dataset.name}' has been closed")
+            self._open(dataset)
+            dataset.active += 1
+            dataset.last_used = time.monotonic()
+        return dataset
+
+    def release(self, dataset):
+        with self.lock:
+            dataset.active -= 1
+            dataset.last_used = time.monotonic()
+
+    def reap(self):
+        """Close the datasets idle for longer than idle_seconds"""
+        now = time.monotonic()
+        with self.lock:
+            for dataset in self.datasets.values():
+                if (dataset is not self.default and dataset.is_open and dataset.active == 0
+                        and now - dataset.last_used > self.idle_seconds):
+                    dataset.close()
+                    self.closes += 1
+
+    def run(self):
+        while not self.stop_event.wait(min(self.idle_seconds / 4, 60)):
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Failed to close idle datasets")
+
+    def start(self):
+        """Start the warmers of the open datasets (and of those opened later) and
+        the thread closing idle ones"""
+        with self.lock:
+            self.started = True
+            for dataset in self.datasets.values():
+                if dataset.is_open:
+                    dataset.warmer.start()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='dataset-reaper', daemon=True)
+            self.thread.start()
+        return self
+
+    def stats(self):
+        with self.lock:
+            return {
+                'default': self.default.name,
+                'idle_seconds': self.idle_seconds,
+                'closes': self.closes,
+                'datasets': {name: dataset.stats() for name, dataset in self.datasets.items()},
+            }
+
+
+class Current:
+    """Attribute of the dataset being served (its snapshots, cache or pool), so
+    code written for one database reads the selected one"""
+
+    def __init__(self, registry, attribute):
+        object.__setattr__(self, '_registry', registry)
+        object.__setattr__(self, '_attribute', attribute)
+
+    def _target(self):
+        return getattr(self._registry.current(), self._attribute)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+
+
+def _select(environ, registry):
+    """Dataset named by the request's path prefix or query parameter, with the
+    selection removed from the URL the app sees"""
+    path = environ.get('PATH_INFO', '')
+    if path.startswith(PREFIX):
+        name, slash, rest = path[len(PREFIX):].partition('/')
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + PREFIX + name
+        environ['PATH_INFO'] = slash + rest if slash else '/'
+        return registry.get(name)
+    query = environ.get('QUERY_STRING', '')
+    if PARAMETER + '=' in query:
+        args = parse_qsl(query, keep_blank_values=True)
+        names = [value for key, value in args if key == PARAMETER]
+        if names:
+            # The cache keys and the views see the rest of the parameters only
+            environ['QUERY_STRING'] = urlencode([(key, value) for key, value in args if key != PARAMETER])
+            return registry.get(names[-1] or None)
+    return registry.default
+
+
+class _DatasetBody:
+    """Response body read with its request's dataset pinned, which is released
+    after the last chunk (or when the response is closed early)"""
+
+    def __init__(self, body, registry, dataset):
+        self.body = body
+        self.registry = registry
+        self.dataset = dataset
+        self.released = False
+
+    def __iter__(self):
+        chunks = iter(self.body)
+        while True:
+            with pin(self.dataset):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+            yield chunk
+        self.release()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.registry.release(self.dataset)
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                with pin(self.dataset):
+                    close()
+        finally:
+            self.release()
+
+
+def _error(start_response, status, message):
+    body = json.dumps({'error': message}).encode('utf-8')
+    start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def install(app, registry):
+    """Route every request to its dataset (or the one set in its environ by an
+    internal request), opening it if needed, until its response has been sent.
+    Internal requests do not reopen a closed dataset: they can only come from
+    its warmer, stopped when the dataset was closed, finishing its last fetch.
+
+    The pooled connections a view leaves open, when it raises for instance, are
+    handed back when its request ends."""
+
+    def middleware(wsgi_app):
+        def dataset_app(environ, start_response):
+            dataset = environ.get(ENVIRON)
+            internal = dataset is not None
+            if not internal:
+                try:
+                    dataset = _select(environ, registry)
+                except UnknownDataset as e:
+                    return _error(start_response, '404 NOT FOUND', str(e))
+                environ[ENVIRON] = dataset
+            try:
+                registry.acquire(dataset, reopen=not internal)
+            except DatasetClosed as e:
+                return _error(start_response, '503 SERVICE UNAVAILABLE', str(e))
+
+            def dataset_start_response(status, headers, exc_info=None):
+                return start_response(status, headers + [('X-Dataset', dataset.name)], exc_info)
+
+            try:
+                with pin(dataset):
+                    body = wsgi_app(environ, dataset_start_response)
+            except BaseException:
+                registry.release(dataset)
+                raise
+            return _DatasetBody(body, registry, dataset)
+        return dataset_app
+
+    @app.teardown_request
+    def close_connections(exc):
+        for conn in request.environ.pop(CONNECTIONS, []):
+            conn.close()
+
+    app.wsgi_app = middleware(app.wsgi_app)
+    return registry
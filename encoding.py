@@ -0,0 +1,314 @@
+"""
+Dictionary-Encoded Storage
+Moves the low-cardinality text columns out of every candidate row into
+integer-keyed lookup tables. Each storage table (every partition, or
+election_results when the database is not partitioned) is rewritten as
+<table>_codes holding the integer ids, and <table> becomes a view that decodes
+them, so every existing query keeps working unchanged.
+
+Decoding through the view costs a lookup per row, so the endpoints read the
+_codes tables directly through Coded: they group, filter and sort on the
+integer ids, read distinct lists from the lookup tables, and decode only the
+group labels or the rows returned. Ids are assigned in
+sorted label order, so grouping or ordering by id gives the same order as by
+the text.
+
+Usage:
+    python encoding.py encode [db_path]
+    python encoding.py decode [db_path]
+    python encoding.py report [db_path]   # file size and endpoint times, plain vs encoded
+"""
+
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import partitions
+
+COLUMNS = ['State_Name', 'Party', 'Sex', 'Party_Type_TCPD', 'Constituency_Type', 'Deposit_Lost', 'Election_Type']
+
+# Catalog of the encoded columns and their original declared types
+DICTIONARY = 'dictionary_columns'
+CODES_SUFFIX = '_codes'
+
+# Routes timed by the report
+BENCHMARK_URLS = [
+    '/api/party-seat-share',
+    '/api/party-seat-share?year=2019',
+    '/api/state-turnout',
+    '/api/top-parties-vote-share?limit=10',
+    '/api/gender-representation',
+    '/api/analytics/national-vs-regional',
+    '/api/analytics/seat-change',
+    '/api/analytics/highest-turnout-state',
+    '/api/analytics/women-percentage',
+    '/api/analytics/narrowest-margins?limit=20',
+    '/api/filters/years',
+    '/api/filters/states',
+    '/api/filters/parties',
+    '/api/search',
+    '/api/search?candidate=Ram',
+    '/api/search?party=BJP&state=State_1',
+    '/api/export?format=csv',
+]
+
+
+def lookup_table(column):
+    return f'lookup_{column.lower()}'
+
+
+def is_encoded(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (DICTIONARY,)).fetchone()
+    return row is not None
+
+
+def _storage_tables(conn):
+    return [partition.table for partition in partitions.catalog(conn)]
+
+
+def _columns(conn, table):
+    return [(row[1], row[2]) for row in conn.execute(f'PRAGMA table_info({table})').fetchall()]
+
+
+def _indexes(conn, table):
+    """(name, [columns]) of the explicit indexes on table"""
+    names = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                         (table,)).fetchall()
+    return [(name, [row[2] for row in conn.execute(f'PRAGMA index_info({name})').fetchall()]) for (name,) in names]
+
+
+def _create_indexes(conn, table, indexes):
+    for name, columns in indexes:
+        conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+
+
+def _decoding_columns(columns, alias='c'):
+    """Select list of columns read from coded rows aliased as alias, dictionary ids decoded"""
+    return ', '.join(
+        f'(SELECT value FROM {lookup_table(name)} WHERE id = {alias}.{name}) AS {name}' if name in COLUMNS
+        else f'{alias}.{name}'
+        for name, _ in columns
+    )
+
+
+def _decoding_select(columns, codes_table):
+    return f"SELECT {_decoding_columns(columns)} FROM {codes_table} c"
+
+
+def encode(conn):
+    """Replace every storage table with integer codes plus a decoding view"""
+    if is_encoded(conn):
+        return
+    tables = _storage_tables(conn)
+    declared = dict(_columns(conn, tables[0]))
+
+    conn.execute(f'CREATE TABLE {DICTIONARY} (column_name TEXT PRIMARY KEY, declared_type TEXT)')
+    for column in COLUMNS:
+        conn.execute(f'CREATE TABLE {lookup_table(column)} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)')
+        distinct = ' UNION '.join(f'SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL' for table in tables)
+        conn.execute(f'INSERT INTO {lookup_table(column)} (value) SELECT * FROM ({distinct}) ORDER BY 1')
+        conn.execute(f'INSERT INTO {DICTIONARY} VALUES (?, ?)', (column, declared.get(column)))
+
+    for table in tables:
+        columns = _columns(conn, table)
+        definition = ', '.join(f"{name} {'INTEGER' if name in COLUMNS else declared_type}"
+                               for name, declared_type in columns)
+        expressions = [
+            f'(SELECT id FROM {lookup_table(name)} WHERE value = t.{name})' if name in COLUMNS else f't.{name}'
+            for name, _ in columns
+        ]
+        codes = table + CODES_SUFFIX
+        conn.execute(f'CREATE TABLE {codes} ({definition})')
+        # Original row order is kept so sums and ties come out exactly as before
+        conn.execute(f"INSERT INTO {codes} SELECT {', '.join(expressions)} FROM {table} t ORDER BY rowid")
+        indexes = _indexes(conn, table)
+        conn.execute(f'DROP TABLE {table}')
+        _create_indexes(conn, codes, indexes)
+        conn.execute(f'CREATE VIEW {table} AS {_decoding_select(columns, codes)}')
+
+
+def decode(conn):
+    """Turn the encoded storage back into plain tables"""
+    if not is_encoded(conn):
+        return
+    declared = dict(conn.execute(f'SELECT column_name, declared_type FROM {DICTIONARY}').fetchall())
+
+    for table in _storage_tables(conn):
+        codes = table + CODES_SUFFIX
+        columns = _columns(conn, codes)
+        definition = ', '.join(f"{name} {declared[name] if name in COLUMNS else declared_type}"
+                               for name, declared_type in columns)
+        conn.execute(f'DROP VIEW {table}')
+        conn.execute(f'CREATE TABLE {table} ({definition})')
+        conn.execute(f'INSERT INTO {table} {_decoding_select(columns, codes)} ORDER BY c.rowid')
+        indexes = _indexes(conn, codes)
+        conn.execute(f'DROP TABLE {codes}')
+        _create_indexes(conn, table, indexes)
+
+    for column in declared:
+        conn.execute(f'DROP TABLE {lookup_table(column)}')
+    conn.execute(f'DROP TABLE {DICTIONARY}')
+
+
+class Coded:
+    """FROM-clause relation over the integer-coded storage of a route's partitions.
+
+    Dictionary columns hold ids here: select them through label(), and test
+    them against text with values() or equals(). On plain storage these return
+    the column and the text unchanged, so the same query runs on either layout.
+    Since ids follow the text order, ORDER BY a dictionary column sorts alike
+    on both.
+    """
+
+    def __init__(self, relation, encoded, tables=()):
+        self.relation = relation
+        self.encoded = encoded
+        self.tables = list(tables)
+
+    def __str__(self):
+        return self.relation
+
+    def label(self, column):
+        if self.encoded and column in COLUMNS:
+            return f'(SELECT value FROM {lookup_table(column)} WHERE id = {column})'
+        return column
+
+    def values(self, column, *values):
+        literals = ', '.join("'" + value.replace("'", "''") + "'" for value in values)
+        if self.encoded and column in COLUMNS:
+            return f'(SELECT id FROM {lookup_table(column)} WHERE value IN ({literals}))'
+        return f'({literals})'
+
+    def equals(self, column):
+        """Predicate comparing column with one text parameter (?)"""
+        if self.encoded and column in COLUMNS:
+            return f'{column} = (SELECT id FROM {lookup_table(column)} WHERE value = ?)'
+        return f'{column} = ?'
+
+    def distinct(self, column, where='1'):
+        """Query of the distinct non-null values of column in the rows matching
+        where, in text order; dictionary columns are read from their lookup table"""
+        if self.encoded and column in COLUMNS:
+            return (f'SELECT value AS {column} FROM {lookup_table(column)} '
+                    f'WHERE id IN (SELECT {column} FROM {self} WHERE {where}) ORDER BY id')
+        return f'SELECT DISTINCT {column} FROM {self} WHERE ({where}) AND {column} IS NOT NULL ORDER BY {column}'
+
+    def columns(self, conn, alias):
+        """Select list of every column, decoded, of this relation aliased as
+        alias: what SELECT * returns from the decoding views"""
+        if not self.encoded:
+            return f'{alias}.*'
+        return _decoding_columns(_columns(conn, self.tables[0]), alias)
+
+    def decoder(self, conn):
+        """Function decoding a batch of SELECT * rows of this relation, for reads
+        of whole rows, where mapping the ids in Python beats a lookup per row"""
+        if not self.encoded:
+            return lambda rows: rows
+        lookups = [
+            (position, dict(conn.execute(f'SELECT id, value FROM {lookup_table(name)}').fetchall()))
+            for position, (name, _) in enumerate(_columns(conn, self.tables[0])) if name in COLUMNS
+        ]
+
+        def decode(rows):
+            decoded = []
+            for row in rows:
+                row = list(row)
+                for position, values in lookups:
+                    row[position] = values.get(row[position])
+                decoded.append(row)
+            return decoded
+        return decode
+
+
+def coded(conn, route):
+    """Coded relation for a partitions.Route"""
+    tables = route.tables(conn)
+    if tables and is_encoded(conn):
+        codes = [table + CODES_SUFFIX for table in tables]
+        return Coded(partitions.relation(codes), True, codes)
+    return Coded(partitions.relation(tables), False, tables)
+
+
+def _convert(db_path, convert):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        convert(conn)
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def _time_url(client, url, db_paths, repeat, environ):
+    """Median latency and last body of url against each database, alternating between them"""
+    import snapshots
+
+    samples = {db_path: [] for db_path in db_paths}
+    bodies = {}
+    for _ in range(repeat):
+        # Interleaved so that background load affects both layouts alike
+        for db_path in db_paths:
+            start = time.perf_counter()
+            # Buffered, so streamed bodies are timed to their last byte; each
+            # copy is served as a database version of its own
+            response = client.get(url, buffered=True, environ_overrides={
+                **environ, snapshots.ENVIRON: snapshots.Snapshot(db_path, db_path)})
+            samples[db_path].append((time.perf_counter() - start) * 1000)
+            bodies[db_path] = response.get_data()
+    return {db_path: statistics.median(samples[db_path]) for db_path in db_paths}, bodies
+
+
+def report(db_path, repeat=30):
+    """Compare file size and aggregation latency of plain and encoded copies of db_path"""
+    # The report times the API routes themselves
+    import app
+    import cache
+
+    workdir = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(workdir, 'plain.db')
+        encoded = os.path.join(workdir, 'encoded.db')
+        shutil.copyfile(db_path, plain)
+        _convert(plain, decode)
+        shutil.copyfile(plain, encoded)
+        _convert(encoded, encode)
+
+        plain_size, encoded_size = os.path.getsize(plain), os.path.getsize(encoded)
+        print(f'File size: {plain_size:,} -> {encoded_size:,} bytes '
+              f'({(1 - encoded_size / plain_size) * 100:.1f}% smaller)')
+
+        client = app.app.test_client()
+        print(f"\n{'Route':<42} {'Plain ms':>9} {'Encoded ms':>11} {'Speedup':>8}  Same response")
+        totals = {plain: 0.0, encoded: 0.0}
+        for url in BENCHMARK_URLS:
+            timings, bodies = _time_url(client, url, [plain, encoded], repeat, {cache.BYPASS: True})
+            same = 'yes' if bodies[plain] == bodies[encoded] else 'NO'
+            print(f'{url:<42} {timings[plain]:>9.2f} {timings[encoded]:>11.2f} '
+                  f'{timings[plain] / timings[encoded]:>7.2f}x  {same}')
+            for path in totals:
+                totals[path] += timings[path]
+        print(f"{'Total':<42} {totals[plain]:>9.2f} {totals[encoded]:>11.2f} {totals[plain] / totals[encoded]:>7.2f}x")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    db_path = sys.argv[2] if len(sys.argv) > 2 else 'election_data2.db'
+    if command == 'encode':
+        _convert(db_path, encode)
+    elif command == 'decode':
+        _convert(db_path, decode)
+    elif command == 'report':
+        report(db_path)
+    else:
+        print(__doc__)
+        sys.exit(1)
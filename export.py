@@ -0,0 +1,185 @@
+"""
+Bulk Export
+Streams every election_results row matching the search filters as CSV, NDJSON
+or Parquet. Rows are pulled from the cursor in fixed-size batches and written
+straight to the response, so server memory stays flat however many rows match.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from flask import Response
+
+import budgets
+import datasets
+import encoding
+import filters
+
+BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def _batches(cursor, first):
+    """first, the batch already fetched, then the rest of the cursor's rows"""
+    rows = first
+    while rows:
+        yield rows
+        rows = cursor.fetchmany(BATCH_SIZE)
+
+
+def csv_chunks(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def ndjson_chunks(batches, columns):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows).encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after each row group"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(batches, columns, declared_types):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def arrow_type(declared):
+        declared = (declared or '').upper()
+        if 'INT' in declared:
+            return pa.int64()
+        if 'REAL' in declared or 'FLOA' in declared or 'DOUB' in declared:
+            return pa.float64()
+        return pa.string()
+
+    schema = pa.schema([(name, arrow_type(declared_types.get(name))) for name in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in batches:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            # Each batch becomes one row group, written out before the next is fetched
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _ExportBody:
+    """Encoded chunks of the export; owns conn and closes it after the last
+    chunk (or when the response is closed early, even before the first)"""
+
+    def __init__(self, conn, chunks):
+        self.conn = conn
+        self.chunks = chunks
+
+    def __iter__(self):
+        try:
+            yield from self.chunks
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            self.chunks.close()
+        finally:
+            self.conn.close()
+
+
+def export_rows(get_db_connection, route, args, fmt):
+    """The connection and the encoded chunks of the export of the rows matching
+    the search filters in args.
+
+    The query runs and its first batch is fetched here, so SQL and budget
+    errors are raised from the view, before the status line is sent, rather
+    than cutting the file short.
+    """
+    conn = get_db_connection()
+    try:
+        # Filtered on the coded rows, which are decoded a batch at a time
+        coded = encoding.coded(conn, route)
+        where, params = filters.search_filters(args, coded)
+        cursor = conn.execute(f"SELECT * FROM {coded} WHERE {where}", params)
+        first = cursor.fetchmany(BATCH_SIZE)
+        columns = [description[0] for description in cursor.description]
+        batches = map(coded.decoder(conn), _batches(cursor, first))
+        if fmt == 'csv':
+            chunks = csv_chunks(batches, columns)
+        elif fmt == 'ndjson':
+            chunks = ndjson_chunks(batches, columns)
+        else:
+            declared = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(election_results)").fetchall()}
+            chunks = parquet_chunks(batches, columns, declared)
+    except BaseException:
+        conn.close()
+        raise
+    # The rest is paced by the client
+    budgets.detach(datasets.hand_off(conn))
+    return conn, chunks
+
+
+def export_response(get_db_connection, route, args, fmt, accept_encoding=''):
+    conn, chunks = export_rows(get_db_connection, route, args, fmt)
+    headers = {'Content-Disposition': f'attachment; filename="election_results.{fmt}"'}
+
+    # Parquet pages are already compressed
+    if fmt != 'parquet' and 'gzip' in accept_encoding.lower():
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+
+    return Response(_ExportBody(conn, chunks), mimetype=FORMATS[fmt], headers=headers)
@@ -0,0 +1,38 @@
+"""
+Request Filters
+Turns the search-style query parameters shared by /api/search and /api/export
+into SQL predicates on election_results, or on its integer-coded storage
+(encoding.Coded) so the dictionary columns are compared as ids.
+"""
+
+
+def search_filters(args, coded=None):
+    """Return (WHERE clause, params) for the candidate/constituency/year/state/party/gender filters"""
+    query = "Year >= 1991 AND Year <= 2019"
+    params = []
+
+    candidate = args.get('candidate', '')
+    constituency = args.get('constituency', '')
+    year = args.get('year', type=int)
+    state = args.get('state', '')
+    party = args.get('party', '')
+    gender = args.get('gender', '')
+
+    if candidate:
+        query += " AND Candidate LIKE ?"
+        params.append(f'%{candidate}%')
+
+    if constituency:
+        query += " AND Constituency_Name LIKE ?"
+        params.append(f'%{constituency}%')
+
+    if year:
+        query += " AND Year = ?"
+        params.append(year)
+
+    for column, value in (('State_Name', state), ('Party', party), ('Sex', gender)):
+        if value:
+            query += f" AND {coded.equals(column) if coded is not None else f'{column} = ?'}"
+            params.append(value)
+
+    return query, params
@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration for pre-fork serving.
+The election data is loaded into the shared column store (dataset.py) in the
+master process before the workers are forked, so all workers share one copy.
+
+    gunicorn -c gunicorn.conf.py
+"""
+
+import os
+
+import dataset
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+
+# Import the app in the master so everything it builds at import is shared too
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before any worker is forked
+    import app
+    # The default dataset's version being served, keyed like the workers' own lookups
+    current = app.snapshot_manager.current
+    store = dataset.preload(current.path, current.version)
+    server.log.info("Preloaded %d rows into %.1f MB shared column store",
+                    store.n_rows, len(store.buffer) / 1024 / 1024)
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork, so each worker starts its own cache warmers
+    # (and the thread closing idle datasets)
+    import app
+    app.registry.start()
+    server.log.info("Worker %s started: %s", worker.pid, dataset.memory_report())
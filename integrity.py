@@ -0,0 +1,398 @@
+"""
+Data Integrity Checks
+Validates the invariants of the election results described in
+SCHEMA_DOCUMENTATION.md (one winner per contest, Margin, Vote_Share_Percentage
+and Turnout_Percentage consistent with the vote counts, ...) and reports every
+violation.
+
+Rows are read in batches sorted by contest (Election_Type, Year, State_Name,
+Constituency_No, Poll_No) and Position into NumPy arrays, and every check is a
+group-wise array operation over a whole batch (bincount, reduceat, shifted
+comparisons), so no check loops over rows in Python. Fetching the rows from
+SQLite dominates the run time, so with --workers the elections are split into
+year ranges read by separate processes.
+
+Usage:
+    python integrity.py [db_path] [--workers N] [--samples N] [--json]
+
+Exits with status 1 if any invariant is violated, so it can gate a data load;
+`python partitions.py import` runs it on the incoming database first.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import dataset
+import partitions
+
+KEY = ['Election_Type', 'Year', 'State_Name', 'Constituency_No', 'Poll_No']
+TEXT_COLUMNS = ['Election_Type', 'State_Name']
+NUMERIC_COLUMNS = ['Year', 'Constituency_No', 'Poll_No', 'Position', 'Votes', 'Valid_Votes', 'Electors', 'N_Cand',
+                   'Turnout_Percentage', 'Vote_Share_Percentage', 'Margin', 'Margin_Percentage', 'Deposit_Lost']
+
+# Deposit_Lost is read as 1 (yes) / 0 (no)
+EXPRESSIONS = {'Deposit_Lost': "CASE Deposit_Lost WHEN 'yes' THEN 1 WHEN 'no' THEN 0 END"}
+
+# Columns that describe the contest rather than the candidate
+CONTEST_COLUMNS = ['Valid_Votes', 'Electors', 'N_Cand', 'Turnout_Percentage']
+
+# Vote counts are whole numbers stored as REAL; percentages are rounded in the source data
+VOTES_TOLERANCE = 0.5
+PERCENT_TOLERANCE = 0.01
+
+BATCH_ROWS = 100000
+SAMPLES = 5
+
+# Check name -> (unit counted, description, fn(batch) -> (rows, actual, expected))
+CHECKS = {}
+
+
+class ValidationError(ValueError):
+    def __init__(self, report):
+        super().__init__(f'{report.total_violations()} integrity violations')
+        self.report = report
+
+
+def check(name, unit, description):
+    def register(fn):
+        CHECKS[name] = (unit, description, fn)
+        return fn
+    return register
+
+
+class Batch:
+    """Column arrays of complete contests, sorted by contest and Position"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        start = _contest_starts(columns)
+        self.contest = np.cumsum(start) - 1
+        self.starts = np.flatnonzero(start)
+        self.sizes = np.diff(np.append(self.starts, len(start)))
+
+    def __len__(self):
+        return len(self.contest)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def contest_value(self, name):
+        """Value of name on the first row of each row's contest"""
+        return self.columns[name][self.starts][self.contest]
+
+    def describe(self, row):
+        """Contest key and Position of a row"""
+        entry = {}
+        for name in KEY + ['Position']:
+            value = self.columns[name][row]
+            if name not in TEXT_COLUMNS:
+                value = None if np.isnan(value) else int(value)
+            entry[name] = value
+        return entry
+
+
+@check('required_values', 'rows', 'Position, Votes, Valid_Votes and Electors are present')
+def _required_values(batch):
+    missing = np.zeros(len(batch), dtype=bool)
+    for name in ('Position', 'Votes', 'Valid_Votes', 'Electors'):
+        missing |= np.isnan(batch[name])
+    return np.flatnonzero(missing), None, None
+
+
+@check('single_winner', 'contests', 'Exactly one row with Position = 1 per contest')
+def _single_winner(batch):
+    winners = np.bincount(batch.contest, weights=batch['Position'] == 1, minlength=len(batch.starts))
+    bad = winners != 1
+    return batch.starts[bad], winners[bad], np.ones(bad.sum())
+
+
+@check('positions', 'rows', 'Positions run 1, 2, 3, ... within each contest')
+def _positions(batch):
+    expected = np.arange(len(batch)) - batch.starts[batch.contest] + 1
+    position = batch['Position']
+    bad = (position != expected) & ~np.isnan(position)
+    return np.flatnonzero(bad), position[bad], expected[bad]
+
+
+@check('votes_order', 'rows', 'Votes never increase with Position')
+def _votes_order(batch):
+    votes = batch['Votes']
+    bad = np.zeros(len(batch), dtype=bool)
+    bad[1:] = votes[1:] > votes[:-1] + VOTES_TOLERANCE
+    bad[batch.starts] = False
+    rows = np.flatnonzero(bad)
+    return rows, votes[rows], votes[rows - 1]
+
+
+@check('contest_constants', 'contests', 'Valid_Votes, Electors, N_Cand and Turnout_Percentage agree on every row of a contest')
+def _contest_constants(batch):
+    differs = np.zeros(len(batch), dtype=bool)
+    for name in CONTEST_COLUMNS:
+        value, first = batch[name], batch.contest_value(name)
+        differs |= (value != first) & ~(np.isnan(value) & np.isnan(first))
+    counts = np.bincount(batch.contest, weights=differs, minlength=len(batch.starts))
+    bad = counts > 0
+    return batch.starts[bad], counts[bad], np.zeros(bad.sum())
+
+
+@check('candidate_count', 'contests', 'N_Cand equals the number of candidate rows')
+def _candidate_count(batch):
+    n_cand = batch['N_Cand'][batch.starts]
+    bad = (n_cand != batch.sizes) & ~np.isnan(n_cand)
+    return batch.starts[bad], n_cand[bad], batch.sizes[bad]
+
+
+@check('valid_votes', 'contests', "Valid_Votes equals the sum of the candidates' Votes")
+def _valid_votes(batch):
+    total = np.add.reduceat(batch['Votes'], batch.starts)
+    valid = batch['Valid_Votes'][batch.starts]
+    bad = np.abs(valid - total) > VOTES_TOLERANCE
+    return batch.starts[bad], valid[bad], total[bad]
+
+
+@check('vote_share', 'rows', 'Vote_Share_Percentage equals 100 * Votes / Valid_Votes')
+def _vote_share(batch):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = 100 * batch['Votes'] / batch['Valid_Votes']
+    share = batch['Vote_Share_Percentage']
+    bad = np.abs(share - expected) > PERCENT_TOLERANCE
+    return np.flatnonzero(bad), share[bad], expected[bad]
+
+
+@check('turnout', 'contests', 'Turnout_Percentage equals 100 * Valid_Votes / Electors')
+def _turnout(batch):
+    starts = batch.starts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = 100 * batch['Valid_Votes'][starts] / batch['Electors'][starts]
+    turnout = batch['Turnout_Percentage'][starts]
+    bad = np.abs(turnout - expected) > PERCENT_TOLERANCE
+    return starts[bad], turnout[bad], expected[bad]
+
+
+@check('margin', 'contests', "Margin of the winner equals the top two candidates' vote difference")
+def _margin(batch):
+    starts = batch.starts[batch.sizes >= 2]
+    votes = batch['Votes']
+    expected = votes[starts] - votes[starts + 1]
+    margin = batch['Margin'][starts]
+    bad = np.abs(margin - expected) > VOTES_TOLERANCE
+    return starts[bad], margin[bad], expected[bad]
+
+
+@check('margin_percentage', 'contests', 'Margin_Percentage of the winner equals 100 * Margin / Valid_Votes')
+def _margin_percentage(batch):
+    starts = batch.starts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = 100 * batch['Margin'][starts] / batch['Valid_Votes'][starts]
+    percentage = batch['Margin_Percentage'][starts]
+    bad = np.abs(percentage - expected) > PERCENT_TOLERANCE
+    return starts[bad], percentage[bad], expected[bad]
+
+
+@check('deposit_lost', 'rows', 'Deposit_Lost is yes exactly for losing candidates with at most a sixth of Valid_Votes')
+def _deposit_lost(batch):
+    votes, valid = batch['Votes'], batch['Valid_Votes']
+    lost = (votes * 6 <= valid) & (batch['Position'] != 1)
+    deposit = batch['Deposit_Lost']
+    bad = (deposit != lost) & ~np.isnan(deposit) & ~np.isnan(votes) & ~np.isnan(valid)
+    return np.flatnonzero(bad), deposit[bad], lost[bad].astype(np.float64)
+
+
+class Report:
+    def __init__(self, samples=SAMPLES):
+        self.samples = samples
+        self.rows = 0
+        self.contests = 0
+        self.elapsed = 0.0
+        self.violations = {name: 0 for name in CHECKS}
+        self.examples = {name: [] for name in CHECKS}
+
+    @property
+    def ok(self):
+        return self.total_violations() == 0
+
+    def total_violations(self):
+        return sum(self.violations.values())
+
+    def add(self, batch):
+        self.rows += len(batch)
+        self.contests += len(batch.starts)
+        for name, (_, _, fn) in CHECKS.items():
+            rows, actual, expected = fn(batch)
+            self.violations[name] += len(rows)
+            examples = self.examples[name]
+            for i in range(min(len(rows), self.samples - len(examples))):
+                example = batch.describe(rows[i])
+                if actual is not None:
+                    example['actual'] = float(actual[i])
+                    example['expected'] = float(expected[i])
+                examples.append(example)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.contests += other.contests
+        for name in CHECKS:
+            self.violations[name] += other.violations[name]
+            self.examples[name].extend(other.examples[name][:self.samples - len(self.examples[name])])
+
+    def to_dict(self):
+        return {
+            'ok': self.ok,
+            'rows': self.rows,
+            'contests': self.contests,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'checks': [
+                {'check': name, 'description': description, 'unit': unit,
+                 'violations': self.violations[name], 'examples': self.examples[name]}
+                for name, (unit, description, _) in CHECKS.items()
+            ],
+        }
+
+    def format(self):
+        rate = self.rows / self.elapsed if self.elapsed else 0
+        lines = [f'{self.rows:,} rows in {self.contests:,} contests checked in {self.elapsed:.2f}s '
+                 f'({rate:,.0f} rows/s)', '']
+        for name, (unit, description, _) in CHECKS.items():
+            count = self.violations[name]
+            lines.append(f"{'FAIL' if count else 'ok':<5} {name:<18} {count:>9,} {unit:<8} {description}")
+            for example in self.examples[name]:
+                lines.append(f'        {json.dumps(example)}')
+        lines.append('')
+        lines.append('All invariants hold' if self.ok else f'{self.total_violations():,} violations')
+        return '\n'.join(lines)
+
+
+def _contest_starts(columns):
+    keys = []
+    for name in KEY:
+        column = columns[name]
+        if name in TEXT_COLUMNS:
+            # Rows are sorted, so numbering the runs of equal text is enough to compare keys
+            changed = np.ones(len(column), dtype=np.int64)
+            changed[1:] = column[1:] != column[:-1]
+            column = np.cumsum(changed)
+        keys.append(column)
+    return dataset.run_starts(*keys)
+
+
+def _arrays(rows):
+    columns = {}
+    for i, name in enumerate(TEXT_COLUMNS):
+        columns[name] = np.array([row[i] for row in rows], dtype=object)
+    numeric = np.array([row[len(TEXT_COLUMNS):] for row in rows], dtype=np.float64)
+    for i, name in enumerate(NUMERIC_COLUMNS):
+        columns[name] = numeric[:, i]
+    return columns
+
+
+def _batches(cursor):
+    """Batches of complete contests from a cursor sorted by contest"""
+    pending = None
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            break
+        columns = _arrays(rows)
+        if pending is not None:
+            columns = {name: np.concatenate([pending[name], column]) for name, column in columns.items()}
+        # The last contest may continue in the next batch
+        last = np.flatnonzero(_contest_starts(columns))[-1]
+        pending = {name: column[last:] for name, column in columns.items()}
+        if last:
+            yield Batch({name: column[:last] for name, column in columns.items()})
+    if pending is not None:
+        yield Batch(pending)
+
+
+def check_slice(db_path, table, years=None, samples=SAMPLES):
+    """Report for the rows of one table, optionally limited to a (first, last) year range"""
+    conn = sqlite3.connect(db_path)
+    try:
+        select = ', '.join(EXPRESSIONS.get(name, name) for name in TEXT_COLUMNS + NUMERIC_COLUMNS)
+        where, params = ('WHERE Year BETWEEN ? AND ?', years) if years else ('', ())
+        cursor = conn.execute(f"""
+        SELECT {select}
+        FROM {table}
+        {where}
+        ORDER BY {', '.join(KEY)}, Position
+        """, params)
+        report = Report(samples)
+        for batch in _batches(cursor):
+            report.add(batch)
+        return report
+    finally:
+        conn.close()
+
+
+def _slices(conn, workers):
+    """(table, year range) pieces of roughly equal row counts, about one per worker"""
+    tables = [partition.table for partition in partitions.catalog(conn)]
+    if workers <= 1:
+        return [(table, None) for table in tables]
+
+    counts = []
+    for table in tables:
+        counts.extend((table, year, rows) for year, rows in
+                      conn.execute(f'SELECT Year, COUNT(*) FROM {table} GROUP BY Year ORDER BY Year'))
+    target = sum(rows for _, _, rows in counts) / workers
+    slices = []
+    current, size = None, 0
+    for table, year, rows in counts:
+        # Contests never span years, so any year boundary can split the work
+        if current and (current[0] != table or size >= target):
+            slices.append(current)
+            current = None
+        if current is None:
+            current, size = (table, [year, year]), 0
+        current[1][1] = year
+        size += rows
+    if current:
+        slices.append(current)
+    return [(table, tuple(years)) for table, years in slices]
+
+
+def validate_database(db_path, workers=1, samples=SAMPLES):
+    """Check every row of the database at db_path and return the Report"""
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        slices = _slices(conn, workers)
+    finally:
+        conn.close()
+
+    report = Report(samples)
+    if workers <= 1:
+        for table, years in slices:
+            report.merge(check_slice(db_path, table, years, samples))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(check_slice, db_path, table, years, samples) for table, years in slices]
+            for future in futures:
+                report.merge(future.result())
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the invariants of the election results.')
+    parser.add_argument('db_path', nargs='?', default='election_data2.db')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes reading the data in parallel (default: one per CPU)')
+    parser.add_argument('--samples', type=int, default=SAMPLES, help='example violations listed per check')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = validate_database(args.db_path, args.workers, args.samples)
+    print(json.dumps(report.to_dict(), indent=2) if args.json else report.format())
+    sys.exit(0 if report.ok else 1)
+
+
+if __name__ == '__main__':
+    main()
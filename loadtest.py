@@ -0,0 +1,302 @@
+"""
+Load Test - Replay the Dashboard's Request Pattern
+Generates load against a locally running dashboard (or one started in-process)
+at several concurrency levels and reports throughput, latency percentiles and
+error rate. Only localhost targets are accepted.
+
+Examples:
+    python loadtest.py --in-process --concurrency 1,4,16 --duration 10
+    python loadtest.py --url http://127.0.0.1:5000 --scenario year-change
+    python loadtest.py --in-process --replay access.log --concurrency 8
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urlparse
+from urllib.request import urlopen
+
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+CHART_ENDPOINTS = [
+    '/api/party-seat-share',
+    '/api/state-turnout',
+    '/api/gender-representation',
+    '/api/top-parties-vote-share?limit=10',
+    '/api/margin-distribution',
+    '/api/analytics/national-vs-regional',
+]
+
+# Only these charts take the year filter in dashboard.js
+YEAR_FILTERED = {'/api/party-seat-share', '/api/state-turnout', '/api/top-parties-vote-share', '/api/margin-distribution'}
+
+DEFAULT_SEARCH_TERMS = ['Gandhi', 'Singh', 'Kumar']
+
+# Matches the request line in common/combined log format: "GET /path HTTP/1.1"
+LOG_REQUEST = re.compile(r'"GET (\S+) HTTP/[\d.]+"')
+
+
+def with_year(path, year):
+    route = path.split('?')[0]
+    if not year or route not in YEAR_FILTERED:
+        return path
+    return f"{path}{'&' if '?' in path else '?'}year={year}"
+
+
+def page_view():
+    """Batches fetched by a fresh page load; requests within a batch run in parallel"""
+    return [
+        ['/api/filters/years', '/api/filters/states', '/api/filters/parties'],
+        ['/api/dashboard/stream'],
+    ]
+
+
+def year_change(year):
+    """Batches fetched when the year filter changes: one stream reloading all six charts"""
+    return [['/api/dashboard/stream?analytics=0' + (f'&year={year}' if year else '')]]
+
+
+def page_view_unstreamed():
+    """The same page load when the browser falls back to one request per chart"""
+    return [
+        ['/api/filters/years', '/api/filters/states', '/api/filters/parties'],
+        list(CHART_ENDPOINTS),
+        ['/api/analytics/highest-turnout-state'],
+        ['/api/analytics/women-percentage'],
+        ['/api/analytics/seat-change'],
+        ['/api/analytics/narrowest-margins?limit=5'],
+    ]
+
+
+def year_change_unstreamed(year):
+    """The same year change when the browser falls back to one request per chart"""
+    return [[with_year(path, year) for path in CHART_ENDPOINTS]]
+
+
+def search(term):
+    """Batches fetched while typing a candidate name and submitting the search"""
+    batches = [[f'/api/suggest?kind=candidate&limit=8&q={quote(term[:length])}']
+               for length in range(1, len(term) + 1)]
+    batches.append([f'/api/search?candidate={quote(term)}'])
+    return batches
+
+
+def read_access_log(path):
+    """Request paths from a captured access log, in order"""
+    paths = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            match = LOG_REQUEST.search(line)
+            if match and match.group(1).startswith('/api/'):
+                paths.append(match.group(1))
+    return paths
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Thread-safe collection of (route, latency, ok) samples"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+
+    def add(self, route, latency, ok):
+        with self.lock:
+            self.samples.append((route, latency, ok))
+
+    def summary(self, elapsed):
+        latencies = sorted(latency for _, latency, _ in self.samples)
+        errors = sum(1 for _, _, ok in self.samples if not ok)
+        total = len(self.samples)
+        return {
+            'requests': total,
+            'errors': errors,
+            'error_rate': errors * 100.0 / total if total else 0.0,
+            'throughput': total / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        }
+
+    def by_route(self):
+        routes = {}
+        for route, latency, ok in self.samples:
+            routes.setdefault(route, []).append((latency, ok))
+        rows = []
+        for route, samples in sorted(routes.items()):
+            latencies = sorted(latency for latency, _ in samples)
+            rows.append({
+                'route': route,
+                'requests': len(samples),
+                'errors': sum(1 for _, ok in samples if not ok),
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+            })
+        return rows
+
+
+class LoadTest:
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def fetch(self, path, recorder):
+        route = path.split('?')[0]
+        start = time.perf_counter()
+        ok = False
+        try:
+            with urlopen(self.base_url + path, timeout=self.timeout) as response:
+                response.read()
+                ok = 200 <= response.status < 400
+        except HTTPError as e:
+            e.read()
+        except (URLError, OSError):
+            pass
+        recorder.add(route, time.perf_counter() - start, ok)
+
+    def run_batches(self, batches, recorder, pool):
+        for batch in batches:
+            if len(batch) == 1:
+                self.fetch(batch[0], recorder)
+            else:
+                list(pool.map(lambda path: self.fetch(path, recorder), batch))
+
+    def session(self, scenario, years, terms):
+        if scenario == 'pageview':
+            return page_view()
+        if scenario == 'year-change':
+            return year_change(random.choice(years) if years else None)
+        if scenario == 'pageview-unstreamed':
+            return page_view_unstreamed()
+        if scenario == 'year-change-unstreamed':
+            return year_change_unstreamed(random.choice(years) if years else None)
+        if scenario == 'search':
+            return search(random.choice(terms))
+        # A full visit: load the page, change the year a couple of times, search
+        batches = page_view()
+        for _ in range(2):
+            batches += year_change(random.choice(years) if years else None)
+        for term in random.sample(terms, min(2, len(terms))):
+            batches += search(term)
+        return batches
+
+    def run(self, concurrency, duration, scenario, years, terms):
+        """Run `concurrency` virtual users for `duration` seconds"""
+        recorder = Recorder()
+        deadline = time.perf_counter() + duration
+
+        def user():
+            # Browsers fetch up to six requests to one host in parallel
+            with ThreadPoolExecutor(max_workers=6) as pool:
+                while time.perf_counter() < deadline:
+                    self.run_batches(self.session(scenario, years, terms), recorder, pool)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return recorder, time.perf_counter() - start
+
+    def replay(self, concurrency, paths, loops=1):
+        """Replay logged request paths in order, spread across `concurrency` workers"""
+        recorder = Recorder()
+        paths = paths * loops
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda path: self.fetch(path, recorder), paths))
+        return recorder, time.perf_counter() - start
+
+    def discover_years(self):
+        try:
+            with urlopen(self.base_url + '/api/filters/years', timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except (URLError, OSError, ValueError):
+            return []
+
+
+def start_in_process(app_module='app'):
+    """Serve the Flask app on a free localhost port in a background thread"""
+    from werkzeug.serving import make_server
+    # The per-request access log would drown out the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # import_module returns the submodule itself for dotted names like api.index
+    module = importlib.import_module(app_module)
+    server = make_server('127.0.0.1', 0, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def print_report(concurrency, summary):
+    print(f"{concurrency:>11} {summary['requests']:>9} {summary['throughput']:>10.1f} "
+          f"{summary['p50_ms']:>9.1f} {summary['p99_ms']:>9.1f} {summary['max_ms']:>9.1f} "
+          f"{summary['error_rate']:>8.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the dashboard request pattern against a local server')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', default='http://127.0.0.1:5000', help='Base URL of a running local server')
+    target.add_argument('--in-process', action='store_true', help='Start the Flask app in this process')
+    parser.add_argument('--app', default='app', help="Module holding the Flask app for --in-process (default: app)")
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma-separated virtual user counts')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--scenario', default='session', choices=['session', 'pageview', 'year-change', 'search',
+                                 'pageview-unstreamed', 'year-change-unstreamed'])
+    parser.add_argument('--search-terms', default=','.join(DEFAULT_SEARCH_TERMS))
+    parser.add_argument('--replay', help='Replay GET /api requests from a captured access log')
+    parser.add_argument('--loops', type=int, default=1, help='Times to repeat the access log when replaying')
+    parser.add_argument('--by-route', action='store_true', help='Also print per-route latency')
+    args = parser.parse_args()
+    terms = [term for term in args.search_terms.split(',') if term]
+    if args.scenario == 'search' and not terms and not args.replay:
+        parser.error('the search scenario needs at least one --search-terms term')
+
+    server = None
+    if args.in_process:
+        server, base_url = start_in_process(args.app)
+    else:
+        base_url = args.url
+        if urlparse(base_url).hostname not in LOCAL_HOSTS:
+            parser.error('load tests may only target localhost')
+
+    test = LoadTest(base_url)
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    years = test.discover_years()
+    paths = read_access_log(args.replay) if args.replay else None
+
+    print(f"Target: {base_url}  Mode: {'replay ' + args.replay if paths else args.scenario}")
+    print(f"{'Concurrency':>11} {'Requests':>9} {'Req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'Errors':>9}")
+    print("-" * 72)
+    try:
+        for concurrency in levels:
+            if paths is not None:
+                recorder, elapsed = test.replay(concurrency, paths, args.loops)
+            else:
+                recorder, elapsed = test.run(concurrency, args.duration, args.scenario, years, terms)
+            print_report(concurrency, recorder.summary(elapsed))
+            if args.by_route:
+                for row in recorder.by_route():
+                    print(f"{'':>11} {row['route']:<40} {row['requests']:>7} "
+                          f"p50 {row['p50_ms']:>7.1f} p99 {row['p99_ms']:>7.1f} errors {row['errors']}")
+    finally:
+        if server:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+Memory Profiling
+Opt-in mode (MEMORY_PROFILE=1) that measures each request with tracemalloc:
+the peak of Python allocations while it was served, the allocation sites
+holding memory once the response has been serialized, and the memory still
+retained after the response has been sent. Results are aggregated per
+endpoint and reported at /api/debug/memory-profile, to size serverless
+memory limits and to compare response strategies (building a list and a
+JSON string vs streaming).
+
+tracemalloc counts allocations process-wide, so profiled requests run one at
+a time (a streamed one until its body has been sent) and skip the response
+cache. Tracing slows Python allocations down
+several times: profile in a local or staging process, not in production.
+
+Usage:
+    python memprofile.py [--app app] [url ...]   # profile the dashboard URLs (or the given ones) in-process
+"""
+
+import argparse
+import gc
+import importlib
+import linecache
+import os
+import threading
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+from flask import current_app, request
+from werkzeug.test import EnvironBuilder
+
+from cache import BYPASS
+
+# Frames kept per allocation; enough to see the view behind a shared helper
+FRAMES = int(os.environ.get('MEMORY_PROFILE_FRAMES', 4))
+
+TOP_SITES = 10
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Only dispatches its parts to other threads, which are profiled as requests of
+# their own (and could not run while it held the profiling lock)
+EXCLUDED = {'/api/dashboard/stream'}
+
+
+def enabled():
+    return os.environ.get('MEMORY_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+
+def _frames(traceback):
+    """file:line of each frame, innermost first, relative to the project and
+    without the repeats of comprehensions"""
+    frames = []
+    for frame in reversed(traceback):
+        filename = frame.filename
+        if filename.startswith(ROOT + os.sep):
+            filename = os.path.relpath(filename, ROOT)
+        location = f'{filename}:{frame.lineno}'
+        if not frames or frames[-1] != location:
+            frames.append(location)
+    return frames
+
+
+def _sites(snapshot, baseline, limit=TOP_SITES):
+    """Allocation sites that grew the most since baseline"""
+    stats = snapshot.compare_to(baseline, 'traceback')
+    sites = []
+    for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:limit]:
+        if stat.size_diff <= 0:
+            break
+        sites.append({
+            'size_bytes': stat.size_diff,
+            'blocks': stat.count_diff,
+            # Allocating line first
+            'traceback': _frames(stat.traceback),
+        })
+    return sites
+
+
+class _RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.peak_max = 0
+        self.peak_total = 0
+        self.retained_total = 0
+        self.response_max = 0
+        self.top_sites = []
+
+    def add(self, peak, retained, response_bytes, sites):
+        self.requests += 1
+        self.peak_total += peak
+        self.retained_total += retained
+        self.response_max = max(self.response_max, response_bytes)
+        if peak >= self.peak_max:
+            # Sites of the request with the highest peak
+            self.peak_max = peak
+            self.top_sites = sites
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'peak_bytes_max': self.peak_max,
+            'peak_bytes_mean': round(self.peak_total / self.requests),
+            'retained_bytes_mean': round(self.retained_total / self.requests),
+            'retained_bytes_total': self.retained_total,
+            'response_bytes_max': self.response_max,
+            'top_sites': self.top_sites,
+        }
+
+
+class _Measurement:
+    """Traced memory of one request. Snapshots are traced allocations too, so
+    their own size is kept out of the peak and retained figures."""
+
+    def __init__(self, route):
+        self.route = route
+        self.response_bytes = 0
+        self.done = False
+        gc.collect()
+        self.before = tracemalloc.get_traced_memory()[0]
+        self.baseline = tracemalloc.take_snapshot()
+        self.snapshot = None
+        self.snapshot_size = 0
+        self.peak = 0
+        self.start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def sample(self):
+        self.peak = tracemalloc.get_traced_memory()[1]
+        current = tracemalloc.get_traced_memory()[0]
+        self.snapshot = tracemalloc.take_snapshot()
+        self.snapshot_size = tracemalloc.get_traced_memory()[0] - current
+        tracemalloc.reset_peak()
+
+    def result(self, held=0):
+        """(peak, retained) bytes, and the sites holding memory at the sample.
+        held is memory still alive for sending, such as a buffered body."""
+        peak = max(self.peak, tracemalloc.get_traced_memory()[1] - self.snapshot_size) - self.start
+        snapshot = self.snapshot or tracemalloc.take_snapshot()
+        sites = _sites(snapshot.filter_traces(_FILTERS), self.baseline.filter_traces(_FILTERS))
+        # Retained: what the request left behind once its garbage is collected
+        self.baseline = self.snapshot = snapshot = None
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - self.before - held
+        return peak, retained, sites
+
+
+class _ProfiledBody:
+    """Streamed body that counts the bytes sent and ends the measurement after
+    the last chunk (or when the response is closed early)"""
+
+    def __init__(self, body, profiler, measurement):
+        self.body = body
+        self.profiler = profiler
+        self.measurement = measurement
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.measurement.response_bytes += len(chunk)
+            yield chunk
+        chunk = None
+        self.profiler.finish(self.measurement)
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.profiler.finish(self.measurement)
+
+
+class MemoryProfiler:
+    def __init__(self, frames=FRAMES):
+        self.frames = frames
+        # One profiled request at a time: tracemalloc's peak is process-wide
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.routes = {}
+        self.local = threading.local()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def sample(self):
+        """Snapshot of what the current request holds, taken right after serialization"""
+        measurement = getattr(self.local, 'measurement', None)
+        if measurement is not None and measurement.snapshot is None:
+            measurement.sample()
+
+    def begin(self, route):
+        self.lock.acquire()
+        try:
+            measurement = self.local.measurement = _Measurement(route)
+        except BaseException:
+            self.lock.release()
+            raise
+        return measurement
+
+    def finish(self, measurement, held=0):
+        if measurement.done:
+            return
+        measurement.done = True
+        if getattr(self.local, 'measurement', None) is measurement:
+            self.local.measurement = None
+        try:
+            peak, retained, sites = measurement.result(held)
+        finally:
+            self.lock.release()
+        with self.stats_lock:
+            self.routes.setdefault(measurement.route, _RouteStats()).add(
+                peak, retained, measurement.response_bytes, sites)
+
+    def report(self):
+        with self.stats_lock:
+            routes = {route: stats.to_dict() for route, stats in self.routes.items()}
+        return {
+            'enabled': tracemalloc.is_tracing(),
+            'traced_bytes': tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0,
+            'routes': dict(sorted(routes.items(), key=lambda item: item[1]['peak_bytes_max'], reverse=True)),
+        }
+
+
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, __file__),
+]
+
+
+def is_profiled(path):
+    return path.startswith('/api/') and not path.startswith('/api/debug/') and path not in EXCLUDED
+
+
+def profiled(view, profiler):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        measurement = profiler.begin(request.path)
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            profiler.finish(measurement)
+            raise
+        if response.is_streamed:
+            # Measured until the body has been sent
+            response.response = _ProfiledBody(response.response, profiler, measurement)
+            response.call_on_close(lambda: profiler.finish(measurement))
+        else:
+            measurement.response_bytes = len(response.get_data())
+            profiler.finish(measurement, held=measurement.response_bytes)
+        return response
+
+    return wrapper
+
+
+def _bypass_cache(wsgi_app):
+    # A cached response would measure nothing
+    def uncached_app(environ, start_response):
+        if is_profiled(environ.get('PATH_INFO', '')):
+            environ[BYPASS] = True
+        return wsgi_app(environ, start_response)
+    return uncached_app
+
+
+def install(app, profiler):
+    """Profile every GET /api view when MEMORY_PROFILE is set; call after all
+    routes are registered and the other view wrappers are installed (outermost)"""
+    if not enabled():
+        return profiler
+    profiler.start()
+    for rule in app.url_map.iter_rules():
+        if is_profiled(rule.rule) and 'GET' in rule.methods:
+            app.view_functions[rule.endpoint] = profiled(app.view_functions[rule.endpoint], profiler)
+    app.wsgi_app = _bypass_cache(app.wsgi_app)
+
+    class ProfiledJSONProvider(type(app.json)):
+        def response(self, *args, **kwargs):
+            response = super().response(*args, **kwargs)
+            # The rows and the encoded body are both alive here
+            profiler.sample()
+            return response
+
+    app.json = ProfiledJSONProvider(app)
+    return profiler
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
+def print_report(report):
+    print(f"{'Route':<42} {'Requests':>8} {'Peak max':>10} {'Peak mean':>10} {'Retained':>10} {'Response':>10}")
+    print('-' * 95)
+    for route, stats in report['routes'].items():
+        print(f"{route:<42} {stats['requests']:>8} {_format_bytes(stats['peak_bytes_max']):>10} "
+              f"{_format_bytes(stats['peak_bytes_mean']):>10} {_format_bytes(stats['retained_bytes_mean']):>10} "
+              f"{_format_bytes(stats['response_bytes_max']):>10}")
+        for site in stats['top_sites'][:3]:
+            print(f"    {_format_bytes(site['size_bytes']):>10}  {' <- '.join(site['traceback'][:3])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile the memory used by API requests in-process')
+    parser.add_argument('--app', default='app', help='Module holding the Flask app (default: app)')
+    parser.add_argument('urls', nargs='*', help='URLs to request (default: every dashboard URL and an export)')
+    args = parser.parse_args()
+
+    os.environ['MEMORY_PROFILE'] = '1'
+    # import_module returns the submodule itself for dotted names like api.index
+    module = importlib.import_module(args.app)
+    urls = args.urls
+    if not urls:
+        from warmer import STATIC_URLS, YEAR_URLS
+        urls = STATIC_URLS + YEAR_URLS + ['/api/export?format=ndjson']
+    for url in urls:
+        # Called as a WSGI server would, which drops each chunk once it is sent
+        # (the test client keeps the first one)
+        body = module.app(EnvironBuilder(url).get_environ(), lambda status, headers, exc_info=None: None)
+        try:
+            deque(body, maxlen=0)
+        finally:
+            body.close()
+    print_report(module.memory_profiler.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Partitioned Storage
+Election results are stored in one table per election type (results_ge,
+results_ae, ...) listed in the result_partitions catalog with the years each
+one covers, and election_results becomes a view over all of them so that
+existing readers keep working.
+
+Queries go through the router instead: source() returns only the partitions
+the request's election_type and year can touch, so a Lok Sabha query never
+scans Vidhan Sabha rows. Each partition is indexed on Year, so a single-year
+query reads only that year's rows. Year ranges are not split into further
+tables because SQLite does not flatten aggregates over a UNION ALL subquery,
+which made all-years queries slower than the unpartitioned table.
+
+A database that has not been partitioned is treated as one Lok Sabha partition,
+which is what the original election_results table contains.
+
+Usage:
+    python partitions.py migrate [db_path]              # partition election_results in place
+    python partitions.py import <source_db> [db_path]   # add another database's election_results
+    python partitions.py import --skip-checks <source_db> [db_path]
+    python partitions.py info [db_path]
+"""
+
+import os
+import re
+import sqlite3
+import sys
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Election type code (the request parameter) -> Election_Type value in the data
+ELECTION_TYPES = {
+    'GE': 'Lok Sabha Election (GE)',
+    'AE': 'Vidhan Sabha Election (AE)',
+}
+
+DEFAULT_ELECTION_TYPE = 'GE'
+
+# Every API query is limited to these years (1991-2019 per requirements)
+YEARS = (1991, 2019)
+
+CATALOG = 'result_partitions'
+VIEW = 'election_results'
+
+Partition = namedtuple('Partition', 'table election_type year_min year_max rows')
+
+
+class UnknownElectionType(ValueError):
+    pass
+
+
+def election_type_code(value):
+    """Code for an Election_Type value: 'Lok Sabha Election (GE)' -> 'GE'"""
+    if value is None or value == '':
+        # The original dataset is Lok Sabha only
+        return DEFAULT_ELECTION_TYPE
+    for code, name in ELECTION_TYPES.items():
+        if value == name or value.upper() == code:
+            return code
+    match = re.search(r'\(([A-Za-z-]+)\)\s*$', value)
+    return (match.group(1) if match else re.sub(r'\W+', '_', value)).upper()
+
+
+def table_name(code):
+    return 'results_' + re.sub(r'\W+', '_', code.lower())
+
+
+def has_catalog(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CATALOG,)).fetchone()
+    return row is not None
+
+
+def catalog(conn):
+    """All partitions, or the unpartitioned table as a single Lok Sabha partition"""
+    if not has_catalog(conn):
+        return [Partition(VIEW, DEFAULT_ELECTION_TYPE, None, None, None)]
+    rows = conn.execute(f"""
+    SELECT table_name, election_type, year_min, year_max, rows
+    FROM {CATALOG}
+    ORDER BY election_type, year_min
+    """).fetchall()
+    return [Partition(*row) for row in rows]
+
+
+def relation(tables):
+    """FROM-clause relation over the given partition tables"""
+    if not tables:
+        # Same columns, no rows, and nothing is scanned
+        return f'(SELECT * FROM {VIEW} WHERE 0)'
+    if len(tables) == 1:
+        return tables[0]
+    return '(' + ' UNION ALL '.join(f'SELECT * FROM {table}' for table in tables) + ')'
+
+
+class Route:
+    """The partitions a request can touch, from its election_type and year"""
+
+    def __init__(self, election_type=DEFAULT_ELECTION_TYPE, year=None):
+        self.election_type = election_type
+        self.year = year
+
+    def tables(self, conn):
+        year_min, year_max = (self.year, self.year) if self.year else YEARS
+        return [
+            partition.table for partition in catalog(conn)
+            if partition.election_type == self.election_type
+            and (partition.year_max is None or partition.year_max >= year_min)
+            and (partition.year_min is None or partition.year_min <= year_max)
+        ]
+
+    def source(self, conn):
+        return relation(self.tables(conn))
+
+
+def route(election_type=None, year=None):
+    """Route for a request's election_type and year; raises UnknownElectionType"""
+    code = (election_type or DEFAULT_ELECTION_TYPE).upper()
+    if code not in ELECTION_TYPES:
+        raise UnknownElectionType(f"Unknown election_type '{election_type}', expected one of {list(ELECTION_TYPES)}")
+    return Route(code, year)
+
+
+def source(conn, election_type=None, year=None):
+    """FROM-clause relation holding only the partitions the request can touch.
+
+    Pass year only when the query itself is restricted to that year.
+    """
+    return route(election_type, year).source(conn)
+
+
+def summary(conn):
+    """Available election types with their partitions"""
+    types = {}
+    for partition in catalog(conn):
+        entry = types.setdefault(partition.election_type, {
+            'election_type': partition.election_type,
+            'name': ELECTION_TYPES.get(partition.election_type, partition.election_type),
+            'partitions': [],
+        })
+        entry['partitions'].append({
+            'table': partition.table,
+            'year_min': partition.year_min,
+            'year_max': partition.year_max,
+            'rows': partition.rows,
+        })
+    return list(types.values())
+
+
+def _columns(conn, table):
+    schema, _, name = table.rpartition('.')
+    pragma = f'PRAGMA {schema}.table_info({name})' if schema else f'PRAGMA table_info({name})'
+    return [(row[1], row[2]) for row in conn.execute(pragma).fetchall()]
+
+
+def _is_table(conn, table):
+    schema, _, name = table.rpartition('.')
+    master = f'{schema}.sqlite_master' if schema else 'sqlite_master'
+    row = conn.execute(f"SELECT type FROM {master} WHERE name = ?", (name,)).fetchone()
+    return row is not None and row[0] == 'table'
+
+
+def _refresh_view(conn):
+    tables = [row[0] for row in conn.execute(f"SELECT table_name FROM {CATALOG} ORDER BY election_type, year_min")]
+    conn.execute(f'DROP VIEW IF EXISTS {VIEW}')
+    conn.execute(f"CREATE VIEW {VIEW} AS {' UNION ALL '.join(f'SELECT * FROM {table}' for table in tables)}")
+
+
+def import_rows(conn, source_table):
+    """Copy source_table's rows into their partitions, creating them as needed"""
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CATALOG} (
+        table_name TEXT PRIMARY KEY,
+        election_type TEXT NOT NULL,
+        year_min INTEGER NOT NULL,
+        year_max INTEGER NOT NULL,
+        rows INTEGER NOT NULL
+    )
+    """)
+    columns = _columns(conn, source_table)
+    # A view (a partitioned or encoded source database) has no rowid to keep the order by
+    order = 'ORDER BY rowid' if _is_table(conn, source_table) else ''
+    column_list = ', '.join(name for name, _ in columns)
+
+    # Partition table -> (code, [Election_Type values])
+    targets = {}
+    for (value,) in conn.execute(f"SELECT DISTINCT Election_Type FROM {source_table}").fetchall():
+        code = election_type_code(value)
+        targets.setdefault(table_name(code), (code, set()))[1].add(value)
+
+    for table, (code, values) in sorted(targets.items()):
+        if code not in ELECTION_TYPES:
+            print(f"warning: {table} holds election type {code}, which the API only serves once it is added to ELECTION_TYPES")
+        definition = ', '.join(f'{name} {declared}' for name, declared in columns)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({definition})')
+        # Keeps rowid order within a year, unlike an index that also covers Position
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_year ON {table} (Year)')
+
+        type_filter = ' OR '.join('Election_Type IS NULL' if value is None else 'Election_Type = ?' for value in values)
+        params = [value for value in values if value is not None]
+        # Original row order is kept so sums and ties come out exactly as before
+        conn.execute(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {source_table}
+        WHERE {type_filter}
+        {order}
+        """, params)
+
+        year_min, year_max, rows = conn.execute(f'SELECT MIN(Year), MAX(Year), COUNT(*) FROM {table}').fetchone()
+        conn.execute(f'INSERT OR REPLACE INTO {CATALOG} VALUES (?, ?, ?, ?, ?)',
+                     (table, code, year_min, year_max, rows))
+
+    _refresh_view(conn)
+
+
+@contextmanager
+def _transaction(conn):
+    # DDL included, so readers never see a half-built layout
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+@contextmanager
+def _plain_storage(conn):
+    """Decode dictionary-encoded storage while partitions change, and re-encode after"""
+    import encoding  # encoding builds on the partition catalog
+
+    encoded = encoding.is_encoded(conn)
+    if encoded:
+        encoding.decode(conn)
+    yield
+    if encoded:
+        encoding.encode(conn)
+
+
+def migrate(db_path):
+    """Split an unpartitioned election_results table into partitions"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    if has_catalog(conn):
+        conn.close()
+        print(f'{db_path}: {VIEW} is already partitioned')
+        return
+
+    with _transaction(conn), _plain_storage(conn):
+        conn.execute(f'ALTER TABLE {VIEW} RENAME TO _unpartitioned')
+        import_rows(conn, '_unpartitioned')
+        conn.execute('DROP TABLE _unpartitioned')
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def import_database(source_path, db_path, checks=True):
+    """Add the election_results rows of another database to the partitions.
+
+    Raises integrity.ValidationError, before anything is written, if the
+    incoming rows break an invariant and checks is set.
+    """
+    if checks:
+        import integrity  # integrity reads the partition catalog
+
+        report = integrity.validate_database(source_path, workers=os.cpu_count() or 1)
+        if not report.ok:
+            raise integrity.ValidationError(report)
+    migrate(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('ATTACH DATABASE ? AS incoming', (source_path,))
+    with _transaction(conn), _plain_storage(conn):
+        import_rows(conn, f'incoming.{VIEW}')
+    conn.execute('DETACH DATABASE incoming')
+    conn.close()
+
+
+def print_info(db_path):
+    conn = sqlite3.connect(db_path)
+    for entry in summary(conn):
+        print(f"{entry['election_type']}: {entry['name']}")
+        for partition in entry['partitions']:
+            years = f"{partition['year_min']}-{partition['year_max']}" if partition['year_min'] else 'all years'
+            rows = partition['rows'] if partition['rows'] is not None else 'unpartitioned'
+            print(f"  {partition['table']:<28} {years:<10} {rows}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--skip-checks']
+    command = args[0] if args else 'info'
+    if command == 'import' and len(args) > 1:
+        db_path = args[2] if len(args) > 2 else 'election_data2.db'
+        import integrity
+
+        try:
+            import_database(args[1], db_path, checks='--skip-checks' not in sys.argv)
+        except integrity.ValidationError as e:
+            print(e.report.format())
+            print(f'{args[1]} was not imported (use --skip-checks to import it anyway)')
+            sys.exit(1)
+    elif command in ('migrate', 'info'):
+        db_path = args[1] if len(args) > 1 else 'election_data2.db'
+        if command == 'migrate':
+            migrate(db_path)
+    else:
+        print(__doc__)
+        sys.exit(1)
+    print_info(db_path)
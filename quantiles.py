@@ -0,0 +1,309 @@
+"""
+Quantile Sketches
+Keeps a mergeable t-digest of Turnout_Percentage, Margin_Percentage, ENOP and
+Vote_Share_Percentage for every (year, state) of 1991-2019, built with one
+scan of the results table. The percentiles of any slice (some years, some
+states, per year or per state) are computed by merging the digests of its
+cells, without reading a candidate row.
+
+A digest is a sorted list of centroids (mean, weight). Centroids near the
+tails hold few values, so extreme percentiles stay accurate, and a cell of up
+to about COMPRESSION / 4 values keeps every value as its own centroid, so its
+percentiles are exact. Percentiles interpolate linearly between centroids like NumPy's
+default method, and match it exactly for slices small enough to be kept
+uncompressed.
+
+The digests are built once per election type on first use and rebuilt when
+the database changes.
+
+Usage:
+    python quantiles.py [metric] [--year YEAR] [--state STATE] [--db db_path]   # compare with exact percentiles
+"""
+
+import argparse
+import sqlite3
+import threading
+
+import numpy as np
+
+import encoding
+import partitions
+
+# Metric name -> (column, read from the winners' rows only). Constituency-level
+# columns repeat on every candidate row, so they count once per contest.
+METRICS = {
+    'turnout': ('Turnout_Percentage', True),
+    'margin': ('Margin_Percentage', True),
+    'enop': ('ENOP', True),
+    'vote_share': ('Vote_Share_Percentage', False),
+}
+
+GROUPINGS = ('year', 'state')
+
+DEFAULT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+MAX_QUANTILES = 99
+
+# About COMPRESSION / 2 centroids per digest at most
+COMPRESSION = 200
+
+
+class UnknownMetric(ValueError):
+    pass
+
+
+def metric(name):
+    if name not in METRICS:
+        raise UnknownMetric(f"Unknown metric '{name}', expected one of {list(METRICS)}")
+    return name
+
+
+def _compress(cells, means, weights, compression=COMPRESSION):
+    """Merge the centroids of each cell, sorted by (cell, mean), into clusters
+    spanning at most one unit of the arcsine scale function, which keeps them
+    small near the tails. Returns the (cells, means, weights) of the clusters."""
+    if not len(means):
+        return cells, means, weights
+    starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+    lengths = np.diff(np.r_[starts, len(cells)])
+    cumulative = np.cumsum(weights)
+    before = np.repeat(np.r_[0.0, cumulative[starts[1:] - 1]], lengths)
+    totals = np.repeat(np.add.reduceat(weights, starts), lengths)
+    # Quantile at the middle of each centroid, within its cell
+    q = (cumulative - before - weights / 2) / totals
+    k = compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1)) + compression / 4
+    clusters = np.floor(k).astype(np.int64)
+    boundaries = np.r_[True, (cells[1:] != cells[:-1]) | (clusters[1:] != clusters[:-1])]
+    first = np.flatnonzero(boundaries)
+    merged_weights = np.add.reduceat(weights, first)
+    merged_means = np.add.reduceat(means * weights, first) / merged_weights
+    return cells[first], merged_means, merged_weights
+
+
+class Digest:
+    def __init__(self, means, weights, minimum, maximum):
+        self.means = means
+        self.weights = weights
+        self.min = minimum
+        self.max = maximum
+
+    @property
+    def count(self):
+        return int(self.weights.sum())
+
+    @classmethod
+    def merge(cls, digests, compression=COMPRESSION):
+        digests = [digest for digest in digests if len(digest.means)]
+        if not digests:
+            return cls(np.zeros(0), np.zeros(0), None, None)
+        means = np.concatenate([digest.means for digest in digests])
+        weights = np.concatenate([digest.weights for digest in digests])
+        order = np.argsort(means, kind='stable')
+        _, means, weights = _compress(np.zeros(len(means), dtype=np.int64), means[order], weights[order], compression)
+        return cls(means, weights, min(digest.min for digest in digests), max(digest.max for digest in digests))
+
+    def quantile(self, qs):
+        """Percentiles at qs (0-1), None for an empty digest"""
+        if not len(self.means):
+            return [None] * len(qs)
+        # A centroid of weight w covers ranks [before, before + w - 1] and sits
+        # at their middle; ranks run from 0 (min) to count - 1 (max)
+        before = np.cumsum(self.weights) - self.weights
+        positions = before + (self.weights - 1) / 2
+        last = self.weights.sum() - 1
+        x = np.r_[0.0, positions, last]
+        y = np.r_[self.min, self.means, self.max]
+        values = np.interp(np.asarray(qs, dtype=np.float64) * last, x, y)
+        return [float(value) for value in values]
+
+    def to_dict(self, qs):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'values': self.quantile(qs),
+        }
+
+
+class MetricSketches:
+    """Digests of one metric for every (year, state) cell, stored as one array
+    of centroids with the offsets of each cell's"""
+
+    def __init__(self, offsets, means, weights, minimums, maximums):
+        self.offsets = offsets
+        self.means = means
+        self.weights = weights
+        self.minimums = minimums
+        self.maximums = maximums
+
+    @classmethod
+    def build(cls, cell_index, values, n_cells, compression=COMPRESSION):
+        valid = ~np.isnan(values)
+        cell_index, values = cell_index[valid], values[valid]
+        order = np.lexsort((values, cell_index))
+        cells, means, weights = _compress(cell_index[order], values[order], np.ones(len(order)), compression)
+        offsets = np.searchsorted(cells, np.arange(n_cells + 1))
+        minimums = np.full(n_cells, np.nan)
+        maximums = np.full(n_cells, np.nan)
+        np.fmin.at(minimums, cell_index, values)
+        np.fmax.at(maximums, cell_index, values)
+        return cls(offsets, means, weights, minimums, maximums)
+
+    def digest(self, cells):
+        """Digest of the values of the given cell indices, merged"""
+        return Digest.merge(
+            Digest(self.means[self.offsets[cell]:self.offsets[cell + 1]],
+                   self.weights[self.offsets[cell]:self.offsets[cell + 1]],
+                   float(self.minimums[cell]), float(self.maximums[cell]))
+            for cell in cells)
+
+
+class Sketches:
+    def __init__(self, years, states, cell_year, cell_state, metrics):
+        self.years = years
+        self.states = states
+        # Year and state index of each cell
+        self.cell_year = cell_year
+        self.cell_state = cell_state
+        self.metrics = metrics
+
+    @classmethod
+    def from_connection(cls, conn, route):
+        coded = encoding.coded(conn, route)
+        rows = conn.execute(f"""
+        SELECT Year, {coded.label('State_Name')} as State_Name, Position = 1 as is_winner,
+               {', '.join(column for column, _ in METRICS.values())}
+        FROM {coded}
+        WHERE Year >= 1991 AND Year <= 2019
+        """).fetchall()
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls([], [], empty, empty, {name: MetricSketches.build(empty, np.zeros(0), 0) for name in METRICS})
+
+        year, state, is_winner, *columns = zip(*rows)
+        years, year_index = np.unique(np.array(year), return_inverse=True)
+        states, state_index = np.unique(np.array(state, dtype=object), return_inverse=True)
+        cell_keys, cell_index = np.unique(year_index * len(states) + state_index, return_inverse=True)
+        winner = np.array(is_winner, dtype=bool)
+
+        metrics = {}
+        for (name, (_, winners_only)), column in zip(METRICS.items(), columns):
+            values = np.array(column, dtype=np.float64)
+            if winners_only:
+                values[~winner] = np.nan
+            metrics[name] = MetricSketches.build(cell_index, values, len(cell_keys))
+        return cls([int(y) for y in years], list(states), cell_keys // len(states), cell_keys % len(states), metrics)
+
+    def cells(self, years=None, year_from=None, year_to=None, states=None):
+        """Cell indices matching the filters"""
+        mask = np.ones(len(self.cell_year), dtype=bool)
+        cell_years = np.array(self.years, dtype=np.int64)[self.cell_year] if self.years else np.zeros(0, dtype=np.int64)
+        if years:
+            mask &= np.isin(cell_years, years)
+        if year_from is not None:
+            mask &= cell_years >= year_from
+        if year_to is not None:
+            mask &= cell_years <= year_to
+        if states:
+            mask &= np.isin(self.cell_state, [self.states.index(state) for state in states])
+        return np.flatnonzero(mask)
+
+    def percentiles(self, name, qs, by=None, **filters):
+        sketches = self.metrics[name]
+        cells = self.cells(**filters)
+        result = {
+            'metric': name,
+            'column': METRICS[name][0],
+            'quantiles': list(qs),
+            **sketches.digest(cells).to_dict(qs),
+        }
+        if by is not None:
+            keys = self.cell_year[cells] if by == 'year' else self.cell_state[cells]
+            labels = self.years if by == 'year' else self.states
+            result['groups'] = [
+                {by: labels[key], **sketches.digest(cells[keys == key]).to_dict(qs)}
+                for key in np.unique(keys)
+            ]
+        return result
+
+
+_sketches = {}
+_sketches_lock = threading.Lock()
+
+
+def get_sketches(get_db_connection, election_type=None, version=None):
+    """Return the process-wide sketches of an election type in a database version,
+    building them on first use"""
+    key = (version, partitions.route(election_type).election_type)
+    sketches = _sketches.get(key)
+    if sketches is None:
+        with _sketches_lock:
+            sketches = _sketches.get(key)
+            if sketches is None:
+                conn = get_db_connection()
+                try:
+                    sketches = _sketches[key] = Sketches.from_connection(conn, partitions.route(key[1]))
+                finally:
+                    conn.close()
+    return sketches
+
+
+def reload_sketches(get_db_connection, version=None):
+    """Build every election type's sketches built so far from a new database
+    version (or rebuild them) before it is served"""
+    for election_type in {key[1] for key in list(_sketches)}:
+        conn = get_db_connection()
+        try:
+            sketches = Sketches.from_connection(conn, partitions.route(election_type))
+        finally:
+            conn.close()
+        with _sketches_lock:
+            _sketches[version, election_type] = sketches
+
+
+def release_sketches(version):
+    """Drop the sketches of a database version that is no longer served"""
+    with _sketches_lock:
+        for key in [key for key in _sketches if key[0] == version]:
+            del _sketches[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Percentiles from the sketches next to the exact ones')
+    parser.add_argument('metric', nargs='?', default='turnout', choices=list(METRICS))
+    parser.add_argument('--year', type=int, action='append')
+    parser.add_argument('--state', action='append')
+    parser.add_argument('--election-type')
+    parser.add_argument('--db', default='election_data2.db')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    route = partitions.route(args.election_type)
+    sketches = Sketches.from_connection(conn, route)
+    result = sketches.percentiles(args.metric, DEFAULT_QUANTILES, years=args.year, states=args.state)
+
+    column, winners_only = METRICS[args.metric]
+    coded = encoding.coded(conn, route)
+    conditions = [f'{column} IS NOT NULL', 'Year >= 1991 AND Year <= 2019']
+    if winners_only:
+        conditions.append('Position = 1')
+    params = []
+    if args.year:
+        conditions.append(f"Year IN ({', '.join('?' * len(args.year))})")
+        params.extend(args.year)
+    if args.state:
+        conditions.append(f"{coded.label('State_Name')} IN ({', '.join('?' * len(args.state))})")
+        params.extend(args.state)
+    values = [row[0] for row in conn.execute(f"SELECT {column} FROM {coded} WHERE {' AND '.join(conditions)}", params)]
+    conn.close()
+
+    exact = np.quantile(values, DEFAULT_QUANTILES).tolist() if values else [None] * len(DEFAULT_QUANTILES)
+    print(f"{column}: {result['count']} values")
+    print(f"{'Quantile':>8} {'Sketch':>10} {'Exact':>10}")
+    for q, estimate, value in zip(DEFAULT_QUANTILES, result['values'], exact):
+        print(f'{q:>8} {estimate if estimate is not None else float("nan"):>10.3f} '
+              f'{value if value is not None else float("nan"):>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Single-Flight Request Coalescing
+Concurrent GET /api requests with the same route and normalized parameters
+share one execution of the view: the first request computes the response and
+every request that arrives while it is running waits for and reuses it.
+Streamed responses are not shared, since that would mean buffering them.
+"""
+
+import threading
+from functools import wraps
+
+from flask import Response, current_app, request
+
+from cache import is_cacheable, request_key
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executions = {}
+        self.deduplicated = {}
+
+    def do(self, key, fn):
+        """Run fn() once per key at a time; concurrent callers get the same result"""
+        route = key[0]
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.executions[route] = self.executions.get(route, 0) + 1
+            else:
+                call.waiters += 1
+                self.deduplicated[route] = self.deduplicated.get(route, 0) + 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def unshared(self, route):
+        """Count a follower that could not reuse the result and ran the view itself"""
+        with self.lock:
+            self.deduplicated[route] -= 1
+            self.executions[route] = self.executions.get(route, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            routes = sorted(set(self.executions) | set(self.deduplicated))
+            per_route = {
+                route: {
+                    'executions': self.executions.get(route, 0),
+                    'deduplicated': self.deduplicated.get(route, 0),
+                }
+                for route in routes
+            }
+            in_flight = len(self.calls)
+        return {
+            'executions': sum(entry['executions'] for entry in per_route.values()),
+            'deduplicated': sum(entry['deduplicated'] for entry in per_route.values()),
+            'in_flight': in_flight,
+            'routes': per_route,
+        }
+
+
+def coalesce(view, flight):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_cacheable(request):
+            return view(*args, **kwargs)
+
+        own = []
+
+        def compute():
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.is_streamed:
+                own.append(response)
+                return response, None, None
+            return response.get_data(), response.status_code, response.mimetype
+
+        body, status, mimetype = flight.do(request_key(request), compute)
+        if status is None:
+            # A streamed body can only be sent once and is not buffered to be
+            # shared: the leader sends it and the followers run the view themselves
+            if own:
+                return body
+            flight.unshared(request.path)
+            return view(*args, **kwargs)
+        return Response(body, status=status, mimetype=mimetype)
+
+    return wrapper
+
+
+def install(app, flight):
+    """Wrap every GET /api view; call after all routes are registered"""
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/api/') and 'GET' in rule.methods:
+            app.view_functions[rule.endpoint] = coalesce(app.view_functions[rule.endpoint], flight)
+    return flight
@@ -0,0 +1,370 @@
+"""
+Database Snapshots
+Serves the election data from immutable, versioned database files instead of
+one file that is rewritten in place. New data is published as a new version
+next to the others, and a pointer file is switched to it atomically
+(os.replace), so a reader always opens one complete version.
+
+Each request is pinned to the version that was current when it arrived and
+reads it to its last byte, even if a newer one is published meanwhile. The
+server notices a new version within the cache warmer's polling interval,
+builds the derived in-memory structures and the cached responses for it,
+and only then starts routing new requests to it. Everything derived from a
+version is keyed by it, and is released once the last request pinned to a
+retired version has finished.
+
+Layout, next to the database path the app is configured with:
+    election_data2.snapshots/v0001.db, v0002.db, ...
+    election_data2.snapshots/CURRENT        # name of the current version file
+
+Without a snapshots directory the configured database file is served as the
+only version, identified by its modification time and size, so replacing it
+in place still refreshes the derived data (without isolating readers).
+
+Usage:
+    python snapshots.py publish <database> [db_path]    # copy a complete database in as the next version
+    python snapshots.py publish --skip-checks <database> [db_path]
+    python snapshots.py import <source_db> [db_path]    # next version = current + another database's rows
+    python snapshots.py rollback <version> [db_path]
+    python snapshots.py prune [keep] [db_path]          # delete all but the current and `keep` newest versions
+    python snapshots.py list [db_path]
+"""
+
+import os
+import re
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+
+POINTER = 'CURRENT'
+VERSION_FILE = re.compile(r'^v(\d+)\.db$')
+
+# WSGI environ key of the Snapshot a request is pinned to
+ENVIRON = 'snapshots.snapshot'
+
+# Retired versions kept on disk by prune, for rollbacks and slow workers
+KEEP = 2
+
+_local = threading.local()
+
+
+def directory(db_path):
+    return os.path.splitext(db_path)[0] + '.snapshots'
+
+
+def versions(db_path):
+    """Version names in the snapshots directory, oldest first"""
+    folder = directory(db_path)
+    if not os.path.isdir(folder):
+        return []
+    names = [name for name in os.listdir(folder) if VERSION_FILE.match(name)]
+    return [name[:-3] for name in sorted(names, key=lambda name: int(VERSION_FILE.match(name).group(1)))]
+
+
+def published(db_path):
+    """(version, path) the pointer designates, or the database file itself
+    identified by its mtime and size when there is no pointer"""
+    pointer = os.path.join(directory(db_path), POINTER)
+    try:
+        with open(pointer, 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        try:
+            stat = os.stat(db_path)
+        except OSError:
+            return 'missing', db_path
+        return f'{stat.st_mtime_ns}-{stat.st_size}', db_path
+    return name[:-3], os.path.join(directory(db_path), name)
+
+
+class Snapshot:
+    def __init__(self, version, path):
+        self.version = version
+        self.path = path
+        # Requests pinned to this version that have not finished yet
+        self.active = 0
+        self.retired = False
+
+    def __repr__(self):
+        return f'Snapshot({self.version!r})'
+
+
+def pinned():
+    """Snapshot the current thread is serving, if any"""
+    return getattr(_local, 'snapshot', None)
+
+
+@contextmanager
+def pin(snapshot):
+    """Open connections to snapshot on this thread inside the with block"""
+    previous, _local.snapshot = pinned(), snapshot
+    try:
+        yield snapshot
+    finally:
+        _local.snapshot = previous
+
+
+def environ_version(environ):
+    snapshot = environ.get(ENVIRON)
+    return snapshot.version if snapshot is not None else None
+
+
+class SnapshotManager:
+    def __init__(self, db_path, name=None):
+        self.db_path = db_path
+        # Prefixed to the versions of a named database served next to others
+        self.name = name
+        self.lock = threading.Lock()
+        self.current = Snapshot(*self.published())
+        # Retired versions still serving requests
+        self.draining = {}
+        # Callbacks(version) dropping what was derived from a drained version
+        self.on_release = []
+        self.switches = 0
+
+    def published(self):
+        version, path = published(self.db_path)
+        return (f'{self.name}/{version}' if self.name else version), path
+
+    def path(self):
+        """Database file of the request being served, else of the current version"""
+        return (pinned() or self.current).path
+
+    def version(self):
+        return (pinned() or self.current).version
+
+    def acquire(self, snapshot=None):
+        with self.lock:
+            snapshot = snapshot or self.current
+            snapshot.active += 1
+        return snapshot
+
+    def release(self, snapshot):
+        with self.lock:
+            snapshot.active -= 1
+            drained = snapshot.retired and snapshot.active == 0 and self.draining.pop(snapshot.version, None)
+        if drained:
+            self._release(snapshot)
+
+    def _release(self, snapshot):
+        for callback in self.on_release:
+            callback(snapshot.version)
+
+    def switch(self, prepare=None):
+        """Start serving the published version if it changed: prepare(snapshot)
+        builds what it needs first, then new requests are routed to it.
+        Returns the new Snapshot, or None if nothing changed."""
+        version, path = self.published()
+        if version == self.current.version:
+            return None
+        snapshot = Snapshot(version, path)
+        if prepare is not None:
+            prepare(snapshot)
+        with self.lock:
+            previous, self.current = self.current, snapshot
+            previous.retired = True
+            drained = previous.active == 0
+            if not drained:
+                self.draining[previous.version] = previous
+            self.switches += 1
+        if drained:
+            self._release(previous)
+        return snapshot
+
+    def stats(self):
+        with self.lock:
+            return {
+                'current': self.current.version,
+                'path': self.current.path,
+                'active': self.current.active,
+                'switches': self.switches,
+                'draining': {version: snapshot.active for version, snapshot in self.draining.items()},
+            }
+
+
+class _PinnedBody:
+    """Response body read with its request's snapshot pinned, which is released
+    after the last chunk (or when the response is closed early)"""
+
+    def __init__(self, body, manager, snapshot):
+        self.body = body
+        self.manager = manager
+        self.snapshot = snapshot
+        self.released = False
+
+    def __iter__(self):
+        chunks = iter(self.body)
+        while True:
+            # Streamed bodies open connections and run queries as they are read
+            with pin(self.snapshot):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+            yield chunk
+        self.release()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.manager.release(self.snapshot)
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.release()
+
+
+def install(app, manager):
+    """Pin every request to the current snapshot (or the one set in its environ
+    by an internal request) until its response has been sent"""
+
+    def middleware(wsgi_app):
+        def pinned_app(environ, start_response):
+            snapshot = environ[ENVIRON] = manager.acquire(environ.get(ENVIRON))
+
+            def versioned_start_response(status, headers, exc_info=None):
+                return start_response(status, headers + [('X-Snapshot-Version', snapshot.version)], exc_info)
+
+            try:
+                with pin(snapshot):
+                    body = wsgi_app(environ, versioned_start_response)
+            except BaseException:
+                manager.release(snapshot)
+                raise
+            return _PinnedBody(body, manager, snapshot)
+        return pinned_app
+
+    app.wsgi_app = middleware(app.wsgi_app)
+    return manager
+
+
+def _write_pointer(folder, name):
+    temporary = os.path.join(folder, POINTER + '.tmp')
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(name + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic: readers see the old or the new name, never a partial one
+    os.replace(temporary, os.path.join(folder, POINTER))
+
+
+def _next_file(db_path):
+    existing = versions(db_path)
+    number = int(existing[-1][1:]) + 1 if existing else 1
+    return f'v{number:04d}.db'
+
+
+def _add_version(db_path, build):
+    """Create the next version file with build(path), then point to it"""
+    folder = directory(db_path)
+    os.makedirs(folder, exist_ok=True)
+    name = _next_file(db_path)
+    temporary = os.path.join(folder, name + '.tmp')
+    try:
+        build(temporary)
+        with open(temporary, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(temporary, os.path.join(folder, name))
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    _write_pointer(folder, name)
+    return name[:-3]
+
+
+def publish(source_path, db_path, checks=True):
+    """Copy a complete database in as the next version and make it current.
+
+    Raises integrity.ValidationError, before anything is written, if its rows
+    break an invariant and checks is set.
+    """
+    if checks:
+        import integrity
+
+        report = integrity.validate_database(source_path, workers=os.cpu_count() or 1)
+        if not report.ok:
+            raise integrity.ValidationError(report)
+    return _add_version(db_path, lambda path: shutil.copyfile(source_path, path))
+
+
+def import_version(source_path, db_path, checks=True):
+    """Publish the current version plus the rows of another database as the next version"""
+    import partitions
+
+    _, current = published(db_path)
+
+    def build(path):
+        shutil.copyfile(current, path)
+        partitions.import_database(source_path, path, checks)
+
+    return _add_version(db_path, build)
+
+
+def rollback(version, db_path):
+    if version not in versions(db_path):
+        raise ValueError(f'Unknown version: {version}')
+    _write_pointer(directory(db_path), version + '.db')
+
+
+def prune(db_path, keep=KEEP):
+    """Delete the version files older than the current one and the `keep` before it"""
+    current, _ = published(db_path)
+    names = versions(db_path)
+    if current not in names:
+        return []
+    removed = names[:max(names.index(current) - keep, 0)]
+    for version in removed:
+        os.remove(os.path.join(directory(db_path), version + '.db'))
+    return removed
+
+
+def main():
+    import integrity
+
+    args = [arg for arg in sys.argv[1:] if arg != '--skip-checks']
+    checks = '--skip-checks' not in sys.argv
+    command = args[0] if args else None
+
+    if command in ('publish', 'import', 'rollback') and len(args) > 1:
+        db_path = args[2] if len(args) > 2 else 'election_data2.db'
+        try:
+            if command == 'publish':
+                version = publish(args[1], db_path, checks)
+            elif command == 'import':
+                version = import_version(args[1], db_path, checks)
+            else:
+                rollback(args[1], db_path)
+                version = args[1]
+        except integrity.ValidationError as e:
+            print(e.report.format())
+            print(f'{args[1]} was not published (use --skip-checks to publish it anyway)')
+            sys.exit(1)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        print(f'{version} is now the current version of {db_path}')
+    elif command == 'prune':
+        keep = int(args[1]) if len(args) > 1 else KEEP
+        db_path = args[2] if len(args) > 2 else 'election_data2.db'
+        for version in prune(db_path, keep):
+            print(f'Deleted {version}')
+    elif command == 'list':
+        db_path = args[1] if len(args) > 1 else 'election_data2.db'
+        current, _ = published(db_path)
+        for version in versions(db_path):
+            size = os.path.getsize(os.path.join(directory(db_path), version + '.db'))
+            print(f"{'*' if version == current else ' '} {version}  {size / 1024 / 1024:8.1f} MB")
+        if current not in versions(db_path):
+            print(f'No snapshots: serving {db_path} directly')
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
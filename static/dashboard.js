@@ -9,10 +9,17 @@ let currentYear = '';
 
 // Initialize dashboard
 document.addEventListener('DOMContentLoaded', async () => {
+    setupSuggestions('candidateSearch', 'candidateSuggestions', 'candidate');
+    setupSuggestions('constituencySearch', 'constituencySuggestions', 'constituency');
     await loadFilters();
     await initializeMap();
-    await updateAllCharts();
-    await loadAnalytics();
+    try {
+        await streamDashboard(true);
+    } catch (error) {
+        console.error('Error streaming dashboard, loading charts individually:', error);
+        await loadAllCharts();
+        await loadAnalytics();
+    }
 });
 
 // Load filter options
@@ -56,6 +63,16 @@ async function loadFilters() {
 // Update all charts
 async function updateAllCharts() {
     currentYear = document.getElementById('yearFilter').value || '';
+    try {
+        await streamDashboard(false);
+    } catch (error) {
+        console.error('Error streaming charts, loading them individually:', error);
+        await loadAllCharts();
+    }
+}
+
+// Load each chart with its own request
+async function loadAllCharts() {
     await Promise.all([
         loadSeatShareChart(),
         loadTurnoutMap(),
@@ -66,11 +83,70 @@ async function updateAllCharts() {
     ]);
 }
 
+// Stream every payload from one request and render each chart as soon as it arrives
+let streamGeneration = 0;
+
+async function streamDashboard(includeAnalytics) {
+    const generation = ++streamGeneration;
+    const renderers = {
+        seatShare: loadSeatShareChart,
+        turnout: loadTurnoutMap,
+        gender: loadGenderChart,
+        voteShare: loadVoteShareChart,
+        margin: loadMarginChart,
+        nationalVsRegional: loadNationalVsRegionalChart,
+        highestTurnout: renderHighestTurnout,
+        womenPercentage: renderWomenPercentage,
+        seatChange: renderSeatChanges,
+        narrowMargins: renderNarrowMargins
+    };
+
+    const params = [];
+    if (currentYear) params.push(`year=${currentYear}`);
+    if (!includeAnalytics) params.push('analytics=0');
+
+    const response = await fetch(`${API_BASE}/dashboard/stream?${params.join('&')}`);
+    if (!response.ok || !response.body) {
+        throw new Error(`Dashboard stream failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const rendering = [];
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline);
+            buffer = buffer.slice(newline + 1);
+            if (!line.trim()) continue;
+
+            // A newer filter change has started its own stream
+            if (generation !== streamGeneration) {
+                reader.cancel();
+                return;
+            }
+            const part = JSON.parse(line);
+            if (part.status === 200 && renderers[part.key]) {
+                rendering.push(renderers[part.key](part.data));
+            } else {
+                console.error(`Error loading ${part.key}:`, part.data);
+            }
+        }
+    }
+    await Promise.all(rendering);
+}
+
 // Party-wise Seat Share Chart
-async function loadSeatShareChart() {
+async function loadSeatShareChart(prefetched) {
     try {
         const url = currentYear ? `${API_BASE}/party-seat-share?year=${currentYear}` : `${API_BASE}/party-seat-share`;
-        const data = await fetch(url).then(r => r.json());
+        const data = prefetched ?? await fetch(url).then(r => r.json());
 
         const ctx = document.getElementById('seatShareChart').getContext('2d');
         
@@ -145,10 +221,10 @@ async function loadSeatShareChart() {
 // State-wise Turnout Map
 let turnoutMarkers = [];
 
-async function loadTurnoutMap() {
+async function loadTurnoutMap(prefetched) {
     try {
         const url = currentYear ? `${API_BASE}/state-turnout?year=${currentYear}` : `${API_BASE}/state-turnout`;
-        const data = await fetch(url).then(r => r.json());
+        const data = prefetched ?? await fetch(url).then(r => r.json());
 
         if (!turnoutMap) {
             turnoutMap = L.map('turnoutMap').setView([23.0225, 77.5], 5.5);
@@ -348,9 +424,9 @@ function getShortStateName(fullName) {
 }
 
 // Gender Representation Chart
-async function loadGenderChart() {
+async function loadGenderChart(prefetched) {
     try {
-        const data = await fetch(`${API_BASE}/gender-representation`).then(r => r.json());
+        const data = prefetched ?? await fetch(`${API_BASE}/gender-representation`).then(r => r.json());
         const ctx = document.getElementById('genderChart').getContext('2d');
 
         if (charts.gender) {
@@ -405,10 +481,10 @@ async function loadGenderChart() {
 }
 
 // Top Parties by Vote Share (Donut Chart)
-async function loadVoteShareChart() {
+async function loadVoteShareChart(prefetched) {
     try {
         const url = currentYear ? `${API_BASE}/top-parties-vote-share?year=${currentYear}&limit=10` : `${API_BASE}/top-parties-vote-share?limit=10`;
-        const data = await fetch(url).then(r => r.json());
+        const data = prefetched ?? await fetch(url).then(r => r.json());
         const ctx = document.getElementById('voteShareChart').getContext('2d');
 
         if (charts.voteShare) {
@@ -449,10 +525,10 @@ async function loadVoteShareChart() {
 }
 
 // Margin of Victory Distribution (Histogram)
-async function loadMarginChart() {
+async function loadMarginChart(prefetched) {
     try {
         const url = currentYear ? `${API_BASE}/margin-distribution?year=${currentYear}` : `${API_BASE}/margin-distribution`;
-        const data = await fetch(url).then(r => r.json());
+        const data = prefetched ?? await fetch(url).then(r => r.json());
         const ctx = document.getElementById('marginChart').getContext('2d');
 
         if (charts.margin) {
@@ -504,9 +580,9 @@ async function loadMarginChart() {
 }
 
 // National vs Regional Parties
-async function loadNationalVsRegionalChart() {
+async function loadNationalVsRegionalChart(prefetched) {
     try {
-        const data = await fetch(`${API_BASE}/analytics/national-vs-regional`).then(r => r.json());
+        const data = prefetched ?? await fetch(`${API_BASE}/analytics/national-vs-regional`).then(r => r.json());
         const ctx = document.getElementById('nationalVsRegionalChart').getContext('2d');
 
         if (charts.nationalVsRegional) {
@@ -601,39 +677,77 @@ async function searchCandidates() {
 }
 
 // Load analytics insights
+// Typeahead suggestions while typing in a search box
+function setupSuggestions(inputId, listId, kind) {
+    const input = document.getElementById(inputId);
+    const list = document.getElementById(listId);
+    let latest = 0;
+
+    input.addEventListener('input', async () => {
+        const q = input.value.trim();
+        const requestId = ++latest;
+        if (!q) {
+            list.innerHTML = '';
+            return;
+        }
+        try {
+            const data = await fetch(`${API_BASE}/suggest?kind=${kind}&limit=8&q=${encodeURIComponent(q)}`).then(r => r.json());
+            // Ignore responses that arrive after a newer keystroke
+            if (requestId !== latest) return;
+            list.innerHTML = '';
+            data.forEach(item => {
+                const option = document.createElement('option');
+                option.value = item.value;
+                list.appendChild(option);
+            });
+        } catch (error) {
+            console.error('Error loading suggestions:', error);
+        }
+    });
+}
+
 async function loadAnalytics() {
     try {
-        // Highest turnout state
-        const turnoutData = await fetch(`${API_BASE}/analytics/highest-turnout-state`).then(r => r.json());
-        document.getElementById('highestTurnout').innerHTML = 
-            `<strong>${(turnoutData.State_Name || '').replace(/_/g, ' ')}</strong><br/>` +
-            `Turnout: ${parseFloat(turnoutData.avg_turnout || 0).toFixed(2)}% (${turnoutData.year})`;
-
-        // Women percentage
-        const womenData = await fetch(`${API_BASE}/analytics/women-percentage`).then(r => r.json());
-        document.getElementById('womenPercentage').innerHTML = 
-            `<strong>${parseFloat(womenData.women_percentage || 0).toFixed(2)}%</strong><br/>` +
-            `${parseInt(womenData.women_candidates || 0).toLocaleString()} out of ${parseInt(womenData.total_candidates || 0).toLocaleString()} candidates`;
-
-        // Seat changes
-        const seatChangeData = await fetch(`${API_BASE}/analytics/seat-change`).then(r => r.json());
-        const topGainers = seatChangeData.changes.slice(0, 3).map(c => 
-            `<div>${c.party}: ${c.change > 0 ? '+' : ''}${c.change} seats</div>`
-        ).join('');
-        document.getElementById('seatChanges').innerHTML = 
-            `<div><strong>${seatChangeData.year1} → ${seatChangeData.year2}</strong></div>` + topGainers;
-
-        // Narrowest margins
-        const marginData = await fetch(`${API_BASE}/analytics/narrowest-margins?limit=5`).then(r => r.json());
-        const margins = marginData.slice(0, 5).map(m => 
-            `<div>${m.Constituency_Name}: ${parseFloat(m.Margin_Percentage || 0).toFixed(2)}%</div>`
-        ).join('');
-        document.getElementById('narrowMargins').innerHTML = margins;
+        renderHighestTurnout(await fetch(`${API_BASE}/analytics/highest-turnout-state`).then(r => r.json()));
+        renderWomenPercentage(await fetch(`${API_BASE}/analytics/women-percentage`).then(r => r.json()));
+        renderSeatChanges(await fetch(`${API_BASE}/analytics/seat-change`).then(r => r.json()));
+        renderNarrowMargins(await fetch(`${API_BASE}/analytics/narrowest-margins?limit=5`).then(r => r.json()));
     } catch (error) {
         console.error('Error loading analytics:', error);
     }
 }
 
+// Highest turnout state
+function renderHighestTurnout(turnoutData) {
+    document.getElementById('highestTurnout').innerHTML = 
+        `<strong>${(turnoutData.State_Name || '').replace(/_/g, ' ')}</strong><br/>` +
+        `Turnout: ${parseFloat(turnoutData.avg_turnout || 0).toFixed(2)}% (${turnoutData.year})`;
+}
+
+// Women percentage
+function renderWomenPercentage(womenData) {
+    document.getElementById('womenPercentage').innerHTML = 
+        `<strong>${parseFloat(womenData.women_percentage || 0).toFixed(2)}%</strong><br/>` +
+        `${parseInt(womenData.women_candidates || 0).toLocaleString()} out of ${parseInt(womenData.total_candidates || 0).toLocaleString()} candidates`;
+}
+
+// Seat changes
+function renderSeatChanges(seatChangeData) {
+    const topGainers = seatChangeData.changes.slice(0, 3).map(c => 
+        `<div>${c.party}: ${c.change > 0 ? '+' : ''}${c.change} seats</div>`
+    ).join('');
+    document.getElementById('seatChanges').innerHTML = 
+        `<div><strong>${seatChangeData.year1} → ${seatChangeData.year2}</strong></div>` + topGainers;
+}
+
+// Narrowest margins
+function renderNarrowMargins(marginData) {
+    const margins = marginData.slice(0, 5).map(m => 
+        `<div>${m.Constituency_Name}: ${parseFloat(m.Margin_Percentage || 0).toFixed(2)}%</div>`
+    ).join('');
+    document.getElementById('narrowMargins').innerHTML = margins;
+}
+
 function getRandomColor() {
     const colors = [
         'rgba(102, 126, 234, 0.8)',
@@ -0,0 +1,153 @@
+"""
+Typeahead Suggestions
+In-memory prefix index over distinct candidate, constituency and party names,
+built once from the database so that every keystroke can be answered without
+touching SQLite.
+"""
+
+import heapq
+import threading
+from bisect import bisect_left
+
+import partitions
+
+KINDS = {
+    'candidate': 'Candidate',
+    'constituency': 'Constituency_Name',
+    'party': 'Party',
+}
+
+# Prefixes up to this length match too many names to rank on the fly, so their
+# top matches are precomputed when the index is built.
+SHORT_PREFIX_LEN = 2
+MAX_LIMIT = 25
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('_', ' ').split())
+
+
+class SuggestIndex:
+    """Sorted prefix index over every word start of every distinct value"""
+
+    def __init__(self, entries):
+        # entries: list of (kind, value, count, last_year)
+        self.entries = entries
+        self.rank = {
+            'frequency': sorted(range(len(entries)), key=lambda i: (-entries[i][2], -entries[i][3], entries[i][1])),
+            'recency': sorted(range(len(entries)), key=lambda i: (-entries[i][3], -entries[i][2], entries[i][1])),
+        }
+        self.position = {
+            order: {entry_id: pos for pos, entry_id in enumerate(ids)}
+            for order, ids in self.rank.items()
+        }
+
+        keys = []
+        for entry_id, (kind, value, count, last_year) in enumerate(entries):
+            words = normalize(value).split(' ')
+            # Index every word start so that "gandhi" also finds "Rahul Gandhi"
+            for start in range(len(words)):
+                keys.append((' '.join(words[start:]), entry_id))
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.ids = [entry_id for _, entry_id in keys]
+
+        self.short = {order: {} for order in self.rank}
+        for order, ids in self.rank.items():
+            for entry_id in ids:
+                words = normalize(entries[entry_id][1]).split(' ')
+                prefixes = set()
+                for start in range(len(words)):
+                    tail = ' '.join(words[start:])
+                    for length in range(1, SHORT_PREFIX_LEN + 1):
+                        prefixes.add(tail[:length])
+                for prefix in prefixes:
+                    for key in ((None, prefix), (entries[entry_id][0], prefix)):
+                        bucket = self.short[order].setdefault(key, [])
+                        if len(bucket) < MAX_LIMIT:
+                            bucket.append(entry_id)
+
+    @classmethod
+    def from_connection(cls, conn, route=None):
+        # Names from the partitions of one election type (Lok Sabha by default)
+        source = (route or partitions.route()).source(conn)
+        entries = []
+        for kind, column in KINDS.items():
+            query = f"""
+            SELECT {column} as value, COUNT(*) as count, MAX(Year) as last_year
+            FROM {source}
+            WHERE Year >= 1991 AND Year <= 2019 AND {column} IS NOT NULL AND {column} != ''
+            GROUP BY {column}
+            """
+            for row in conn.execute(query).fetchall():
+                entries.append((kind, row[0], row[1], row[2]))
+        return cls(entries)
+
+    def _matching_ids(self, prefix, kind, order, limit):
+        if len(prefix) <= SHORT_PREFIX_LEN:
+            return self.short[order].get((kind, prefix), [])[:limit]
+
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo)
+        ids = set(self.ids[lo:hi])
+        if kind:
+            ids = [entry_id for entry_id in ids if self.entries[entry_id][0] == kind]
+        return heapq.nsmallest(limit, ids, key=self.position[order].__getitem__)
+
+    def suggest(self, q, kind=None, limit=10, order='frequency'):
+        prefix = normalize(q)
+        if not prefix:
+            return []
+
+        results = []
+        for entry_id in self._matching_ids(prefix, kind, order, min(limit, MAX_LIMIT)):
+            entry_kind, value, count, last_year = self.entries[entry_id]
+            results.append({
+                'value': value,
+                'kind': entry_kind,
+                'count': count,
+                'last_year': last_year
+            })
+        return results
+
+
+# (database snapshot version, election type) -> index
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def get_index(get_db_connection, election_type=None, version=None):
+    """Return the process-wide index of an election type in a database version,
+    building it on first use"""
+    key = (version, partitions.route(election_type).election_type)
+    index = _indexes.get(key)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(key)
+            if index is None:
+                conn = get_db_connection()
+                try:
+                    index = _indexes[key] = SuggestIndex.from_connection(conn, partitions.route(key[1]))
+                finally:
+                    conn.close()
+    return index
+
+
+def reload_index(get_db_connection, version=None):
+    """Build every election type's index built so far from a new database version
+    (or rebuild it) before it is served; one never built is built by the next request"""
+    for election_type in {key[1] for key in list(_indexes)}:
+        conn = get_db_connection()
+        try:
+            index = SuggestIndex.from_connection(conn, partitions.route(election_type))
+        finally:
+            conn.close()
+        with _index_lock:
+            _indexes[version, election_type] = index
+
+
+def release_index(version):
+    """Drop the indexes of a database version that is no longer served"""
+    with _index_lock:
+        for key in [key for key in _indexes if key[0] == version]:
+            del _indexes[key]
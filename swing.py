@@ -0,0 +1,482 @@
+"""
+Swing Simulator
+Answers "what if party X gains 3 points in state Y": applies vote-share swings
+by party, nationally or within a state or region, to every candidate's
+Vote_Share_Percentage in a base year and recomputes the winner of every
+constituency with one argmax over a (simulation, constituency, candidate)
+array.
+
+A uniform swing adds the same number of points to the party in every
+constituency in scope; a proportional swing scales its share there so that
+its overall share in the scope moves by that many points. The other
+candidates of a constituency give up (or gain) the difference in proportion
+to their shares, so each constituency's shares keep adding up to the same
+total.
+
+Only the swung parties' candidates and the strongest other candidate of each
+constituency can win once shares are rescaled this way, so a simulation
+works on those few columns instead of every candidate. In Monte Carlo mode
+each swing is drawn from a normal distribution (optionally varying by state)
+in every simulation, the simulations are run in batches across a process
+pool, and the seat counts are reported as intervals.
+
+The constituencies of a base year are read once per election type and
+grouping (parties, or the coalitions of coalitions.py) on first use and
+reread when the database changes.
+
+Usage:
+    python swing.py [--year YEAR] [--model uniform|proportional] [--simulations N]
+                    [--state-sd SD] [--workers N] [--seed N] [--db db_path] SWING [SWING ...]
+
+A SWING is PARTY:POINTS[~SD][@SCOPE], for example BJP:+3, INC:-2@Kerala,
+BSP:+1.5~1@north. SCOPE is a state or a region (north, south, east, west,
+central, northeast); SD is the standard deviation of the swing in Monte
+Carlo mode.
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import coalitions
+import dataset
+import encoding
+import partitions
+
+MODELS = ('uniform', 'proportional')
+
+REGIONS = {
+    'north': ['Chandigarh', 'Delhi', 'Haryana', 'Himachal_Pradesh', 'Jammu_&_Kashmir', 'Punjab',
+              'Rajasthan', 'Uttar_Pradesh', 'Uttarakhand'],
+    'central': ['Chhattisgarh', 'Madhya_Pradesh'],
+    'east': ['Andaman_&_Nicobar_Islands', 'Bihar', 'Jharkhand', 'Odisha', 'West_Bengal'],
+    'northeast': ['Arunachal_Pradesh', 'Assam', 'Manipur', 'Meghalaya', 'Mizoram', 'Nagaland',
+                  'Sikkim', 'Tripura'],
+    'west': ['Dadra_&_Nagar_Haveli', 'Daman_&_Diu', 'Goa', 'Gujarat', 'Maharashtra'],
+    'south': ['Andhra_Pradesh', 'Karnataka', 'Kerala', 'Lakshadweep', 'Puducherry', 'Tamil_Nadu',
+              'Telangana'],
+}
+
+MAX_SIMULATIONS = 100000
+
+# Simulations per array operation: (batch, constituencies, swung parties) stays a few MB
+BATCH = 1000
+
+# Processes running the Monte Carlo simulations of an API request
+WORKERS = int(os.environ.get('SWING_WORKERS', 1))
+
+
+class InvalidSwing(ValueError):
+    pass
+
+
+class Swing:
+    def __init__(self, party, points, sd=0.0, state=None, region=None):
+        self.party = party
+        self.points = points
+        self.sd = sd
+        self.state = state
+        self.region = region
+
+    @classmethod
+    def parse(cls, text):
+        """PARTY:POINTS[~SD][@SCOPE]; the scope is resolved against a year's states later"""
+        spec, _, scope = text.partition('@')
+        party, _, amount = spec.rpartition(':')
+        points, _, sd = amount.partition('~')
+        try:
+            points, sd = float(points), float(sd or 0)
+        except ValueError:
+            raise InvalidSwing(f"Invalid swing '{text}', expected PARTY:POINTS[~SD][@STATE or REGION]")
+        if not party.strip() or sd < 0:
+            raise InvalidSwing(f"Invalid swing '{text}', expected PARTY:POINTS[~SD][@STATE or REGION]")
+        scope = scope.strip()
+        if scope.lower() in REGIONS:
+            return cls(party.strip(), points, sd, region=scope.lower())
+        return cls(party.strip(), points, sd, state=scope.replace(' ', '_') or None)
+
+    def to_dict(self):
+        return {'party': self.party, 'points': self.points, 'sd': self.sd,
+                'state': self.state, 'region': self.region}
+
+
+class Plan:
+    """The arrays one set of swings is simulated on; small, so it is cheap to
+    send to worker processes"""
+
+    def __init__(self, n_parties, swung, best, total, count, other_best, other_party, contest_total,
+                 contest_state, n_states, slots, masks, weights, means, sds, model):
+        self.n_parties = n_parties
+        # (J,) party index of each swung party
+        self.swung = swung
+        # (C, J) strongest share, total share and candidates of each swung party per constituency
+        self.best = best
+        self.total = total
+        self.count = count
+        # (C,) strongest candidate of any other party, -inf and -1 if there is none
+        self.other_best = other_best
+        self.other_party = other_party
+        self.contest_total = contest_total
+        self.contest_state = contest_state
+        self.n_states = n_states
+        # Per swing: swung party column, (C,) scope mask, points to share change factor
+        self.slots = slots
+        self.masks = masks
+        self.weights = weights
+        self.means = means
+        self.sds = sds
+        self.model = model
+
+    def winners(self, points):
+        """(B, C) party index of every constituency's winner for (B, S) or
+        (B, S, states) swings in points"""
+        if points.ndim == 2:
+            points = points[:, :, None]
+        # (B, S, C) points applied to each constituency, 0 outside the swing's scope
+        applied = points[:, :, self.contest_state] if points.shape[2] > 1 else points
+        applied = applied * (self.weights[:, None] * self.masks)[None]
+        onehot = np.zeros((len(self.slots), len(self.swung)))
+        onehot[np.arange(len(self.slots)), self.slots] = 1
+        effect = np.einsum('bsc,sj->bcj', applied, onehot)
+
+        present = self.count > 0
+        if self.model == 'proportional':
+            best = self.best * (1 + effect)
+            total = self.total * (1 + effect)
+        else:
+            best = self.best + effect
+            total = self.total + self.count * effect
+        best = np.where(present, np.maximum(best, 0), -np.inf)
+        total = np.maximum(total, 0)
+
+        # The other candidates share what the swung parties gained or lost
+        rest = self.contest_total - self.total.sum(axis=1)
+        new_rest = np.maximum(self.contest_total - total.sum(axis=2), 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(rest > 0, new_rest / rest, 0)
+            other = np.where(self.other_party >= 0, self.other_best * scale, -np.inf)
+
+        slot = np.argmax(np.concatenate([best, other[:, :, None]], axis=2), axis=2)
+        if not len(self.swung):
+            return np.broadcast_to(self.other_party, slot.shape)
+        return np.where(slot < len(self.swung), self.swung[np.minimum(slot, len(self.swung) - 1)],
+                        self.other_party)
+
+    def seats(self, winners):
+        """(B, parties) seats won in each simulation"""
+        offsets = np.arange(len(winners))[:, None] * self.n_parties
+        return np.bincount((winners + offsets).ravel(),
+                           minlength=len(winners) * self.n_parties).reshape(len(winners), self.n_parties)
+
+    def sample(self, simulations, seed, state_sd=0.0):
+        """(simulations, parties) seat counts with swings drawn from their distributions"""
+        rng = np.random.default_rng(seed)
+        counts = np.empty((simulations, self.n_parties), dtype=np.int32)
+        for start in range(0, simulations, BATCH):
+            size = min(BATCH, simulations - start)
+            points = rng.normal(self.means, self.sds, size=(size, len(self.means)))
+            if state_sd:
+                points = points[:, :, None] + rng.normal(0, state_sd, size=(size, len(self.means), self.n_states))
+            counts[start:start + size] = self.seats(self.winners(points))
+        return counts
+
+
+def _sample(plan, simulations, seed, state_sd):
+    # Module-level, so that worker processes can run it
+    return plan.sample(simulations, seed, state_sd)
+
+
+class Contests:
+    """Candidates' vote shares in every constituency of one year"""
+
+    def __init__(self, year, states, names, parties, contest_state, row_contest, row_party, row_share, votes):
+        self.year = year
+        self.states = states
+        self.parties = parties
+        # (C,) state index and name of each constituency
+        self.contest_state = contest_state
+        self.names = names
+        # (R,) rows ordered by constituency, then by Position
+        self.row_contest = row_contest
+        self.row_party = row_party
+        self.row_share = row_share
+        # (C,) votes polled and sum of the candidates' shares
+        self.votes = votes
+        self.total = np.bincount(row_contest, weights=row_share, minlength=len(names))
+
+    @classmethod
+    def from_connection(cls, conn, route, year, group_by=None):
+        coded = encoding.coded(conn, route)
+        grouped = coalitions.grouped(conn, coded, group_by)
+        rows = conn.execute(f"""
+        SELECT {coded.label('State_Name')} as State_Name, Constituency_No, Poll_No, Constituency_Name,
+               {grouped.label} as Party, Vote_Share_Percentage, Votes
+        FROM {grouped}
+        WHERE Year = ? AND Vote_Share_Percentage IS NOT NULL
+        ORDER BY State_Name, Constituency_No, Poll_No, Position
+        """, (year,)).fetchall()
+        if not rows:
+            return None
+
+        state, number, poll, name, party, share, votes = zip(*rows)
+        states, state_index = np.unique(np.array(state, dtype=object), return_inverse=True)
+        parties, party_index = np.unique(np.array(party, dtype=object), return_inverse=True)
+        starts = dataset.run_starts(state_index, np.array(number, dtype=float), np.array(poll, dtype=float))
+        row_contest = np.cumsum(starts) - 1
+        first = np.flatnonzero(starts)
+        votes = np.bincount(row_contest, weights=np.nan_to_num(np.array(votes, dtype=np.float64)))
+        return cls(year, list(states), [name[i] for i in first], list(parties), state_index[first],
+                   row_contest, party_index, np.array(share, dtype=np.float64), votes)
+
+    def scope_mask(self, swing):
+        if swing.region is not None:
+            indices = [self.states.index(state) for state in REGIONS[swing.region] if state in self.states]
+            return np.isin(self.contest_state, indices)
+        if swing.state is not None:
+            if swing.state not in self.states:
+                raise InvalidSwing(f'Unknown state: {swing.state}')
+            return self.contest_state == self.states.index(swing.state)
+        return np.ones(len(self.names), dtype=bool)
+
+    def plan(self, swings, model='uniform'):
+        if model not in MODELS:
+            raise InvalidSwing(f"Unknown model '{model}', expected one of {list(MODELS)}")
+        for swing in swings:
+            if swing.party not in self.parties:
+                raise InvalidSwing(f'No {swing.party} candidates in {self.year}')
+
+        swung = np.array(sorted({self.parties.index(swing.party) for swing in swings}), dtype=np.int64)
+        n_contests = len(self.names)
+        slot_of = np.full(len(self.parties), -1)
+        slot_of[swung] = np.arange(len(swung))
+        row_slot = slot_of[self.row_party]
+
+        best = np.full((n_contests, len(swung)), -np.inf)
+        total = np.zeros((n_contests, len(swung)))
+        count = np.zeros((n_contests, len(swung)))
+        mine = row_slot >= 0
+        np.maximum.at(best, (self.row_contest[mine], row_slot[mine]), self.row_share[mine])
+        np.add.at(total, (self.row_contest[mine], row_slot[mine]), self.row_share[mine])
+        np.add.at(count, (self.row_contest[mine], row_slot[mine]), 1)
+
+        # Rows are in Position order, so the first maximum is the better placed candidate
+        other_best = np.full(n_contests, -np.inf)
+        np.maximum.at(other_best, self.row_contest[~mine], self.row_share[~mine])
+        other_party = np.full(n_contests, -1)
+        is_best = ~mine & (self.row_share == other_best[self.row_contest])
+        rows = np.flatnonzero(is_best)
+        contests, first = np.unique(self.row_contest[rows], return_index=True)
+        other_party[contests] = self.row_party[rows[first]]
+
+        masks = np.array([self.scope_mask(swing) for swing in swings], dtype=np.float64).reshape(len(swings), n_contests)
+        weights = np.ones(len(swings))
+        if model == 'proportional':
+            for i, swing in enumerate(swings):
+                # The party's share of all votes polled in the scope
+                slot = slot_of[self.parties.index(swing.party)]
+                scope_votes = (self.votes * masks[i]).sum()
+                share = (total[:, slot] * self.votes * masks[i]).sum() / scope_votes if scope_votes else 0
+                if not share:
+                    raise InvalidSwing(f'{swing.party} has no votes in the scope of a proportional swing')
+                weights[i] = 1 / share
+
+        return Plan(len(self.parties), swung, best, total, count, other_best, other_party, self.total,
+                    self.contest_state, len(self.states), slot_of[[self.parties.index(swing.party) for swing in swings]],
+                    masks, weights, np.array([swing.points for swing in swings], dtype=np.float64),
+                    np.array([swing.sd for swing in swings], dtype=np.float64), model)
+
+    def _base(self, plan):
+        base = plan.winners(np.zeros((1, len(plan.means))))[0]
+        return base, plan.seats(base[None])[0]
+
+    def simulate(self, swings, model='uniform'):
+        """Seats of every party and the constituencies changing hands"""
+        plan = self.plan(swings, model)
+        base, base_seats = self._base(plan)
+        winners = plan.winners(plan.means[None])[0]
+        seats = plan.seats(winners[None])[0]
+        parties = np.flatnonzero((base_seats > 0) | (seats > 0))
+        parties = parties[np.argsort(-seats[parties], kind='stable')]
+        return {
+            'year': self.year,
+            'model': model,
+            'swings': [swing.to_dict() for swing in swings],
+            'seats_total': len(self.names),
+            'majority': len(self.names) // 2 + 1,
+            'parties': [{
+                'party': self.parties[i],
+                'base_seats': int(base_seats[i]),
+                'seats': int(seats[i]),
+                'change': int(seats[i] - base_seats[i]),
+            } for i in parties],
+            'flips': [{
+                'state': self.states[self.contest_state[c]],
+                'constituency': self.names[c],
+                'from': self.parties[base[c]],
+                'to': self.parties[winners[c]],
+            } for c in np.flatnonzero(winners != base)],
+        }
+
+    def monte_carlo(self, swings, model='uniform', simulations=10000, seed=0, state_sd=0.0,
+                    interval=0.9, workers=1, pool=None):
+        """Seat count distribution of every party over simulations with randomly drawn swings"""
+        plan = self.plan(swings, model)
+        _, base_seats = self._base(plan)
+        seeds = np.random.SeedSequence(seed).spawn(max(workers, 1))
+        sizes = [len(part) for part in np.array_split(np.arange(simulations), len(seeds))]
+        if workers <= 1:
+            counts = plan.sample(simulations, seeds[0], state_sd)
+        elif pool is not None:
+            counts = np.concatenate(list(pool.map(_sample, [plan] * len(seeds), sizes, seeds, [state_sd] * len(seeds))))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as own_pool:
+                counts = np.concatenate(list(own_pool.map(_sample, [plan] * len(seeds), sizes, seeds, [state_sd] * len(seeds))))
+
+        majority = len(self.names) // 2 + 1
+        parties = np.flatnonzero((base_seats > 0) | (counts.max(axis=0) > 0))
+        mean = counts[:, parties].mean(axis=0)
+        low, median, high = np.percentile(counts[:, parties], [(1 - interval) * 50, 50, (1 + interval) * 50], axis=0)
+        order = np.argsort(-mean, kind='stable')
+        return {
+            'year': self.year,
+            'model': model,
+            'swings': [swing.to_dict() for swing in swings],
+            'simulations': simulations,
+            'seed': seed,
+            'state_sd': state_sd,
+            'interval': interval,
+            'seats_total': len(self.names),
+            'majority': majority,
+            'parties': [{
+                'party': self.parties[parties[i]],
+                'base_seats': int(base_seats[parties[i]]),
+                'mean': round(float(mean[i]), 2),
+                'median': float(median[i]),
+                'low': float(low[i]),
+                'high': float(high[i]),
+                'majority_probability': float((counts[:, parties[i]] >= majority).mean()),
+            } for i in order],
+        }
+
+
+# (database snapshot version, election type, grouping, year) -> Contests
+_contests = {}
+_contests_lock = threading.Lock()
+
+
+def get_contests(get_db_connection, election_type=None, year=None, group_by=None, version=None):
+    """Constituencies of a year (the latest by default) for an election type and
+    grouping in a database version, read on first use; None if that year has no results"""
+    key_type = partitions.route(election_type).election_type
+    grouping = coalitions.grouping(group_by)
+    if year is None:
+        conn = get_db_connection()
+        try:
+            year = conn.execute(f'SELECT MAX(Year) FROM {partitions.source(conn, key_type)} '
+                                'WHERE Year >= 1991 AND Year <= 2019').fetchone()[0]
+        finally:
+            conn.close()
+    key = (version, key_type, grouping, year)
+    if key not in _contests:
+        with _contests_lock:
+            if key not in _contests:
+                conn = get_db_connection()
+                try:
+                    _contests[key] = Contests.from_connection(conn, partitions.route(key_type, year), year, grouping)
+                finally:
+                    conn.close()
+    return _contests[key]
+
+
+def reload_contests(get_db_connection, version=None):
+    """Read every year read so far from a new database version (or reread them)
+    before it is served"""
+    for election_type, group_by, year in {key[1:] for key in list(_contests)}:
+        conn = get_db_connection()
+        try:
+            contests = Contests.from_connection(conn, partitions.route(election_type, year), year, group_by)
+        finally:
+            conn.close()
+        with _contests_lock:
+            _contests[version, election_type, group_by, year] = contests
+
+
+def release_contests(version):
+    """Drop the contests of a database version that is no longer served"""
+    with _contests_lock:
+        for key in [key for key in _contests if key[0] == version]:
+            del _contests[key]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process pool shared by the API's Monte Carlo requests, when SWING_WORKERS > 1"""
+    global _pool
+    if WORKERS <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS)
+    return _pool
+
+
+def print_result(result):
+    print(f"{result['year']} {result['model']} swing, {result['seats_total']} seats, "
+          f"majority {result['majority']}")
+    if 'simulations' in result:
+        percent = round(result['interval'] * 100)
+        print(f"{result['simulations']} simulations, {percent}% interval\n")
+        print(f"{'Party':<24} {'Base':>6} {'Mean':>8} {'Median':>7} {'Interval':>13} {'P(majority)':>12}")
+        for party in result['parties']:
+            interval = f"{party['low']:.0f}-{party['high']:.0f}"
+            print(f"{party['party']:<24} {party['base_seats']:>6} {party['mean']:>8.1f} {party['median']:>7.0f} "
+                  f"{interval:>13} {party['majority_probability']:>12.3f}")
+        return
+    print()
+    print(f"{'Party':<24} {'Base':>6} {'Seats':>6} {'Change':>7}")
+    for party in result['parties']:
+        print(f"{party['party']:<24} {party['base_seats']:>6} {party['seats']:>6} {party['change']:>+7}")
+    print(f"\n{len(result['flips'])} constituencies change hands")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate seat outcomes under vote-share swings.')
+    parser.add_argument('swings', nargs='+', metavar='SWING', help='PARTY:POINTS[~SD][@STATE or REGION]')
+    parser.add_argument('--db', default='election_data2.db')
+    parser.add_argument('--year', type=int, help='base year (default: the latest)')
+    parser.add_argument('--election-type', default=None)
+    parser.add_argument('--group-by', default='party', choices=coalitions.GROUPINGS)
+    parser.add_argument('--model', default='uniform', choices=MODELS)
+    parser.add_argument('--simulations', type=int, default=0, help='Monte Carlo simulations (default: none)')
+    parser.add_argument('--state-sd', type=float, default=0.0,
+                        help='standard deviation of each swing between states in Monte Carlo mode')
+    parser.add_argument('--interval', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes running the simulations (default: one per CPU)')
+    args = parser.parse_args()
+
+    try:
+        swings = [Swing.parse(text) for text in args.swings]
+        contests = get_contests(lambda: sqlite3.connect(args.db), args.election_type, args.year, args.group_by)
+        if contests is None:
+            parser.error(f'No results for {args.year}')
+        if args.simulations:
+            result = contests.monte_carlo(swings, args.model, args.simulations, args.seed, args.state_sd,
+                                          args.interval, args.workers)
+        else:
+            result = contests.simulate(swings, args.model)
+    except InvalidSwing as e:
+        parser.error(str(e))
+    print_result(result)
+
+
+if __name__ == '__main__':
+    main()
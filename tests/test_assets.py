@@ -0,0 +1,39 @@
+import shutil
+import subprocess
+
+import pytest
+
+import assets
+
+SOURCE = r"""
+const comment = /\/*/;  // a regex, then a comment
+const url = text.replace(/https?:\/\//g, '');
+const quote = value.split(/"/);
+const slash = path.match(/[/]+/);
+function clean(text) {
+    return /^\s*\/\//.test(text) ? '' : text;
+}
+const ratio = total / count / 2;
+let n = 0;
+n++ / 2;
+"""
+
+
+def test_regex_literals_survive():
+    minified = assets.minify_js(SOURCE)
+    for literal in [r'/\/*/', r'/https?:\/\//g', r'/"/', r'/[/]+/', r'/^\s*\/\//']:
+        assert literal in minified
+    assert 'a regex, then a comment' not in minified
+    assert 'const ratio = total / count / 2;' in minified
+    assert "return /^\\s*\\/\\//.test(text) ? '' : text;" in minified
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_minified_sources_parse(tmp_path):
+    with open(f'{assets.STATIC_DIR}/dashboard.js', encoding='utf-8') as f:
+        dashboard = f.read()
+    # Parsed only, so the undefined names do not matter
+    for name, source in [('sample.js', SOURCE), ('dashboard.js', dashboard)]:
+        path = tmp_path / name
+        path.write_text(assets.minify_js(source), encoding='utf-8')
+        subprocess.run(['node', '--check', str(path)], check=True)
@@ -0,0 +1,53 @@
+import importlib
+import os
+import sqlite3
+
+import pytest
+
+SCHEMA = """CREATE TABLE election_results (State_Name TEXT, Assembly_No INTEGER, Constituency_No INTEGER,
+Year INTEGER, month REAL, Poll_No INTEGER, DelimID INTEGER, Position INTEGER, Candidate TEXT, Sex TEXT,
+Party TEXT, Votes REAL, Valid_Votes INTEGER, Electors REAL, Constituency_Name TEXT, Constituency_Type TEXT,
+N_Cand INTEGER, Turnout_Percentage REAL, Vote_Share_Percentage REAL, Deposit_Lost TEXT, Margin REAL,
+Margin_Percentage REAL, ENOP REAL, pid TEXT, Party_Type_TCPD TEXT, Party_ID REAL, last_poll INTEGER,
+Contested REAL, No_Terms REAL, Turncoat INTEGER, Incumbent INTEGER, Recontest INTEGER, Election_Type TEXT)"""
+
+# The query /api/search ran before the results were partitioned or encoded
+BASELINE = ("SELECT * FROM election_results WHERE Year >= 1991 AND Year <= 2019 AND Candidate LIKE ? "
+            "ORDER BY Year DESC, Position LIMIT 100")
+
+
+@pytest.fixture(scope='module')
+def db_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('search') / 'election_data2.db')
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    # 150 candidates tied on (Year, Position), stored in the reverse of their
+    # natural key order, so the 100 returned depend on how ties are broken
+    rows = [(f'State_{n % 7}', 200 - n, 2004, 5.0, 0, 1, f'Ram {n}', 'M', f'P{n % 5}', 'Lok Sabha Election (GE)')
+            for n in range(150)]
+    conn.executemany("""INSERT INTO election_results (State_Name, Constituency_No, Year, month, Poll_No,
+                        Position, Candidate, Sex, Party, Election_Type) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                     rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.mark.parametrize('module_name', ['app', 'api.index'])
+def test_plain_layout_matches_baseline(db_path, module_name, monkeypatch):
+    monkeypatch.setenv('DATASETS', f'default={db_path}:warm=false')
+    module = importlib.import_module(module_name)
+    module = importlib.reload(module)
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    baseline = [dict(row) for row in conn.execute(BASELINE, ('%Ram%',))]
+    natural = [dict(row) for row in conn.execute(BASELINE.replace(
+        'Position LIMIT', 'Position, State_Name, Constituency_No, month, Poll_No LIMIT'), ('%Ram%',))]
+    conn.close()
+    assert len(baseline) == 100
+    assert baseline != natural
+
+    response = module.app.test_client().get('/api/search?candidate=Ram', buffered=True)
+    assert response.status_code == 200
+    assert response.get_json() == baseline
@@ -0,0 +1,468 @@
+"""
+Request Tracing
+Records nested spans for the phases of each sampled request: the request
+itself, opening SQLite connections, every query from execute to its last
+fetched row, dict(row) conversion and jsonify, with the route, parameters,
+row counts and bytes as attributes. Each finished request is exported as one
+line of OTLP/JSON (the OpenTelemetry protocol's JSON encoding, as written by
+the collector's file exporter) to a local file or the console, so no
+collector has to run.
+
+TRACE_EXPORT turns tracing on: 'console' for standard output, or the path of
+a JSON-lines file. TRACE_SAMPLE_RATE (default 1.0) is the fraction of
+requests traced; a request with a W3C traceparent header follows its caller's
+sampling decision and joins its trace.
+
+Usage:
+    python tracing.py summary traces.jsonl   # time per phase of each route
+"""
+
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'election-dashboard')
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# OTLP status codes
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_local = threading.local()
+
+
+def current():
+    """Trace of the request being served on this thread, if it is sampled"""
+    return getattr(_local, 'trace', None)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        # int64 is a string in OTLP/JSON
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class Span:
+    def __init__(self, trace, name, kind, parent_id, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        if self.end is None:
+            self.end = time.time_ns()
+            if error is not None:
+                self.error = f'{type(error).__name__}: {error}'
+
+    def __enter__(self):
+        self.trace.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.stack.pop()
+        self.finish(exc)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            'status': {'code': STATUS_UNSET},
+        }
+        if self.error:
+            span['status'] = {'code': STATUS_ERROR, 'message': self.error}
+        return span
+
+
+class Trace:
+    """Spans of one request; the innermost open span is the parent of new ones"""
+
+    def __init__(self, trace_id, parent_id, root_attributes):
+        self.trace_id = trace_id
+        # Trace of an enclosing request on the same thread, restored when this one ends
+        self.previous = None
+        self.exported = False
+        self.spans = []
+        self.stack = []
+        self.root = self.start_span('request', SERVER, root_attributes, parent_id=parent_id)
+        self.stack.append(self.root)
+
+    def start_span(self, name, kind=INTERNAL, attributes=None, parent_id=None):
+        """Started span that does not become the parent of later spans"""
+        if parent_id is None and self.stack:
+            parent_id = self.stack[-1].span_id
+        span = Span(self, name, kind, parent_id, attributes)
+        self.spans.append(span)
+        return span
+
+    def span(self, name, attributes=None, kind=INTERNAL):
+        """Span that is the parent of the spans started inside its with block"""
+        return self.start_span(name, kind, attributes)
+
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.stack[-1].span_id}-01'
+
+
+class _NoSpan:
+    """Stands in for spans of requests that are not sampled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **attributes):
+    """Nested span of the current request, or a no-op outside sampled requests"""
+    trace = current()
+    if trace is None:
+        return _NO_SPAN
+    return trace.span(name, attributes)
+
+
+def propagation_headers():
+    """traceparent header that makes a sub-request part of the current trace"""
+    trace = current()
+    return {'traceparent': trace.traceparent()} if trace is not None else {}
+
+
+def records(rows):
+    """[dict(row) for row in rows], traced as its own phase"""
+    trace = current()
+    if trace is None:
+        return [dict(row) for row in rows]
+    with trace.span('rows.to_dict') as s:
+        result = [dict(row) for row in rows]
+        s.set('db.rows', len(result))
+    return result
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Times each statement from execute to its last fetched row"""
+
+    _span = None
+    _rows = 0
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        trace = current()
+        if trace is not None:
+            self._span = trace.start_span('sqlite.query', CLIENT, {
+                'db.system': 'sqlite',
+                'db.statement': ' '.join(sql.split()),
+            })
+            self._rows = 0
+        try:
+            return super().execute(sql, parameters)
+        except BaseException as e:
+            self._finish(e)
+            raise
+
+    def _finish(self, error=None):
+        if self._span is not None:
+            self._span.set('db.rows', self._rows)
+            self._span.finish(error)
+            self._span = None
+
+    def _fetch(self, fetch, *args):
+        try:
+            result = fetch(*args)
+        except BaseException as e:
+            self._finish(e)
+            raise
+        return result
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self._finish()
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+def connect(database):
+    """sqlite3.connect, with the connection and its queries traced if the
+    current request is sampled"""
+    trace = current()
+    if trace is None:
+        return sqlite3.connect(database)
+    with trace.span('sqlite.connect', {'db.system': 'sqlite', 'db.name': database}, CLIENT):
+        return sqlite3.connect(database, factory=TracedConnection)
+
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with jsonify traced; the output is unchanged"""
+
+    def response(self, *args, **kwargs):
+        trace = current()
+        if trace is None:
+            return super().response(*args, **kwargs)
+        with trace.span('flask.jsonify') as s:
+            response = super().response(*args, **kwargs)
+            s.set('http.response.body.size', response.content_length)
+        return response
+
+
+class ConsoleExporter:
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+
+    def export(self, line):
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, line):
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+def exporter_from_env():
+    target = os.environ.get('TRACE_EXPORT', '')
+    if not target:
+        return None
+    if target == 'console':
+        return ConsoleExporter()
+    return FileExporter(target)
+
+
+class _TracedBody:
+    """Response body that counts the bytes sent and ends the trace after the
+    last chunk (or when closed early), so streamed responses are traced until
+    their end"""
+
+    def __init__(self, body, tracer, trace):
+        self.body = body
+        self.tracer = tracer
+        self.trace = trace
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.trace.root.attributes['http.response.body.size'] += len(chunk)
+            yield chunk
+        self.tracer.finish(self.trace)
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.tracer.finish(self.trace)
+
+
+class Tracer:
+    def __init__(self, exporter=None, sample_rate=None):
+        self.exporter = exporter_from_env() if exporter is None else exporter
+        self.sample_rate = (float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+                            if sample_rate is None else sample_rate)
+        self.exported = 0
+
+    def begin(self, environ):
+        """Trace for a request, or None if it is not sampled"""
+        parent = TRACEPARENT.match(environ.get('HTTP_TRACEPARENT', ''))
+        if parent:
+            if not int(parent.group(3), 16) & 1:
+                return None
+            trace_id, parent_id = parent.group(1), parent.group(2)
+        else:
+            if random.random() >= self.sample_rate:
+                return None
+            trace_id, parent_id = '%032x' % random.getrandbits(128), None
+        return Trace(trace_id, parent_id, {
+            'http.request.method': environ.get('REQUEST_METHOD'),
+            'url.path': environ.get('PATH_INFO'),
+            'url.query': environ.get('QUERY_STRING') or None,
+            'http.response.body.size': 0,
+        })
+
+    def finish(self, trace):
+        if trace.exported:
+            return
+        trace.exported = True
+        if current() is trace:
+            _local.trace = trace.previous
+        root = trace.root
+        root.name = f"{root.attributes['http.request.method']} {root.attributes.get('http.route') or root.attributes['url.path']}"
+        for open_span in trace.spans:
+            # Cursors that were never read to the end
+            open_span.finish()
+        self.exporter.export(json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', SERVICE_NAME)]},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [s.to_otlp() for s in trace.spans],
+            }],
+        }]}, separators=(',', ':')))
+        self.exported += 1
+
+    def middleware(self, wsgi_app):
+        def traced_app(environ, start_response):
+            trace = self.begin(environ)
+            if trace is None:
+                return wsgi_app(environ, start_response)
+            trace.previous, _local.trace = current(), trace
+
+            def traced_start_response(status, headers, exc_info=None):
+                code = int(status.split(' ', 1)[0])
+                trace.root.set('http.response.status_code', code)
+                if code >= 500:
+                    trace.root.error = status
+                for name, value in headers:
+                    if name.lower() == 'x-cache':
+                        trace.root.set('cache.hit', value == 'HIT')
+                return start_response(status, headers, exc_info)
+
+            try:
+                body = wsgi_app(environ, traced_start_response)
+            except BaseException as e:
+                trace.root.finish(e)
+                self.finish(trace)
+                raise
+            return _TracedBody(body, self, trace)
+
+        return traced_app
+
+
+def install(app, tracer):
+    """Trace requests from the WSGI entry to the last byte of the response"""
+    if tracer.exporter is None:
+        return tracer
+    app.wsgi_app = tracer.middleware(app.wsgi_app)
+    app.json = TracedJSONProvider(app)
+
+    @app.after_request
+    def annotate_request(response):
+        trace = current()
+        if trace is not None:
+            trace.root.set('http.route', request.url_rule.rule if request.url_rule else None)
+            for name, value in request.args.items():
+                trace.root.set(f'http.request.query.{name}', value)
+        return response
+
+    return tracer
+
+
+def summary(path):
+    """Median and maximum milliseconds of each span name per route"""
+    durations = defaultdict(lambda: defaultdict(list))
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            for resource in json.loads(line)['resourceSpans']:
+                for scope in resource['scopeSpans']:
+                    spans = scope['spans']
+                    route = next((s['name'] for s in spans if s['kind'] == SERVER), '?')
+                    for s in spans:
+                        name = 'request' if s['kind'] == SERVER else s['name']
+                        ms = (int(s['endTimeUnixNano']) - int(s['startTimeUnixNano'])) / 1e6
+                        durations[route][name].append(ms)
+    return durations
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != 'summary':
+        print(__doc__)
+        sys.exit(1)
+    durations = summary(sys.argv[2])
+    print(f"{'Route / phase':<50} {'Count':>7} {'p50 ms':>9} {'Max ms':>9}")
+    print('-' * 78)
+    for route in sorted(durations):
+        phases = durations[route]
+        for name in ['request'] + sorted(name for name in phases if name != 'request'):
+            if name not in phases:
+                continue
+            values = phases[name]
+            label = route if name == 'request' else f'  {name}'
+            print(f'{label:<50} {len(values):>7} {statistics.median(values):>9.2f} {max(values):>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
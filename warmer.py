@@ -0,0 +1,146 @@
+"""
+Cache Warmer
+Precomputes every response the dashboard can request (each endpoint for all
+years and for every year from /api/filters/years) in a background thread at
+startup, then watches the database file and recomputes the cached responses
+whenever its mtime or size changes, so users never hit a cold path.
+"""
+
+import logging
+import threading
+import time
+from urllib.parse import urlencode
+
+import snapshots
+from cache import BYPASS, PIN
+
+logger = logging.getLogger(__name__)
+
+# Endpoints the dashboard requests once per page view
+STATIC_URLS = [
+    '/api/filters/years',
+    '/api/filters/states',
+    '/api/filters/parties',
+    '/api/gender-representation',
+    '/api/analytics/national-vs-regional',
+    '/api/analytics/highest-turnout-state',
+    '/api/analytics/women-percentage',
+    '/api/analytics/seat-change',
+    '/api/analytics/narrowest-margins?limit=5',
+]
+
+# Endpoints the dashboard requests again whenever the year filter changes
+YEAR_URLS = [
+    '/api/party-seat-share',
+    '/api/state-turnout',
+    '/api/top-parties-vote-share?limit=10',
+    '/api/margin-distribution',
+]
+
+
+def with_year(url, year):
+    return f"{url}{'&' if '?' in url else '?'}year={year}"
+
+
+class CacheWarmer:
+    def __init__(self, app, cache, snapshot_manager, interval=5.0, on_change=None, environ=None, dashboard=True):
+        self.app = app
+        self.cache = cache
+        self.snapshots = snapshot_manager
+        self.interval = interval
+        # Callbacks(version) building the in-memory structures derived from a
+        # new database version, called with that version pinned
+        self.on_change = list(on_change or [])
+        # Set on every request, e.g. to read one dataset of several
+        self.environ = dict(environ or {})
+        # Whether the dashboard's responses are precomputed, or only the
+        # responses already cached are recomputed for a new version
+        self.dashboard = dashboard
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.last_warm = None
+
+    def fetch(self, client, url, pin=True, snapshot=None):
+        # Bypass the cache so the view recomputes and the fresh body replaces the
+        # entry; the dashboard's own responses are pinned so they are never evicted.
+        # Buffered, as streamed bodies are only cached once they have been read
+        environ = {**self.environ, BYPASS: True, PIN: pin}
+        if snapshot is not None:
+            # Computed from (and cached for) a version that is not served yet
+            environ[snapshots.ENVIRON] = snapshot
+        return client.get(url, buffered=True, environ_base=environ)
+
+    def urls(self, client, snapshot=None):
+        response = self.fetch(client, '/api/filters/years', snapshot=snapshot)
+        years = response.get_json() if response.status_code == 200 else []
+        urls = list(STATIC_URLS)
+        for url in YEAR_URLS:
+            urls.append(url)
+            urls.extend(with_year(url, year) for year in years)
+        return urls
+
+    def warm(self, extra_urls=(), snapshot=None):
+        """Recompute every dashboard response plus any other currently cached URLs"""
+        start = time.perf_counter()
+        client = self.app.test_client()
+        pinned = self.urls(client, snapshot) if self.dashboard else []
+        seen = set(pinned)
+        urls = [(url, True) for url in pinned] + [(url, False) for url in extra_urls if url not in seen]
+
+        failures = 0
+        for url, pin in urls:
+            if self.stop_event.is_set():
+                break
+            try:
+                if self.fetch(client, url, pin, snapshot).status_code != 200:
+                    failures += 1
+            except Exception:
+                logger.exception("Cache warmer failed on %s", url)
+                failures += 1
+
+        self.last_warm = {
+            'urls': len(urls),
+            'failures': failures,
+            'seconds': time.perf_counter() - start,
+            'finished_at': time.time(),
+        }
+        logger.info("Warmed %d responses in %.2fs (%d failures)",
+                    len(urls), self.last_warm['seconds'], failures)
+
+    def cached_urls(self):
+        """URLs cached for the version being served"""
+        version = self.snapshots.current.version
+        urls = []
+        for path, args, key_version in self.cache.keys():
+            if key_version == version:
+                urls.append(f'{path}?{urlencode(args)}' if args else path)
+        return urls
+
+    def prepare(self, snapshot):
+        """Build everything a new version serves, while the previous one is still current"""
+        logger.info("Database version %s published, preparing it", snapshot.version)
+        with snapshots.pin(snapshot):
+            for callback in self.on_change:
+                callback(snapshot.version)
+        self.warm(self.cached_urls(), snapshot)
+
+    def run(self):
+        self.warm(snapshot=self.snapshots.current)
+        while not self.stop_event.wait(self.interval):
+            try:
+                snapshot = self.snapshots.switch(self.prepare)
+            except Exception:
+                # Retried on the next poll; requests keep the current version
+                logger.exception("Cache warmer failed to switch database versions")
+                continue
+            if snapshot is not None:
+                logger.info("Serving database version %s", snapshot.version)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='cache-warmer', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()